@@ -0,0 +1,259 @@
+import argparse
+import json
+import logging
+import time
+
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+from sklearn.decomposition import TruncatedSVD
+
+from scoring import score_recipes, top_n_indices
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_COMPONENTS = 128
+DEFAULT_PROBES = 8
+DEFAULT_SAMPLE_SIZE = 100000
+DEFAULT_MAX_FEATURES = 50000
+
+
+def normalize_rows(embedded):
+    norms = np.linalg.norm(embedded, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return embedded / norms
+
+
+class IvfIndex:
+    """Approximate candidate generation for catalogs too big to score exactly.
+
+    Recipes are embedded with a TruncatedSVD of the TF-IDF matrix and grouped
+    into ``n_clusters`` inverted lists by their nearest k-means centroid. A
+    query scores the centroids only, takes the recipes of the ``probes`` best
+    lists and scores those exactly against the TF-IDF matrix. More probes
+    trade latency for recall; probing every list is exact. The embedding only
+    uses the ``max_features`` most frequent terms, which keeps the SVD within
+    memory when bigrams push the vocabulary past a million terms.
+    """
+
+    def __init__(self, features, projection, centroids, list_offsets, list_rows, probes=DEFAULT_PROBES):
+        self.features = features  # Sorted columns of the terms used by the embedding
+        self.projection = projection  # Transposed SVD components, one row per used term
+        self.centroids = centroids  # Normalised cluster centres in the embedding
+        self.list_offsets = list_offsets  # Recipes of list c are list_rows[offsets[c]:offsets[c + 1]]
+        self.list_rows = list_rows
+        self.probes = probes
+
+    @property
+    def n_clusters(self):
+        return len(self.centroids)
+
+    def embed(self, vectors):
+        """Project TF-IDF rows onto the SVD components and L2-normalise them"""
+        return normalize_rows(self._project(vectors, self.features, self.projection))
+
+    @staticmethod
+    def _project(vectors, features, projection):
+        if vectors.shape[0] == 1:
+            # Only the rows of the user's terms are read, not the whole projection
+            positions = np.minimum(np.searchsorted(features, vectors.indices), len(features) - 1)
+            used = features[positions] == vectors.indices
+            return (vectors.data[used].astype(np.float32) @ projection[positions[used]])[np.newaxis]
+        return np.asarray(vectors[:, features] @ projection, dtype=np.float32)
+
+    @classmethod
+    def build(cls, recipe_vectors, n_components=DEFAULT_COMPONENTS, n_clusters=None,
+              probes=DEFAULT_PROBES, sample_size=DEFAULT_SAMPLE_SIZE, max_features=DEFAULT_MAX_FEATURES,
+              chunk_size=50000, random_state=0):
+        """Fit the embedding and clusters on a sample, then file every recipe.
+
+        Only the sample is ever embedded at once; the rest is assigned in
+        chunks, so memory stays flat however big the catalog is.
+        """
+        n_recipes, n_features = recipe_vectors.shape
+        n_clusters = n_clusters or max(1, int(np.sqrt(n_recipes)))
+        rng = np.random.default_rng(random_state)
+        sample = np.arange(n_recipes)
+        if n_recipes > sample_size:
+            sample = np.sort(rng.choice(n_recipes, sample_size, replace=False))
+        document_frequency = np.bincount(recipe_vectors.indices, minlength=n_features)
+        features = np.sort(np.argsort(-document_frequency, kind='stable')[:max_features])
+        sample_vectors = recipe_vectors[sample][:, features]
+
+        n_components = max(1, min(n_components, len(features) - 1, len(sample) - 1))
+        svd = TruncatedSVD(n_components, random_state=random_state).fit(sample_vectors)
+        # Term-major, so projecting a query reads one row per term
+        projection = np.ascontiguousarray(svd.components_.T, dtype=np.float32)
+
+        n_clusters = min(n_clusters, len(sample))
+        kmeans = MiniBatchKMeans(n_clusters, random_state=random_state, batch_size=4096, n_init=3)
+        kmeans.fit(normalize_rows(np.asarray(sample_vectors @ projection, dtype=np.float32)))
+        centroids = normalize_rows(kmeans.cluster_centers_.astype(np.float32))
+
+        assignments = np.empty(n_recipes, dtype=np.int64)
+        for start in range(0, n_recipes, chunk_size):
+            chunk = normalize_rows(cls._project(recipe_vectors[start:start + chunk_size], features, projection))
+            assignments[start:start + chunk_size] = np.argmax(chunk @ centroids.T, axis=1)
+
+        list_offsets, list_rows = cls._lists(assignments, n_clusters)
+        logger.info(
+            f"Built ANN index: {n_components} components over {len(features)} terms, "
+            f"{n_clusters} lists over {n_recipes} recipes"
+        )
+        return cls(features, projection, centroids, list_offsets, list_rows, probes)
+
+    @staticmethod
+    def _lists(assignments, n_clusters):
+        # Rows grouped by list, in catalog order within each list
+        list_rows = np.argsort(assignments, kind='stable')
+        list_offsets = np.zeros(n_clusters + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=n_clusters), out=list_offsets[1:])
+        return list_offsets, list_rows
+
+    def extended(self, recipe_vectors, start):
+        """Copy of the index with the rows from ``start`` on filed into their nearest lists.
+
+        The embedding and centroids are kept as they are, so recipes added
+        this way are only as well placed as the terms the embedding knows.
+        """
+        assignments = np.empty(recipe_vectors.shape[0], dtype=np.int64)
+        assignments[self.list_rows] = np.repeat(np.arange(self.n_clusters), np.diff(self.list_offsets))
+        if recipe_vectors.shape[0] > start:
+            added = normalize_rows(self._project(recipe_vectors[start:], self.features, self.projection))
+            assignments[start:] = np.argmax(added @ self.centroids.T, axis=1)
+        list_offsets, list_rows = self._lists(assignments, self.n_clusters)
+        return type(self)(self.features, self.projection, self.centroids, list_offsets, list_rows, self.probes)
+
+    def candidates(self, user_vector, n, probes=None):
+        """Return the sorted rows of the lists closest to the user vector.
+
+        Takes at least ``probes`` lists, and more if they hold fewer than n
+        recipes between them.
+        """
+        probes = probes or self.probes
+        query = self.embed(user_vector)[0]
+        order = np.argsort(-(self.centroids @ query), kind='stable')
+        covered = np.cumsum(np.diff(self.list_offsets)[order])
+        count = max(probes, int(np.searchsorted(covered, n)) + 1)
+        rows = [self.list_rows[self.list_offsets[c]:self.list_offsets[c + 1]] for c in order[:count]]
+        return np.sort(np.concatenate(rows))
+
+    def top_n(self, recipe_vectors, user_vector, n, probes=None, excluded=None):
+        """Return (rows, scores, candidates visited) of the n best probed recipes, best first"""
+        rows = self.candidates(user_vector, n, probes)
+        if excluded is not None:
+            rows = rows[~excluded[rows]]
+        scores = score_recipes(recipe_vectors[rows], user_vector)
+        best = top_n_indices(scores, n)
+        return rows[best], scores[best], len(rows)
+
+
+def recall_at_n(exact_scores, approximate_scores, n):
+    """Share of the n approximate results that belong in the exact top n.
+
+    A result counts when its exact score reaches the exact n-th best score, so
+    swapping recipes that tie with it is not counted as a miss.
+    """
+    if len(exact_scores) == 0:
+        return 1.0
+    threshold = exact_scores[min(n, len(exact_scores)) - 1]
+    hits = np.count_nonzero(approximate_scores >= threshold - 1e-12)
+    return min(hits, len(exact_scores)) / len(exact_scores)
+
+
+def evaluate(recommender, query_texts, n=10, probes_options=(1, 2, 4, 8, 16, 32), ann_index=None):
+    """Compare the ANN engine with exact scoring over a set of user queries.
+
+    Returns the exact engine's latency and, for each number of probes, the
+    mean recall@n, latency percentiles and candidates scored per query.
+    """
+    recommender.finalize()
+    ann_index = ann_index or recommender.ann_index or IvfIndex.build(recommender.recipe_vectors)
+    recipe_vectors = recommender.recipe_vectors
+    user_vectors = recommender.vectorizer.transform(query_texts)
+    queries = [user_vectors[row] for row in range(user_vectors.shape[0]) if user_vectors[row].nnz]
+
+    exact = []
+    exact_times = []
+    for user_vector in queries:
+        started = time.perf_counter()
+        rows, scores, _ = recommender.inverted_index.top_n(user_vector, n)
+        exact_times.append(time.perf_counter() - started)
+        exact.append(scores)
+
+    def summary(times):
+        times = np.asarray(times) * 1000
+        return {'p50_ms': float(np.percentile(times, 50)), 'p99_ms': float(np.percentile(times, 99))}
+
+    report = {
+        'recipes': recipe_vectors.shape[0],
+        'queries': len(queries),
+        'n': n,
+        'lists': ann_index.n_clusters,
+        'components': ann_index.projection.shape[1],
+        'exact': summary(exact_times),
+        'ann': []
+    }
+    for probes in probes_options:
+        recalls = []
+        times = []
+        visited = []
+        for user_vector, exact_scores in zip(queries, exact):
+            started = time.perf_counter()
+            rows, _, count = ann_index.top_n(recipe_vectors, user_vector, n, probes)
+            times.append(time.perf_counter() - started)
+            visited.append(count)
+            # Judge the returned rows by their exact score
+            approximate_scores = score_recipes(recipe_vectors[rows], user_vector)
+            recalls.append(recall_at_n(exact_scores, approximate_scores, n))
+        report['ann'].append({
+            'probes': probes,
+            f'recall@{n}': float(np.mean(recalls)),
+            'candidates': float(np.mean(visited)),
+            **summary(times)
+        })
+    return report
+
+
+def sample_queries(recommender, count, ingredients_per_query=5, random_state=0):
+    """Pseudo-users built from the ingredient words of random catalog recipes"""
+    rng = np.random.default_rng(random_state)
+    queries = []
+    for row in rng.choice(len(recommender.recipes), count):
+        words = recommender._recipe_record(row)['ingredients'].split()
+        size = min(len(words), ingredients_per_query)
+        queries.append(' '.join(rng.choice(words, size, replace=False)))
+    return queries
+
+
+if __name__ == '__main__':
+    # Offline recall@n of the ANN engine against exact scoring
+    from recommender import RecipeRecommender
+    from ingest import ingest_recipes, iter_jsonl_batches
+    from log_config import configure_logging
+
+    parser = argparse.ArgumentParser(description='Measure ANN recall@n against exact scoring')
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--snapshot', help='snapshot directory to evaluate')
+    source.add_argument('--jsonl', help='JSONL file with one recipe document per line')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--n', type=int, default=10)
+    parser.add_argument('--probes', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument('--components', type=int, default=DEFAULT_COMPONENTS)
+    parser.add_argument('--lists', type=int, default=None, help='number of inverted lists, sqrt(recipes) by default')
+    args = parser.parse_args()
+
+    configure_logging('production', log_file='')
+    recommender = RecipeRecommender(cache_size=0)
+    if args.snapshot:
+        if not recommender.load_snapshot(args.snapshot):
+            parser.error(f'no usable snapshot at {args.snapshot}')
+    else:
+        ingest_recipes(recommender, iter_jsonl_batches(args.jsonl))
+        recommender.finalize()
+
+    started = time.perf_counter()
+    index = IvfIndex.build(recommender.recipe_vectors, n_components=args.components, n_clusters=args.lists)
+    build_seconds = time.perf_counter() - started
+    report = evaluate(recommender, sample_queries(recommender, args.queries), args.n, args.probes, index)
+    report['build_seconds'] = build_seconds
+    print(json.dumps(report, indent=2))
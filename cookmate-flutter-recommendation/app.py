@@ -1,29 +1,41 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, Response, stream_with_context
 from flask_cors import CORS
 from recommender import RecipeRecommender
 from pymongo import MongoClient
 from bson import ObjectId
 import os
+import base64
+import hashlib
+import json
 import logging
 import sys
 from dotenv import load_dotenv
 import threading
 import time
-
-# Set up logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler('app.log')
-    ]
-)
-logger = logging.getLogger(__name__)
+from urllib.parse import urlencode
+import multiprocessing
+from snapshot import catalog_fingerprint, read_manifest
+from prefork import PreforkServer
+from ingest import ingest_recipes, iter_mongo_batches, DEFAULT_BATCH_SIZE, INDEXABLE_QUERY
+from log_config import configure_logging, should_log_request, log_request
+from recipe_store import RECIPE_FIELDS
+from catalog_sync import CatalogSync
+from user_store import UserGenerations, create_user_store
+from user_profile import ProfileLimits
+from popularity import PopularityRanking
+from metrics import PipelineMetrics, CONTENT_TYPE as METRICS_CONTENT_TYPE, start_profile, stop_profile, server_timing
+from readiness import LoadProgress
+from facets import RecipeFilters
+from serving import BoundedExecutor, Overloaded, serve
+import atexit
 
 # Load environment variables
 load_dotenv()
 
+# Set up logging: LOG_PROFILE is debug, default or production
+configure_logging()
+logger = logging.getLogger(__name__)
+
 try:
     logger.info("Initializing Flask application...")
     app = Flask(__name__)
@@ -33,31 +45,167 @@ try:
         r"/api/*": {
             "origins": "*",
             "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-            "allow_headers": ["Content-Type"]
+            "allow_headers": ["Content-Type", "X-Profile"],
+            "expose_headers": ["Server-Timing"]
         }
     })
 
+    # Recommendation cache: max cached (user, n) results and their lifetime in seconds
+    CACHE_SIZE = int(os.getenv('RECOMMENDATION_CACHE_SIZE', '10000'))
+    CACHE_TTL = float(os.getenv('RECOMMENDATION_CACHE_TTL', '300'))
+
+    # 'exact' or 'ann'; ANN_PROBES trades latency for recall in ANN mode
+    SCORING_ENGINE = os.getenv('SCORING_ENGINE', 'exact')
+    ANN_PROBES = int(os.getenv('ANN_PROBES', '8'))
+    ANN_MIN_RECIPES = int(os.getenv('ANN_MIN_RECIPES', '100000'))
+    # Default and largest page of GET /api/recipes; format=ndjson streams without a cap
+    RECIPES_PAGE_SIZE = int(os.getenv('RECIPES_PAGE_SIZE', '100'))
+    RECIPES_MAX_PAGE_SIZE = int(os.getenv('RECIPES_MAX_PAGE_SIZE', '1000'))
+    # Similar recipes precomputed per recipe when the index is built (0 scores them
+    # per request), and the processes computing them (unset means one per CPU)
+    SIMILAR_K = int(os.getenv('SIMILAR_K', '20'))
+    SIMILAR_WORKERS = int(os.environ['SIMILAR_WORKERS']) if os.getenv('SIMILAR_WORKERS') else None
+    # How ingredient terms become matrix columns: 'vocabulary' (every word and word pair),
+    # 'pruned' (word pairs only once MIN_BIGRAM_DF recipes use them) or 'hashing'
+    # (HASH_FEATURES hashed columns, no vocabulary kept at all)
+    FEATURE_MODE = os.getenv('FEATURE_MODE', 'vocabulary')
+    MIN_BIGRAM_DF = int(os.getenv('MIN_BIGRAM_DF', '2'))
+    HASH_FEATURES = int(os.getenv('HASH_FEATURES', str(2 ** 20)))
+
+    def fetch_instructions(recipe_ids):
+        """Look up the instructions of a few recipes; the recommender keeps none in memory"""
+        object_ids = [ObjectId(recipe_id) if ObjectId.is_valid(recipe_id) else recipe_id for recipe_id in recipe_ids]
+        cursor = get_db().recipes.find({'_id': {'$in': object_ids}}, {'Instructions': 1})
+        return {str(doc['_id']): doc.get('Instructions') or '' for doc in cursor}
+
+    # More than one worker serves from a pre-forked pool sharing one mapped snapshot
+    WORKERS = int(os.getenv('WORKERS', '1'))
+    
+    # Where tracked ingredients live: 'memory' (this process only) or 'sqlite'
+    # (USER_STORE_PATH, kept across restarts and shared by workers). Tracking is
+    # committed USER_STORE_BATCH_SIZE users or USER_STORE_FLUSH_INTERVAL seconds
+    # at a time, and up to USER_STORE_CACHE_USERS users are cached in memory.
+    # Ingredient weights halve every PROFILE_HALF_LIFE_DAYS days (0 keeps them),
+    # and a profile keeps its PROFILE_MAX_INGREDIENTS heaviest ingredients and
+    # PROFILE_MAX_SEEN most recent recipes, which EXCLUDE_SEEN_RECIPES leaves out.
+    # Each user's change stamp sits in shared memory with several workers, so
+    # a profile tracked by one drops what the others cached from it.
+    EXCLUDE_SEEN_RECIPES = os.getenv('EXCLUDE_SEEN_RECIPES', '1') != '0'
+    user_store = create_user_store(
+        os.getenv('USER_STORE', 'memory'),
+        os.getenv('USER_STORE_PATH', 'user_preferences.db'),
+        limits=ProfileLimits(
+            half_life=float(os.getenv('PROFILE_HALF_LIFE_DAYS', '30')) * 24 * 3600,
+            max_ingredients=int(os.getenv('PROFILE_MAX_INGREDIENTS', '50')),
+            max_seen=int(os.getenv('PROFILE_MAX_SEEN', '200'))
+        ),
+        cache_users=int(os.getenv('USER_STORE_CACHE_USERS', '100000')),
+        batch_size=int(os.getenv('USER_STORE_BATCH_SIZE', '1000')),
+        flush_interval=float(os.getenv('USER_STORE_FLUSH_INTERVAL', '0.5')),
+        generations=UserGenerations(shared=WORKERS > 1)
+    )
+    # Commit queued tracking on a clean exit
+    atexit.register(user_store.close)
+    
+    # Users without a usable profile get the POPULAR_SIZE most tracked recipes, with
+    # tracking counts halving every POPULAR_HALF_LIFE_HOURS hours and the list
+    # re-ranked every POPULAR_REFRESH_INTERVAL seconds. Every process starts its
+    # counts from the recipes the user store remembers being tracked.
+    popularity = PopularityRanking(
+        half_life=float(os.getenv('POPULAR_HALF_LIFE_HOURS', '24')) * 3600,
+        refresh_interval=float(os.getenv('POPULAR_REFRESH_INTERVAL', '60')),
+        top_size=int(os.getenv('POPULAR_SIZE', '100')),
+        seed=user_store.tracked_recipes
+    )
+
+    # Recommendations are scored on SCORING_THREADS threads per process (default one
+    # per CPU, 0 scores on the request thread) with at most SCORING_QUEUE_DEPTH more
+    # requests waiting for one; past that they are turned away with 429
+    SCORING_THREADS = int(os.getenv('SCORING_THREADS', str(os.cpu_count() or 1)))
+    SCORING_QUEUE_DEPTH = int(os.getenv('SCORING_QUEUE_DEPTH', str(max(SCORING_THREADS, 1))))
+    scoring_pool = BoundedExecutor(SCORING_THREADS, SCORING_QUEUE_DEPTH)
+    # 'development' is Flask's server, a thread per request (FLASK_DEBUG=1 for the
+    # debugger); 'production' is waitress with SERVER_THREADS threads per process, by
+    # default 8 more than scoring can hold so tracking is never starved, and at most
+    # SERVER_CONNECTION_LIMIT open connections
+    SERVER_MODE = os.getenv('SERVER_MODE', 'development')
+    SERVER_THREADS = int(os.getenv('SERVER_THREADS', str(SCORING_THREADS + SCORING_QUEUE_DEPTH + 8)))
+    SERVER_CONNECTION_LIMIT = int(os.getenv('SERVER_CONNECTION_LIMIT', '100'))
+    FLASK_DEBUG = os.getenv('FLASK_DEBUG') == '1'
+    
+    # Stage latency histograms served at /metrics (METRICS_ENABLED=0 turns the timers
+    # off). With several workers they sit in shared memory, one slot per process: 0
+    # for the server process, which builds snapshots, and 1 + worker_slot for workers.
+    # REQUEST_PROFILING lets a request send X-Profile: 1 to get its own stage timings
+    # back in a Server-Timing header.
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') != '0'
+    REQUEST_PROFILING = os.getenv('REQUEST_PROFILING', '1') != '0'
+    metrics = PipelineMetrics(slots=WORKERS + 2, shared=WORKERS > 1, enabled=METRICS_ENABLED)
+
+    def create_recommender():
+        return RecipeRecommender(
+            instructions_loader=fetch_instructions, user_store=user_store, exclude_seen=EXCLUDE_SEEN_RECIPES,
+            popularity=popularity, metrics=metrics,
+            cache_size=CACHE_SIZE, cache_ttl=CACHE_TTL,
+            engine=SCORING_ENGINE, ann_probes=ANN_PROBES, ann_min_recipes=ANN_MIN_RECIPES,
+            similar_k=SIMILAR_K, similar_workers=SIMILAR_WORKERS,
+            feature_mode=FEATURE_MODE, min_bigram_df=MIN_BIGRAM_DF, hash_features=HASH_FEATURES
+        )
+
     # Initialize recommender
     logger.info("Initializing recipe recommender...")
-    recommender = RecipeRecommender()
+    recommender = create_recommender()
 
     # MongoDB connection
     MONGO_URL = os.getenv('MONGO_URL', 'mongodb://localhost:27017')
     DB_NAME = os.getenv('DB_NAME', 'cookmate')
+    SNAPSHOT_DIR = os.getenv('SNAPSHOT_DIR', 'snapshot')
+    INGEST_BATCH_SIZE = int(os.getenv('INGEST_BATCH_SIZE', str(DEFAULT_BATCH_SIZE)))
+    # Tokenizer processes used while loading recipes; unset means one per spare CPU, 0 runs inline
+    INGEST_WORKERS = int(os.environ['INGEST_WORKERS']) if os.getenv('INGEST_WORKERS') else None
+    # Seconds between incremental syncs with MongoDB (0 disables them), the share of
+    # tombstoned or stale rows that triggers a compaction, seconds between full id
+    # comparisons when polling, and an optional last-modified field to poll for updates
+    SYNC_INTERVAL = float(os.getenv('SYNC_INTERVAL', '60'))
+    SYNC_COMPACT_RATIO = float(os.getenv('SYNC_COMPACT_RATIO', '0.2'))
+    SYNC_RECONCILE_INTERVAL = float(os.getenv('SYNC_RECONCILE_INTERVAL', '600'))
+    SYNC_UPDATED_FIELD = os.getenv('SYNC_UPDATED_FIELD') or None
+    # The server answers before the index is loaded; MongoDB is retried every
+    # LOAD_RETRY_INTERVAL seconds until it answers, which is also the Retry-After
+    # of 503s sent while loading when no better estimate is known
+    LOAD_RETRY_INTERVAL = float(os.getenv('LOAD_RETRY_INTERVAL', '10'))
+    load_progress = LoadProgress(retry_after=max(1, round(LOAD_RETRY_INTERVAL)))
+    catalog_sync = None  # Set once the background sync is running
+    refresh_lock = threading.Lock()  # One full rebuild at a time when sync is off
+    index_load_started = False  # Set by create_app
+    
+    # One pooled client per process, made on first use and kept: MongoClient is not
+    # fork-safe, so forked workers and snapshot builds each make their own.
+    # MONGO_MAX_POOL_SIZE caps its connections.
+    MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', '100'))
+    mongo_client = None
+    mongo_client_pid = None
+    mongo_client_lock = threading.Lock()
 
     def get_db():
-        try:
-            logger.info(f"Connecting to MongoDB at {MONGO_URL}")
-            client = MongoClient(MONGO_URL, serverSelectionTimeoutMS=5000)  # 5 second timeout
-            db = client[DB_NAME]
-            # Test the connection
-            db.command('ping')
-            logger.info("Successfully connected to MongoDB")
-            return db
-        except Exception as e:
-            logger.error(f"Failed to connect to MongoDB: {str(e)}")
-            logger.error("Please ensure MongoDB is running and accessible")
-            raise
+        global mongo_client, mongo_client_pid
+        if mongo_client_pid != os.getpid():
+            with mongo_client_lock:
+                if mongo_client_pid != os.getpid():
+                    logger.info(f"Connecting to MongoDB at {MONGO_URL}")
+                    client = MongoClient(MONGO_URL, serverSelectionTimeoutMS=5000,  # 5 second timeout
+                                         maxPoolSize=MONGO_MAX_POOL_SIZE)
+                    try:
+                        # Test the connection once; later calls reuse the pool
+                        client.admin.command('ping')
+                    except Exception as e:
+                        client.close()
+                        logger.error(f"Failed to connect to MongoDB: {str(e)}")
+                        logger.error("Please ensure MongoDB is running and accessible")
+                        raise
+                    logger.info("Successfully connected to MongoDB")
+                    mongo_client, mongo_client_pid = client, os.getpid()
+        return mongo_client[DB_NAME]
 
     def process_ingredients(ingredients):
         """Process ingredients list into a format suitable for TF-IDF"""
@@ -69,109 +217,388 @@ try:
             return ' '.join(ingredient.strip().lower() for ingredient in ingredients.split(','))
         return ''
 
-    def fetch_recipes_from_mongodb():
+    def fetch_recipes_from_mongodb(target=None):
         """Fetch recipes from MongoDB and add them to the recommender"""
+        target = target or recommender
         try:
             logger.info("Fetching recipes from MongoDB...")
+            load_progress.begin('connecting')
             db = get_db()
             
-            # Count total recipes first
-            total_recipes = db.recipes.count_documents({})
-            logger.info(f"Found {total_recipes} recipes in database")
-            
-            recipes = db.recipes.find(
-                {},
-                {
-                    '_id': 1,
-                    'Title': 1,
-                    'Cleaned_Ingredients': 1,
-                    'Instructions': 1,
-                    'image': 1
-                }
-            )
-            
-            recipe_count = 0
-            for recipe in recipes:
-                try:
-                    recipe_count += 1
-                    if recipe_count % 100 == 0:
-                        logger.info(f"Processed {recipe_count}/{total_recipes} recipes")
-                    
-                    # Process ingredients to ensure they're in the correct format
-                    ingredients = recipe.get('Cleaned_Ingredients', [])
-                    if isinstance(ingredients, str):
-                        ingredients = [ingredients]
-                    elif not isinstance(ingredients, list):
-                        ingredients = []
-                    
-                    if not ingredients:
-                        logger.warning(f"Recipe {recipe.get('_id')} has no ingredients")
-                        continue
-                    
-                    recommender.add_recipe(
-                        recipe_id=str(recipe['_id']),
-                        name=recipe.get('Title', ''),
-                        ingredients=ingredients,
-                        instructions=recipe.get('Instructions', '')
-                    )
-                
-                except Exception as e:
-                    logger.error(f"Error processing recipe {recipe.get('_id')}: {str(e)}")
+            # Stream the collection in batches; cleaning and tokenizing run in a process pool
+            load_progress.begin('indexing', expected=db.recipes.estimated_document_count())
+            with metrics.timed('index', 'ingest'):
+                stats = ingest_recipes(
+                    target,
+                    iter_mongo_batches(db.recipes, INGEST_BATCH_SIZE),
+                    workers=INGEST_WORKERS,
+                    progress=load_progress.advance
+                )
+            recipe_count = stats['indexed']
             
-            # Process any remaining recipes in the last batch
-            recommender._process_batch()
+            # Process any remaining recipes in the last batch and weight the index
+            load_progress.begin('weighting')
+            target.finalize()
             logger.info(f"Successfully loaded all {recipe_count} recipes")
             
-            # Start Flask server only after all recipes are loaded
-            logger.info("All recipes loaded, starting Flask server...")
-            start_flask_server()
+            # Similar recipes go into the snapshot with the index
+            load_progress.begin('neighbours')
+            target.build_neighbors()
+            
+            # Save a snapshot so the next start can skip this reload
+            load_progress.begin('saving')
+            target.save_snapshot(SNAPSHOT_DIR)
             
             return True
         except Exception as e:
             logger.error(f"Error fetching recipes from MongoDB: {str(e)}")
             logger.error("Please check your MongoDB connection and database setup")
+            load_progress.fail(e)
             return False
 
+    def fetch_catalog_fingerprint():
+        """Fingerprint of the ids of the recipes in MongoDB that would be indexed.
+        
+        Recipes without ingredients are left out, as they are of the index
+        and so of the snapshot's fingerprint; otherwise one of them would
+        make every snapshot look stale.
+        """
+        db = get_db()
+        recipe_ids = [str(doc['_id']) for doc in db.recipes.find(INDEXABLE_QUERY, {'_id': 1})]
+        return catalog_fingerprint(recipe_ids)
+
+    def use_index(fresh, source):
+        """Serve from a freshly loaded index; requests in flight finish on the old one"""
+        global recommender
+        recommender = fresh
+        load_progress.mark_ready(source, fresh.get_recipe_count())
+    
+    def check_snapshot_freshness():
+        """Reload from MongoDB in the background if the snapshot is out of date"""
+        try:
+            logger.info("Checking snapshot freshness against MongoDB...")
+            if fetch_catalog_fingerprint() == recommender.catalog_fingerprint:
+                logger.info("Snapshot is up to date")
+                return
+            
+            logger.info("Snapshot is stale, rebuilding the index from MongoDB...")
+            fresh = create_recommender()
+            if fetch_recipes_from_mongodb(fresh):
+                # Tracked users stay in the shared store
+                use_index(fresh, 'mongodb')
+                logger.info("Swapped in the rebuilt index")
+        except Exception as e:
+            logger.error(f"Error checking snapshot freshness: {str(e)}")
+    
+    def rebuild_in_background():
+        """Rebuild the whole index from MongoDB off the request thread, then swap it in"""
+        try:
+            fresh = create_recommender()
+            if fetch_recipes_from_mongodb(fresh):
+                use_index(fresh, 'mongodb')
+                logger.info("Swapped in the rebuilt index")
+        except Exception as e:
+            logger.error(f"Error rebuilding the index: {str(e)}")
+        finally:
+            refresh_lock.release()
+    
+    def swap_recommender(fresh):
+        """Serve from a compacted index and save it as the new snapshot"""
+        global recommender
+        # Requests in flight finish on the old index
+        recommender = fresh
+        logger.info("Swapped in the compacted index")
+        fresh.save_snapshot(SNAPSHOT_DIR)
+    
+    def start_catalog_sync():
+        """Follow MongoDB changes in the background, patching the index in place"""
+        global catalog_sync
+        catalog_sync = CatalogSync(
+            get_db().recipes, lambda: recommender, swap_recommender,
+            interval=SYNC_INTERVAL, compact_ratio=SYNC_COMPACT_RATIO,
+            reconcile_interval=SYNC_RECONCILE_INTERVAL, updated_field=SYNC_UPDATED_FIELD
+        ).start()
+    
+    def load_index():
+        """Load the index behind a server that is already answering.
+        
+        A usable snapshot is served first. Without one the index is built
+        from MongoDB, retried every LOAD_RETRY_INTERVAL seconds while it is
+        unreachable; so is starting the catalog sync, whose first round then
+        brings the snapshot up to date.
+        """
+        load_progress.begin('snapshot')
+        fresh = create_recommender()
+        if fresh.load_snapshot(SNAPSHOT_DIR):
+            use_index(fresh, 'snapshot')
+            if SYNC_INTERVAL <= 0:
+                check_snapshot_freshness()
+        else:
+            # A refresh asked for meanwhile would only repeat this load
+            with refresh_lock:
+                while True:
+                    fresh = create_recommender()
+                    if fetch_recipes_from_mongodb(fresh):
+                        use_index(fresh, 'mongodb')
+                        break
+                    logger.warning(f"Retrying the recipe load in {LOAD_RETRY_INTERVAL:g}s")
+                    time.sleep(LOAD_RETRY_INTERVAL)
+        
+        while SYNC_INTERVAL > 0:
+            try:
+                start_catalog_sync()
+                return
+            except Exception as e:
+                logger.error(f"Error starting the catalog sync, retrying in {LOAD_RETRY_INTERVAL:g}s: {str(e)}")
+                time.sleep(LOAD_RETRY_INTERVAL)
+    
+    def _build_snapshot_process():
+        sys.exit(0 if fetch_recipes_from_mongodb(create_recommender()) else 1)
+
+    def build_snapshot():
+        """Rebuild the snapshot from MongoDB in a child process.
+        
+        Keeps the full in-memory index out of the pre-fork parent, so workers
+        forked from it stay small.
+        """
+        process = multiprocessing.get_context('fork').Process(target=_build_snapshot_process)
+        process.start()
+        process.join()
+        return process.exitcode == 0
+
+    def shared_snapshot_usable():
+        """Whether workers can map the snapshot: it exists and has the configured features"""
+        manifest = read_manifest(SNAPSHOT_DIR)
+        return manifest is not None and (
+            manifest.get('features', {'mode': 'vocabulary'}) == recommender.feature_signature()
+        )
+    
+    def check_shared_snapshot_freshness(server):
+        """Rebuild a missing or stale shared snapshot, then restart the workers onto it"""
+        try:
+            logger.info("Checking shared snapshot freshness against MongoDB...")
+            manifest = read_manifest(SNAPSHOT_DIR)
+            if shared_snapshot_usable() and fetch_catalog_fingerprint() == manifest['fingerprint']:
+                logger.info("Snapshot is up to date")
+                return
+            
+            logger.info("Snapshot is missing or stale, rebuilding it from MongoDB...")
+            if build_snapshot():
+                server.reload()
+        except Exception as e:
+            logger.error(f"Error checking snapshot freshness: {str(e)}")
+    
+    def watch_shared_snapshot(server):
+        """Check the shared snapshot now and, with sync on, every SYNC_RECONCILE_INTERVAL seconds.
+        
+        Workers map one read-only snapshot, so they cannot be patched in
+        place; a changed catalog means a rebuilt snapshot and a rolling reload.
+        While there is no snapshot workers can use, MongoDB is retried every
+        LOAD_RETRY_INTERVAL seconds instead.
+        """
+        while True:
+            check_shared_snapshot_freshness(server)
+            if not shared_snapshot_usable():
+                time.sleep(LOAD_RETRY_INTERVAL)
+                continue
+            if SYNC_INTERVAL <= 0:
+                return
+            time.sleep(SYNC_RECONCILE_INTERVAL)
+
+    def load_shared_snapshot():
+        """Map the snapshot read-only in a freshly forked worker.
+        
+        Without a usable snapshot the worker still serves, answering 503 to
+        recommendations until the server process has built one and reloaded
+        the workers onto it.
+        """
+        load_progress.begin('snapshot')
+        if recommender.load_snapshot(SNAPSHOT_DIR, shared=True):
+            load_progress.mark_ready('snapshot', recommender.get_recipe_count())
+        else:
+            logger.warning(f"No usable snapshot at {SNAPSHOT_DIR} yet, waiting for the server process to build it")
+            load_progress.begin('waiting_for_snapshot')
+    
+    def start_worker(server):
+        # Slot 0 is the server process's; workers take the ones after it
+        metrics.use_slot(server.worker_slot + 1)
+        load_shared_snapshot()
+
+    def start_prefork_server():
+        """Serve from WORKERS processes that share one memory-mapped index"""
+        server = PreforkServer(
+            app, '0.0.0.0', 5002, WORKERS,
+            on_worker_start=lambda: start_worker(server), on_worker_exit=user_store.close,
+            serve=lambda sock, stop: serve(app, '0.0.0.0', 5002, SERVER_MODE, threads=SERVER_THREADS,
+                                           connection_limit=SERVER_CONNECTION_LIMIT, sock=sock, stop=stop)
+        )
+        threading.Thread(target=watch_shared_snapshot, args=(server,), daemon=True).start()
+        logger.info(f"Server will be available at http://localhost:5002 with {WORKERS} workers")
+        server.serve_forever()
+
+    def create_app():
+        """The app, with its index loading in the background, for WSGI servers and ASGI adapters.
+        
+        Serve it from one process with threads, e.g. ``waitress-serve --call
+        app:create_app``: each process calling this loads and syncs its own
+        index. ``WORKERS`` spreads one shared snapshot over several processes.
+        """
+        global index_load_started
+        if not index_load_started:
+            index_load_started = True
+            threading.Thread(target=load_index, name='index-load', daemon=True).start()
+        return app
+
     def start_flask_server():
-        """Start the Flask server"""
+        """Start the server in SERVER_MODE"""
         try:
-            logger.info("Starting Flask server...")
+            logger.info(f"Starting Flask server ({SERVER_MODE})...")
             logger.info("Server will be available at http://localhost:5002")
             
             print("\n" + "="*50)
             print("Flask server starting...")
             print("="*50 + "\n")
             
-            app.run(
-                debug=True,
-                host='0.0.0.0',
-                port=5002,
-                use_reloader=False,
-                threaded=True
-            )
+            if SERVER_MODE == 'development':
+                app.run(
+                    debug=FLASK_DEBUG,
+                    host='0.0.0.0',
+                    port=5002,
+                    use_reloader=False,
+                    threaded=True
+                )
+            else:
+                serve(app, '0.0.0.0', 5002, SERVER_MODE, threads=SERVER_THREADS,
+                      connection_limit=SERVER_CONNECTION_LIMIT)
         except Exception as e:
             logger.error(f"Failed to start Flask server: {str(e)}")
             print(f"\nError starting server: {str(e)}")
             raise
 
+    @app.before_request
+    def start_request_record():
+        # Sampling is decided first, so unsampled requests build no record at all
+        g.log_request = should_log_request()
+        if g.log_request:
+            g.request_started = time.perf_counter()
+            g.log_fields = {}
+        if REQUEST_PROFILING and request.headers.get('X-Profile') == '1':
+            g.profile_started = time.perf_counter()
+            g.profile, g.profile_token = start_profile()
+
+    @app.after_request
+    def finish_request_record(response):
+        if g.get('log_request'):
+            log_request(
+                method=request.method,
+                path=request.path,
+                endpoint=request.endpoint,
+                status=response.status_code,
+                duration_ms=round((time.perf_counter() - g.request_started) * 1000, 3),
+                **g.log_fields
+            )
+        if g.get('profile') is not None:
+            stop_profile(g.profile_token)
+            # Stages of every pipeline this request ran, then the whole request
+            timings = server_timing(g.profile)
+            total = f'request;dur={(time.perf_counter() - g.profile_started) * 1000:.3f}'
+            response.headers['Server-Timing'] = f'{timings}, {total}' if timings else total
+        return response
+
+    # Endpoints that need the index; until a first one is loaded they answer 503
+    INDEX_ENDPOINTS = {'get_recommendations', 'get_recommendations_batch', 'get_all_recipes', 'get_similar_recipes'}
+
+    def index_loading_response():
+        response = jsonify({'error': 'The recipe index is still loading', 'status': load_progress.status()})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(load_progress.retry_after())
+        return response
+
+    @app.before_request
+    def require_index():
+        # CORS preflights never reach the index
+        if not load_progress.ready and request.endpoint in INDEX_ENDPOINTS and request.method != 'OPTIONS':
+            return index_loading_response()
+
+    def overloaded_response():
+        response = jsonify({'error': 'Too many recommendation requests in progress, try again shortly'})
+        response.status_code = 429
+        response.headers['Retry-After'] = '1'
+        return response
+
+    def note_request(**fields):
+        """Add fields to this request's structured log record, if it gets one"""
+        if g.get('log_request'):
+            g.log_fields.update(fields)
+
+    def query_list(name):
+        """Values of a repeatable, comma-separated query argument"""
+        return [value.strip() for arg in request.args.getlist(name) for value in arg.split(',') if value.strip()]
+
+    def body_filters(data):
+        """RecipeFilters from a JSON ``filters`` object, or None if it is malformed"""
+        filters = data.get('filters') or {}
+        if not isinstance(filters, dict):
+            return None
+        fields = {}
+        for field in ('include', 'exclude', 'exclude_ids'):
+            values = filters.get(field, [])
+            if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+                return None
+            fields[field] = values
+        return RecipeFilters(**fields)
+
     @app.route('/api/recommendations/<user_id>', methods=['GET'])
     def get_recommendations(user_id):
         """Get recipe recommendations for a user"""
         try:
-            logger.info(f"Getting recommendations for user {user_id}")
-            recommendations = recommender.get_recommendations(user_id)
+            filters = RecipeFilters(query_list('include'), query_list('exclude'), query_list('exclude_ids'))
+            note_request(user_id=user_id, filtered=bool(filters))
+            recommendations = scoring_pool.run(recommender.get_recommendations, user_id, filters=filters)
             return jsonify(recommendations)
+        except Overloaded:
+            return overloaded_response()
         except Exception as e:
             logger.error(f"Error getting recommendations: {str(e)}")
             return jsonify({'error': str(e)}), 500
 
+    @app.route('/api/recommendations/batch', methods=['POST'])
+    def get_recommendations_batch():
+        """Get recipe recommendations for many users in one request"""
+        try:
+            data = request.get_json(silent=True)
+            if not isinstance(data, dict):
+                data = {}
+            user_ids = data.get('user_ids')
+            n = data.get('n', 5)
+            
+            if not isinstance(user_ids, list) or not user_ids:
+                return jsonify({'error': 'user_ids must be a non-empty list'}), 400
+            # JSON true and false come in as bool, which is an int too
+            if isinstance(n, bool) or not isinstance(n, int) or n < 1:
+                return jsonify({'error': 'n must be a positive integer'}), 400
+            filters = body_filters(data)
+            if filters is None:
+                return jsonify({'error': 'filters must hold include, exclude and exclude_ids as lists of strings'}), 400
+            
+            note_request(users=len(user_ids), n=n, filtered=bool(filters))
+            results = scoring_pool.run(
+                recommender.get_recommendations_batch, [str(user_id) for user_id in user_ids], n, filters=filters
+            )
+            return jsonify({'results': results})
+        except Overloaded:
+            return overloaded_response()
+        except Exception as e:
+            logger.error(f"Error getting batch recommendations: {str(e)}")
+            return jsonify({'error': str(e)}), 500
+
     @app.route('/api/track', methods=['POST'])
     def track_user_behavior():
         """Track user behavior and ingredient preferences"""
         try:
-            logger.info("Received tracking request")
             data = request.get_json()
-            logger.debug(f"Request data: {data}")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Request data: {data}")
             
             user_id = data.get('user_id')
             recipe_id = data.get('recipe_id')
@@ -181,12 +608,12 @@ try:
                 logger.warning("Missing required fields in request")
                 return jsonify({'error': 'Missing required fields'}), 400
                 
-            logger.info(f"Tracking behavior for user {user_id}")
-            logger.debug(f"Recipe ID: {recipe_id}")
-            logger.debug(f"Ingredients used: {ingredients_used}")
+            note_request(user_id=user_id, recipe_id=recipe_id, ingredients=len(ingredients_used))
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Recipe ID: {recipe_id}")
+                logger.debug(f"Ingredients used: {ingredients_used}")
             
             recommender.track_user_behavior(user_id, recipe_id, ingredients_used)
-            logger.info("Successfully tracked user behavior")
             return jsonify({'message': 'Behavior tracked successfully'})
         except Exception as e:
             logger.error(f"Error tracking behavior: {str(e)}")
@@ -195,45 +622,199 @@ try:
             logger.error(f"Traceback: {traceback.format_exc()}")
             return jsonify({'error': str(e)}), 500
 
+    def encode_cursor(version, offset):
+        return base64.urlsafe_b64encode(f'{version}:{offset}'.encode()).decode().rstrip('=')
+
+    def decode_cursor(cursor):
+        """Return (index version, offset) of a cursor, or None if it is malformed"""
+        try:
+            padded = cursor + '=' * (-len(cursor) % 4)
+            version, offset = base64.urlsafe_b64decode(padded.encode()).decode().rsplit(':', 1)
+            return version, int(offset)
+        except (ValueError, UnicodeDecodeError):
+            return None
+
     @app.route('/api/recipes', methods=['GET'])
     def get_all_recipes():
-        """Get all recipes in the system"""
+        """List recipes a page at a time, or stream them all as NDJSON.
+        
+        Query parameters: limit, offset or cursor (from X-Next-Cursor), fields
+        (comma-separated subset of id, name, ingredients, instructions) and
+        format=ndjson. The ETag follows the index version, so an unchanged
+        catalog answers If-None-Match with 304 before anything is serialized.
+        """
         try:
-            logger.info("Getting all recipes")
-            recipes = recommender.get_all_recipes()
-            return jsonify(recipes)
+            current = recommender  # Keep one index for the whole response, even if it is swapped
+            fields = RECIPE_FIELDS
+            if request.args.get('fields'):
+                fields = tuple(dict.fromkeys(
+                    field.strip() for field in request.args['fields'].split(',') if field.strip()
+                ))
+                unknown = [field for field in fields if field not in RECIPE_FIELDS]
+                if unknown or not fields:
+                    return jsonify({'error': f"fields must be a subset of {', '.join(RECIPE_FIELDS)}"}), 400
+            
+            stream = (request.args.get('format') == 'ndjson'
+                      or request.accept_mimetypes.best == 'application/x-ndjson')
+            version = current.get_index_version()
+            
+            default_limit = None if stream else RECIPES_PAGE_SIZE
+            try:
+                offset = int(request.args.get('offset', 0))
+                limit = int(request.args['limit']) if 'limit' in request.args else default_limit
+            except ValueError:
+                return jsonify({'error': 'offset and limit must be integers'}), 400
+            if request.args.get('cursor'):
+                decoded = decode_cursor(request.args['cursor'])
+                if decoded is None:
+                    return jsonify({'error': 'Invalid cursor'}), 400
+                cursor_version, offset = decoded
+                if cursor_version != version:
+                    return jsonify({'error': 'Cursor expired, the catalog changed; start again'}), 410
+            if offset < 0 or (limit is not None and limit < 1):
+                return jsonify({'error': 'offset must be >= 0 and limit >= 1'}), 400
+            if not stream:
+                limit = min(limit, RECIPES_MAX_PAGE_SIZE)
+            
+            representation = json.dumps([offset, limit, fields, stream])
+            etag = f'{version}-{hashlib.sha1(representation.encode()).hexdigest()[:12]}'
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+                response.set_etag(etag)
+                return response
+            
+            total = current.get_recipe_count()
+            if stream:
+                def generate():
+                    for chunk in current.iter_recipes(offset, limit, fields):
+                        yield ''.join(json.dumps(record) + '\n' for record in chunk)
+                response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+            else:
+                response = jsonify(current.get_recipes_page(offset, limit, fields))
+                next_offset = offset + limit
+                if next_offset < total:
+                    next_cursor = encode_cursor(version, next_offset)
+                    response.headers['X-Next-Cursor'] = next_cursor
+                    params = request.args.to_dict()
+                    params.pop('offset', None)
+                    params.update(cursor=next_cursor, limit=limit)
+                    response.headers['Link'] = f'<{request.base_url}?{urlencode(params)}>; rel="next"'
+            response.headers['X-Total-Count'] = str(total)
+            response.headers['Cache-Control'] = 'no-cache'
+            response.set_etag(etag)
+            note_request(offset=offset, limit=limit, stream=stream)
+            return response
         except Exception as e:
             logger.error(f"Error getting recipes: {str(e)}")
             return jsonify({'error': str(e)}), 500
 
+    @app.route('/api/recipes/<recipe_id>/similar', methods=['GET'])
+    def get_similar_recipes(recipe_id):
+        """Recipes most like one recipe, for "more like this" views"""
+        try:
+            note_request(recipe_id=recipe_id)
+            try:
+                n = int(request.args.get('n', 10))
+            except ValueError:
+                return jsonify({'error': 'n must be an integer'}), 400
+            if n < 1:
+                return jsonify({'error': 'n must be positive'}), 400
+            if SIMILAR_K > 0:
+                n = min(n, SIMILAR_K)
+            
+            similar = scoring_pool.run(recommender.get_similar_recipes, recipe_id, n)
+            if similar is None:
+                return jsonify({'error': f'Recipe {recipe_id} not found'}), 404
+            return jsonify({'recipe_id': recipe_id, 'similar': similar})
+        except Overloaded:
+            return overloaded_response()
+        except Exception as e:
+            logger.error(f"Error getting similar recipes: {str(e)}")
+            return jsonify({'error': str(e)}), 500
+
     @app.route('/api/refresh', methods=['POST'])
     def refresh_recipes():
-        """Refresh recipes from MongoDB"""
+        """Ask for a sync with MongoDB; it runs in the background and this returns at once"""
         try:
             logger.info("Refreshing recipes")
-            fetch_recipes_from_mongodb()
-            return jsonify({'message': 'Recipes refreshed successfully'})
+            if catalog_sync is not None and catalog_sync.running:
+                catalog_sync.request_sync()
+                return jsonify({'message': 'Recipe sync scheduled', 'last_sync': catalog_sync.last_stats}), 202
+            if WORKERS > 1:
+                return jsonify({'error': 'Workers serve a shared snapshot; the server process refreshes it'}), 409
+            
+            # Sync is off: rebuild in the background and swap the index in when done
+            if refresh_lock.acquire(blocking=False):
+                threading.Thread(target=rebuild_in_background, daemon=True).start()
+            return jsonify({'message': 'Recipe refresh scheduled'}), 202
         except Exception as e:
             logger.error(f"Error refreshing recipes: {str(e)}")
             return jsonify({'error': str(e)}), 500
 
+    @app.route('/api/cache/stats', methods=['GET'])
+    def get_cache_stats():
+        """Get hit/miss counters of the recommendation cache"""
+        try:
+            return jsonify(recommender.recommendation_cache.stats())
+        except Exception as e:
+            logger.error(f"Error getting cache stats: {str(e)}")
+            return jsonify({'error': str(e)}), 500
+
+    @app.route('/healthz', methods=['GET'])
+    def get_health():
+        """Liveness: the process answers, whether or not the index is loaded yet"""
+        return jsonify({'status': 'ok', **load_progress.status()})
+
+    @app.route('/readyz', methods=['GET'])
+    def get_readiness():
+        """Readiness: 200 once an index is served, 503 with the load's progress until then"""
+        if not load_progress.ready:
+            return index_loading_response()
+        return jsonify({'status': 'ready', **load_progress.status()})
+
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        """Stage latency histograms and index gauges in the Prometheus text format"""
+        try:
+            current = recommender
+            catalog = current.catalog_stats()
+            cache = current.recommendation_cache.stats()
+            # Histograms cover every worker; gauges are this worker's view of the index
+            gauges = {
+                'cookmate_recipes': ('Recipes in the index', current.get_recipe_count()),
+                'cookmate_index_rows': ('Rows in the recipe matrix, tombstones included', catalog['rows']),
+                'cookmate_index_tombstones': ('Rows of deleted or replaced recipes', catalog['tombstones']),
+                'cookmate_recommendation_cache_entries': ('Cached recommendation results', cache['entries']),
+                'cookmate_recommendation_cache_hit_rate': ('Share of lookups served from the cache', cache['hit_rate']),
+                'cookmate_scoring_rejected': ('Requests this worker turned away with 429', scoring_pool.rejected)
+            }
+            return Response(metrics.render(gauges), content_type=METRICS_CONTENT_TYPE)
+        except Exception as e:
+            logger.error(f"Error rendering metrics: {str(e)}")
+            return jsonify({'error': str(e)}), 500
+
     @app.route('/api/users/<user_id>', methods=['GET'])
     def get_user_info(user_id):
         """Get information about a user and their tracked ingredients"""
         try:
-            logger.info(f"Checking user {user_id}")
-            if user_id not in recommender.user_preferences:
+            note_request(user_id=user_id)
+            profile = recommender.user_store.get(user_id)
+            if profile is None:
                 return jsonify({
                     'exists': False,
                     'message': f'User {user_id} not found'
                 }), 404
             
-            user_ingredients = list(recommender.user_preferences[user_id])
+            # Weights decayed to now, heaviest first
+            weights = profile.weights_at(time.time(), recommender.user_store.limits)
+            user_ingredients = profile.ingredients
             return jsonify({
                 'exists': True,
                 'user_id': user_id,
                 'tracked_ingredients': user_ingredients,
-                'ingredient_count': len(user_ingredients)
+                'ingredient_weights': {ingredient: round(weights[ingredient], 4) for ingredient in user_ingredients},
+                'ingredient_count': len(user_ingredients),
+                'seen_recipes': list(profile.seen)
             })
         except Exception as e:
             logger.error(f"Error checking user: {str(e)}")
@@ -241,8 +822,14 @@ try:
 
     if __name__ == '__main__':
         try:
-            logger.info("Starting recipe loading process...")
-            fetch_recipes_from_mongodb()
+            if WORKERS > 1:
+                # Workers map the snapshot themselves; the parent never loads the index
+                start_prefork_server()
+            else:
+                # Answer at once, 503 to recommendations until the index is loaded
+                logger.info("Starting recipe loading process in the background...")
+                create_app()
+                start_flask_server()
         except Exception as e:
             logger.error(f"Fatal error during application startup: {str(e)}")
             raise
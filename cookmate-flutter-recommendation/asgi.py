@@ -0,0 +1,8 @@
+# ASGI entry point, needs asgiref (pip install asgiref uvicorn):
+#   uvicorn asgi:application --port 5002
+# Requests run on asgiref's thread pool, scoring still on the bounded scoring threads.
+from asgiref.wsgi import WsgiToAsgi
+
+from app import create_app
+
+application = WsgiToAsgi(create_app())
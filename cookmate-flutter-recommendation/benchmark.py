@@ -0,0 +1,469 @@
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SCALES = (10000, 100000, 1000000)
+DEFAULT_VOCABULARY = 5000
+DEFAULT_USERS = 1000
+ADD_RECIPE_SAMPLE = 10000  # Recipes timed through add_recipe, which is much slower than ingest
+
+# The head of the ingredient distribution; the long tail is made-up words
+COMMON_INGREDIENTS = [
+    'salt', 'olive oil', 'garlic', 'onion', 'black pepper', 'butter', 'sugar', 'water', 'eggs',
+    'all purpose flour', 'milk', 'lemon juice', 'vegetable oil', 'parsley', 'brown sugar',
+    'tomatoes', 'parmesan cheese', 'honey', 'baking powder', 'vanilla extract', 'ground cumin',
+    'soy sauce', 'chicken broth', 'carrots', 'celery', 'heavy cream', 'red pepper flakes',
+    'cilantro', 'ginger', 'lime juice', 'paprika', 'cinnamon', 'baking soda', 'mayonnaise',
+    'dijon mustard', 'basil', 'thyme', 'oregano', 'potatoes', 'rice', 'scallions', 'bacon',
+    'chicken breasts', 'ground beef', 'cheddar cheese', 'sour cream', 'shallots', 'white wine',
+    'red wine vinegar', 'bay leaves', 'nutmeg', 'cornstarch', 'chili powder', 'avocado', 'spinach',
+    'mushrooms', 'zucchini', 'bell pepper', 'walnuts', 'almonds', 'maple syrup', 'yogurt',
+]
+SYLLABLES = ['ka', 'ro', 'mi', 'tan', 'sel', 'bo', 'ri', 'qui', 'nu', 'pe', 'lo', 'zar', 've', 'shi', 'gra', 'dum']
+
+
+def synthetic_vocabulary(size, rng):
+    """Ingredient names, most popular first: real ones, then one- or two-word made-up ones"""
+    names = list(COMMON_INGREDIENTS[:size])
+    seen = set(names)
+    while len(names) < size:
+        words = [''.join(rng.choice(SYLLABLES, rng.integers(2, 4))) for _ in range(rng.integers(1, 3))]
+        name = ' '.join(words)
+        if name not in seen:
+            seen.add(name)
+            names.append(name)
+    return names
+
+
+def iter_synthetic_batches(count, batch_size=2000, vocabulary_size=DEFAULT_VOCABULARY,
+                           mean_ingredients=9, seed=0):
+    """Yield batches of recipe documents shaped like the MongoDB collection.
+
+    Ingredient popularity follows a Zipf law, so a few ingredients appear in
+    most recipes and most appear in few, as in real catalogs. Recipes have
+    at least 3 ingredients and ``mean_ingredients`` on average.
+    """
+    rng = np.random.default_rng(seed)
+    vocabulary = np.asarray(synthetic_vocabulary(vocabulary_size, rng), dtype=object)
+    weights = 1.0 / np.arange(1, vocabulary_size + 1) ** 1.1
+    weights /= weights.sum()
+    for start in range(0, count, batch_size):
+        size = min(batch_size, count - start)
+        lengths = 3 + rng.poisson(max(mean_ingredients - 3, 0), size)
+        # One draw for the whole batch; repeats within a recipe are dropped
+        draws = vocabulary[rng.choice(vocabulary_size, int(lengths.sum()), p=weights)]
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        yield [
+            {
+                '_id': f'{start + i:024x}',
+                'Title': f'Synthetic recipe {start + i}',
+                'Cleaned_Ingredients': list(dict.fromkeys(draws[offsets[i]:offsets[i + 1]])),
+                'Instructions': ''
+            }
+            for i in range(size)
+        ]
+
+
+def synthetic_events(recommender, users, events_per_user=10, seed=0):
+    """Tracking events of users who favour popular recipes and a few ingredients of each"""
+    rng = np.random.default_rng(seed + 1)
+    n_recipes = len(recommender.recipes)
+    weights = 1.0 / np.arange(1, n_recipes + 1) ** 0.8
+    weights /= weights.sum()
+    rows = rng.permutation(n_recipes)[rng.choice(n_recipes, users * events_per_user, p=weights)]
+    events = []
+    for index, row in enumerate(rows):
+        record = recommender.recipes.record(int(row))
+        words = record['ingredients'].split()
+        used = list(rng.choice(words, min(len(words), int(rng.integers(1, 5))), replace=False))
+        events.append((f'user-{index % users}', record['id'], used))
+    return events
+
+
+def latency_summary(seconds):
+    times = np.asarray(seconds) * 1000
+    if len(times) == 0:
+        return {'count': 0}
+    return {
+        'count': len(times),
+        'mean_ms': float(times.mean()),
+        'p50_ms': float(np.percentile(times, 50)),
+        'p95_ms': float(np.percentile(times, 95)),
+        'p99_ms': float(np.percentile(times, 99))
+    }
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process so far"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def bench_build(count, options):
+    """Time the ingest pipeline, finalize and the neighbour build, and add_recipe on a sample"""
+    from recommender import RecipeRecommender
+    from ingest import ingest_recipes
+
+    report = {}
+    rss_before = peak_rss_mb()
+    recommender = RecipeRecommender(cache_size=options.cache_size, engine=options.engine,
+                                    similar_k=options.similar_k, similar_workers=options.workers,
+                                    **feature_options(options))
+    started = time.perf_counter()
+    ingest_recipes(recommender, iter_synthetic_batches(count, vocabulary_size=options.vocabulary),
+                   workers=options.workers)
+    ingested = time.perf_counter()
+    recommender.finalize()
+    finalized = time.perf_counter()
+    recommender.build_neighbors()
+    built = time.perf_counter()
+    vectors = recommender.recipe_vectors
+    postings = recommender.inverted_index.postings
+    report['build'] = {
+        'recipes': len(recommender.recipes),
+        'features': vectors.shape[1],
+        'vocabulary_terms': len(recommender.vectorizer.vocabulary_ or ()),
+        'nnz': int(vectors.nnz),
+        'matrix_mb': (vectors.data.nbytes + vectors.indices.nbytes + vectors.indptr.nbytes) / 2 ** 20,
+        'postings_mb': (postings.data.nbytes + postings.indices.nbytes + postings.indptr.nbytes) / 2 ** 20,
+        'ingest_seconds': ingested - started,
+        'finalize_seconds': finalized - ingested,
+        'neighbors_seconds': built - finalized,
+        'recipes_per_second': count / (finalized - started),
+        'peak_rss_mb': peak_rss_mb(),
+        'peak_rss_growth_mb': peak_rss_mb() - rss_before
+    }
+
+    sample = RecipeRecommender(cache_size=0, **feature_options(options))
+    sample_count = min(count, ADD_RECIPE_SAMPLE)
+    documents = [doc for batch in iter_synthetic_batches(sample_count, vocabulary_size=options.vocabulary)
+                 for doc in batch]
+    started = time.perf_counter()
+    for doc in documents:
+        sample.add_recipe(doc['_id'], doc['Title'], doc['Cleaned_Ingredients'], doc['Instructions'])
+    sample.finalize()
+    report['add_recipe'] = {
+        'recipes': sample_count,
+        'seconds': time.perf_counter() - started,
+        'recipes_per_second': sample_count / (time.perf_counter() - started)
+    }
+    return recommender, report
+
+
+def bench_recommendations(recommender, events, users, options):
+    """Latency of tracking, single-user, filtered and batch recommendations and similar recipes"""
+    from facets import RecipeFilters
+
+    report = {}
+    times = []
+    for user_id, recipe_id, used in events:
+        started = time.perf_counter()
+        recommender.track_user_behavior(user_id, recipe_id, used)
+        times.append(time.perf_counter() - started)
+    report['track'] = latency_summary(times)
+
+    user_ids = [f'user-{index}' for index in range(users)]
+    times = []
+    for user_id in user_ids:
+        started = time.perf_counter()
+        recommender.get_recommendations(user_id, options.n)
+        times.append(time.perf_counter() - started)
+    report['recommend'] = latency_summary(times)
+
+    times = []
+    for start in range(0, len(user_ids), options.batch_users):
+        started = time.perf_counter()
+        recommender.get_recommendations_batch(user_ids[start:start + options.batch_users], options.n)
+        times.append(time.perf_counter() - started)
+    report['recommend_batch'] = {'users_per_call': options.batch_users, **latency_summary(times)}
+
+    # A common ingredient kept, a rarer one left out: both kinds of facet
+    filters = RecipeFilters(include=['chicken'], exclude=['walnuts'])
+    times = []
+    returned = []
+    for user_id in user_ids:
+        started = time.perf_counter()
+        result = recommender.get_recommendations(user_id, options.n, filters)
+        times.append(time.perf_counter() - started)
+        returned.append(len(result.get('recommendations', [])))
+    report['recommend_filtered'] = {'mean_results': float(np.mean(returned)), **latency_summary(times)}
+
+    times = []
+    for _, recipe_id, _ in events[:users]:
+        started = time.perf_counter()
+        recommender.get_similar_recipes(recipe_id, options.n)
+        times.append(time.perf_counter() - started)
+    report['similar'] = latency_summary(times)
+    return report
+
+
+def bench_quality(recommender, events, users, options):
+    """How far recommendations and similar recipes agree with the full vocabulary.
+
+    Builds a 'vocabulary' mode recommender on the same corpus, tracks the
+    same events on both under fresh user ids and gives the mean share of
+    each top n that both return. Similar recipes are compared as served, so
+    precomputed neighbours count in; bench_neighbors measures them alone.
+    """
+    from recommender import RecipeRecommender
+    from ingest import ingest_recipes
+
+    reference = RecipeRecommender(cache_size=0)
+    ingest_recipes(reference, iter_synthetic_batches(len(recommender.recipes), vocabulary_size=options.vocabulary),
+                   workers=options.workers)
+    reference.finalize()
+    for target in (recommender, reference):
+        for user_id, recipe_id, used in events:
+            target.track_user_behavior(f'quality-{user_id}', recipe_id, used)
+
+    def overlap(results, expected):
+        expected = [item['id'] for item in expected]
+        found = {item['id'] for item in results}
+        return len(found.intersection(expected)) / len(expected) if expected else 1.0
+
+    recommend = []
+    for index in range(users):
+        expected = reference.get_recommendations(f'quality-user-{index}', options.n).get('recommendations')
+        if expected:
+            results = recommender.get_recommendations(f'quality-user-{index}', options.n).get('recommendations', [])
+            recommend.append(overlap(results, expected))
+    similar = [
+        overlap(recommender.get_similar_recipes(recipe_id, options.n) or [],
+                reference.get_similar_recipes(recipe_id, options.n) or [])
+        for _, recipe_id, _ in events[:users]
+    ]
+    return {
+        'reference_features': reference.recipe_vectors.shape[1],
+        'recommend_overlap': float(np.mean(recommend)) if recommend else None,
+        'similar_overlap': float(np.mean(similar)) if similar else None
+    }
+
+
+def bench_neighbors(recommender, events, users):
+    """Recall of the precomputed neighbours against scoring the whole catalog.
+
+    For the recipes of the first events, gives the mean and worst share of
+    the exact top k (k as precomputed) found in the precomputed list, and
+    how many lists came out shorter than the exact one.
+    """
+    from scoring import score_recipes, top_n_indices
+
+    neighbors = recommender.neighbors
+    recipe_vectors = recommender.recipe_vectors
+    recalls = []
+    short = 0
+    for row in dict.fromkeys(recommender.get_recipe_row(recipe_id) for _, recipe_id, _ in events[:users]):
+        scores = score_recipes(recipe_vectors, recipe_vectors[row])
+        scores[row] = 0
+        exact = top_n_indices(scores, neighbors.k)
+        exact = exact[scores[exact] > 0]
+        if not len(exact):
+            continue
+        found, _ = neighbors.of(row)
+        recalls.append(len(set(exact.tolist()).intersection(found.tolist())) / len(exact))
+        short += len(found) < len(exact)
+    return {
+        'k': neighbors.k,
+        'recipes': len(recalls),
+        'recall': float(np.mean(recalls)) if recalls else None,
+        'worst_recall': float(np.min(recalls)) if recalls else None,
+        'short_lists': short
+    }
+
+
+def bench_endpoints(recommender, events, users, options):
+    """Requests per second and latency of the API under concurrent clients.
+
+    The Flask app is served from a local threaded WSGI server on a free
+    port, with its recommender swapped for the benchmark's one. Unless
+    SCORING_QUEUE_DEPTH is set, scoring queues one request per client, so
+    429s only count what the set limits reject; they are reported apart
+    from errors.
+    """
+    from werkzeug.serving import make_server
+    # Read when the app is imported
+    os.environ.setdefault('SCORING_THREADS', str(os.cpu_count() or 1))
+    os.environ.setdefault('SCORING_QUEUE_DEPTH', str(options.clients))
+    import app as service
+
+    # Marks the index ready too, or index endpoints would answer 503
+    service.use_index(recommender, 'benchmark')
+    server = make_server('127.0.0.1', 0, service.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+    rng = np.random.default_rng(2)
+
+    def get(path):
+        return urllib.request.Request(base + path)
+
+    def post(path, body):
+        return urllib.request.Request(base + path, data=json.dumps(body).encode(),
+                                      headers={'Content-Type': 'application/json'})
+
+    endpoints = {
+        'recommendations': lambda i: get(f'/api/recommendations/user-{i % users}'),
+        'track': lambda i: post('/api/track', {
+            'user_id': events[i % len(events)][0], 'recipe_id': events[i % len(events)][1],
+            'ingredients_used': events[i % len(events)][2]
+        }),
+        'recipes_page': lambda i: get(f'/api/recipes?limit=100&offset={int(rng.integers(0, len(recommender.recipes)))}'
+                                      '&fields=id,name'),
+        'similar': lambda i: get(f'/api/recipes/{events[i % len(events)][1]}/similar'),
+    }
+
+    def call(request):
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        return time.perf_counter() - started, status
+
+    report = {}
+    try:
+        with ThreadPoolExecutor(options.clients) as clients:
+            for name, make_request in endpoints.items():
+                requests = [make_request(i) for i in range(options.requests)]
+                started = time.perf_counter()
+                results = list(clients.map(call, requests))
+                elapsed = time.perf_counter() - started
+                report[name] = {
+                    'clients': options.clients,
+                    'requests_per_second': len(results) / elapsed,
+                    'errors': sum(1 for _, status in results if status >= 400 and status != 429),
+                    'rejected': sum(1 for _, status in results if status == 429),
+                    **latency_summary([seconds for seconds, _ in results])
+                }
+    finally:
+        server.shutdown()
+    return report
+
+
+def run_scale(count, options):
+    """Benchmark one catalog size; runs in its own process so peak memory is its own"""
+    from log_config import configure_logging
+    configure_logging('production', log_file='', sample_rate=0)
+    users = min(options.users, count)
+    recommender, report = bench_build(count, options)
+    events = synthetic_events(recommender, users, options.events_per_user)
+    report.update(bench_recommendations(recommender, events, users, options))
+    if recommender.neighbors is not None:
+        report['neighbors'] = bench_neighbors(recommender, events, users)
+    if not options.skip_endpoints:
+        report['endpoints'] = bench_endpoints(recommender, events, users, options)
+    report['peak_rss_mb'] = peak_rss_mb()
+    if options.features != 'vocabulary':
+        # Last, as the reference index would count towards peak memory
+        report['quality'] = bench_quality(recommender, events, users, options)
+    return {'recipes': count, **report}
+
+
+def feature_options(options):
+    return {'feature_mode': options.features, 'min_bigram_df': options.min_bigram_df,
+            'hash_features': options.hash_features}
+
+
+def flatten(report, prefix=''):
+    """Numeric leaves of a report as {'a.b.c': value}"""
+    values = {}
+    for key, value in report.items():
+        name = f'{prefix}{key}'
+        if isinstance(value, dict):
+            values.update(flatten(value, f'{name}.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[name] = value
+    return values
+
+
+def compare(baseline, current):
+    """Ratio current / baseline of every metric both runs measured at the same scale"""
+    before = {run['recipes']: flatten(run) for run in baseline['runs']}
+    changes = {}
+    for run in current['runs']:
+        old = before.get(run['recipes'])
+        if old is None:
+            continue
+        changes[str(run['recipes'])] = {
+            name: value / old[name] for name, value in flatten(run).items()
+            if old.get(name) and name != 'recipes'
+        }
+    return changes
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the recommender and API on synthetic data')
+    parser.add_argument('--scales', type=int, nargs='+', default=list(DEFAULT_SCALES), help='catalog sizes')
+    parser.add_argument('--vocabulary', type=int, default=DEFAULT_VOCABULARY, help='distinct ingredients')
+    parser.add_argument('--users', type=int, default=DEFAULT_USERS)
+    parser.add_argument('--events-per-user', type=int, default=10)
+    parser.add_argument('--n', type=int, default=10, help='recommendations per request')
+    parser.add_argument('--batch-users', type=int, default=100, help='users per batch call')
+    parser.add_argument('--engine', default='exact', choices=['exact', 'ann'])
+    parser.add_argument('--similar-k', type=int, default=20, help='precomputed similar recipes, 0 for none')
+    parser.add_argument('--features', default='vocabulary', choices=['vocabulary', 'pruned', 'hashing'],
+                        help='feature mode; other than vocabulary also measures agreement with it')
+    parser.add_argument('--min-bigram-df', type=int, default=2, help='pruned mode: recipes a word pair needs')
+    parser.add_argument('--hash-features', type=int, default=2 ** 20, help='hashing mode: columns')
+    parser.add_argument('--cache-size', type=int, default=0, help='recommendation cache entries, off by default')
+    parser.add_argument('--workers', type=int, default=None, help='ingest and neighbour processes')
+    parser.add_argument('--clients', type=int, default=8, help='concurrent API clients')
+    parser.add_argument('--requests', type=int, default=2000, help='requests per endpoint')
+    parser.add_argument('--skip-endpoints', action='store_true')
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--compare', help='earlier JSON report to compute ratios against')
+    args = parser.parse_args()
+
+    # Importing the app for the endpoint runs must not log every request or reach MongoDB
+    os.environ.setdefault('LOG_PROFILE', 'production')
+    os.environ.setdefault('LOG_FILE', '')
+    os.environ.setdefault('REQUEST_LOG_SAMPLE_RATE', '0')
+    results = {
+        'commit': git_commit(),
+        'created_at': time.time(),
+        'python': platform.python_version(),
+        'cpus': os.cpu_count(),
+        'options': vars(args),
+        'runs': []
+    }
+    context = multiprocessing.get_context('fork')
+    for scale in args.scales:
+        with ProcessPoolExecutor(1, mp_context=context) as pool:
+            results['runs'].append(pool.submit(run_scale, scale, args).result())
+        print(f'Benchmarked {scale} recipes', file=sys.stderr)
+    if args.compare:
+        with open(args.compare) as f:
+            results['compared_to'] = args.compare
+            results['ratios'] = compare(json.load(f), results)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
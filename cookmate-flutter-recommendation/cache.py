@@ -0,0 +1,97 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class RecommendationCache:
+    """Thread-safe LRU cache of recommendation payloads with a TTL.
+
+    Entries are keyed on (user_id, n). At most ``max_entries`` payloads are
+    kept, which bounds memory since each payload holds at most n recipes.
+    Entries older than ``ttl`` seconds count as misses, and so do entries
+    put with a ``generation`` other than the one ``get`` is given: the
+    user's profile changed since, maybe in another worker process.
+    ``max_entries=0`` disables caching.
+    """
+
+    def __init__(self, max_entries=10000, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # (user_id, n) -> (expires_at, generation, payload)
+        self._keys_by_user = {}  # user_id -> set of n, for per-user invalidation
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, user_id, n, generation=None):
+        key = (user_id, n)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, cached_generation, payload = entry
+            if cached_generation != generation:
+                self._remove(key)
+                self.invalidations += 1
+                self.misses += 1
+                return None
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return payload
+
+    def put(self, user_id, n, payload, generation=None):
+        if self.max_entries <= 0:
+            return
+        key = (user_id, n)
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, generation, payload)
+            self._entries.move_to_end(key)
+            self._keys_by_user.setdefault(user_id, set()).add(n)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate_user(self, user_id):
+        """Drop every cached payload of one user"""
+        with self._lock:
+            for n in self._keys_by_user.pop(user_id, ()):
+                self._entries.pop((user_id, n), None)
+                self.invalidations += 1
+
+    def clear(self):
+        """Drop everything, e.g. after the index was rebuilt"""
+        with self._lock:
+            self.invalidations += len(self._entries)
+            self._entries.clear()
+            self._keys_by_user.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        user_id, n = key
+        user_keys = self._keys_by_user.get(user_id)
+        if user_keys is not None:
+            user_keys.discard(n)
+            if not user_keys:
+                del self._keys_by_user[user_id]
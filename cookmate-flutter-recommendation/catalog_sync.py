@@ -0,0 +1,238 @@
+import logging
+import threading
+import time
+
+from bson import ObjectId
+from pymongo.errors import PyMongoError
+
+from ingest import prepare_batch, RECIPE_PROJECTION
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 60
+DEFAULT_COMPACT_RATIO = 0.2
+DEFAULT_RECONCILE_INTERVAL = 600
+FETCH_BATCH = 1000
+MAX_STREAM_EVENTS = 50000  # Events applied per round; the rest wait for the next one
+
+
+class CatalogSync:
+    """Keeps a recommender in step with the recipes collection without full reloads.
+
+    Changes come from a change stream when the deployment has one (replica
+    sets and Atlas). Otherwise the collection is polled: recipes whose
+    ObjectId is past the high-water mark are new, recipes whose
+    ``updated_field`` moved past its mark are changed, and every
+    ``reconcile_interval`` seconds the ids are compared with the index to find
+    deletions and inserts the mark missed. The first round always reconciles,
+    which catches a snapshot up with the collection.
+
+    Each round goes through RecipeRecommender.apply_catalog_changes, which
+    appends and tombstones rows and swaps them in at once. When tombstones
+    and rows weighted with an old fit pass ``compact_ratio`` of the index, a
+    clean index is built from the live rows and handed to ``on_swap``. All
+    of this runs on one background thread; requests never wait for it.
+    ``collection`` only needs the pymongo Collection methods used here, so a
+    mongomock collection works too.
+    """
+
+    def __init__(self, collection, get_recommender, on_swap, interval=DEFAULT_INTERVAL,
+                 compact_ratio=DEFAULT_COMPACT_RATIO, reconcile_interval=DEFAULT_RECONCILE_INTERVAL,
+                 updated_field=None, use_change_stream=True):
+        self.collection = collection
+        self.get_recommender = get_recommender  # Returns the recommender currently serving
+        self.on_swap = on_swap  # Called with a compacted recommender to serve instead
+        self.interval = interval
+        self.compact_ratio = compact_ratio
+        self.reconcile_interval = reconcile_interval
+        self.updated_field = updated_field
+        self.use_change_stream = use_change_stream
+        self.projection = dict(RECIPE_PROJECTION)
+        if updated_field:
+            self.projection[updated_field] = 1
+        self.high_water = None  # Largest ObjectId applied
+        self.updated_mark = None  # Largest updated_field value applied
+        self.stream = None
+        self.last_reconcile = None
+        self.last_stats = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()  # One round at a time
+
+    def start(self):
+        """Run sync rounds every ``interval`` seconds on a daemon thread"""
+        self._thread = threading.Thread(target=self._run, name='catalog-sync', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self.stream is not None:
+            self.stream.close()
+
+    def request_sync(self):
+        """Start a round now instead of at the next interval; returns straight away"""
+        self._wake.set()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sync_once()
+            except Exception as e:
+                logger.error(f"Error syncing recipes: {str(e)}")
+                import traceback
+                logger.error(f"Traceback: {traceback.format_exc()}")
+                # Start over from a full comparison
+                self._close_stream()
+                self.last_reconcile = None
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def sync_once(self):
+        """Apply the changes since the last round, compacting if due; returns what changed"""
+        with self._lock:
+            started = time.perf_counter()
+            recommender = self.get_recommender()
+            if self.last_reconcile is None:
+                # Open the stream first so changes made while comparing are not lost
+                self._open_stream()
+                mode = 'reconcile'
+                documents, deleted_ids = self._reconcile(recommender)
+            elif self.stream is None and time.monotonic() - self.last_reconcile >= self.reconcile_interval:
+                mode = 'reconcile'
+                documents, deleted_ids = self._reconcile(recommender)
+            elif self.stream is not None:
+                mode = 'change_stream'
+                documents, deleted_ids = self._read_stream()
+            else:
+                mode = 'poll'
+                documents, deleted_ids = self._poll()
+
+            stats = {'mode': mode, 'upserted': 0, 'deleted': 0, 'compacted': False}
+            records = []
+            if documents or deleted_ids:
+                # Tokens are not used; the recommender weights the text with its current fit
+                records, _ = prepare_batch(documents, analyzer=str.split)
+                # A recipe changed to have no usable ingredients is dropped. Only ids the
+                # index holds are deletions: a recipe that never had usable ingredients
+                # comes back from every reconcile and must not count as a change.
+                kept = {record['id'] for record in records}
+                deleted_ids = {
+                    recipe_id for recipe_id in set(deleted_ids) | ({str(doc['_id']) for doc in documents} - kept)
+                    if recommender.get_recipe_row(recipe_id) is not None
+                }
+                stats.update(upserted=len(records), deleted=len(deleted_ids))
+            if records or deleted_ids:
+                catalog = recommender.apply_catalog_changes(records, deleted_ids)
+                if catalog is None:
+                    raise RuntimeError("Recommender did not accept the catalog changes")
+                if self._compaction_due(catalog):
+                    self.on_swap(recommender.compacted())
+                    stats['compacted'] = True
+            stats['seconds'] = round(time.perf_counter() - started, 3)
+            self.last_stats = stats
+            if records or deleted_ids:
+                logger.info(f"Recipe sync ({mode}): {stats['upserted']} added or updated, "
+                            f"{stats['deleted']} deleted in {stats['seconds']}s")
+            return stats
+
+    def _compaction_due(self, catalog):
+        if not catalog['rows']:
+            return False
+        return (catalog['tombstones'] + catalog['stale_rows']) / catalog['rows'] > self.compact_ratio
+
+    def _reconcile(self, recommender):
+        """Compare every id in the collection with the index"""
+        projection = {'_id': 1}
+        if self.updated_field:
+            projection[self.updated_field] = 1
+        source_ids = {}
+        for doc in self.collection.find({}, projection):
+            source_ids[str(doc['_id'])] = doc['_id']
+            self._advance_marks(doc)
+        indexed = recommender.live_recipe_ids()
+        missing = [source_ids[recipe_id] for recipe_id in source_ids.keys() - indexed]
+        self.last_reconcile = time.monotonic()
+        return self._fetch(missing), list(indexed - source_ids.keys())
+
+    def _poll(self):
+        documents = {}
+        if self.high_water is not None:
+            query = {'_id': {'$gt': self.high_water}}
+            for doc in self.collection.find(query, self.projection).sort('_id', 1):
+                documents[doc['_id']] = doc
+        if self.updated_field and self.updated_mark is not None:
+            query = {self.updated_field: {'$gt': self.updated_mark}}
+            for doc in self.collection.find(query, self.projection):
+                documents[doc['_id']] = doc
+        for doc in documents.values():
+            self._advance_marks(doc)
+        return list(documents.values()), []
+
+    def _advance_marks(self, doc):
+        if isinstance(doc['_id'], ObjectId) and (self.high_water is None or doc['_id'] > self.high_water):
+            self.high_water = doc['_id']
+        if self.updated_field:
+            updated = doc.get(self.updated_field)
+            if updated is not None and (self.updated_mark is None or updated > self.updated_mark):
+                self.updated_mark = updated
+
+    def _fetch(self, object_ids):
+        documents = []
+        for start in range(0, len(object_ids), FETCH_BATCH):
+            batch = object_ids[start:start + FETCH_BATCH]
+            documents.extend(self.collection.find({'_id': {'$in': batch}}, self.projection))
+        return documents
+
+    def _open_stream(self):
+        self._close_stream()
+        if not self.use_change_stream:
+            return
+        if not callable(getattr(type(self.collection), 'watch', None)):
+            logger.info("Collection has no change streams, polling for recipe changes")
+            return
+        try:
+            self.stream = self.collection.watch(full_document='updateLookup')
+            logger.info("Following recipe changes through a change stream")
+        except (PyMongoError, NotImplementedError) as e:
+            # Standalone servers and test doubles have no change streams
+            logger.info(f"Change streams unavailable ({type(e).__name__}), polling for recipe changes")
+
+    def _close_stream(self):
+        if self.stream is not None:
+            try:
+                self.stream.close()
+            except PyMongoError:
+                pass
+            self.stream = None
+
+    def _read_stream(self):
+        """Drain the events that arrived since the last round, last event per recipe winning"""
+        documents = {}
+        deleted = {}
+        for _ in range(MAX_STREAM_EVENTS):
+            change = self.stream.try_next()
+            if change is None:
+                break
+            if 'documentKey' not in change:
+                # The collection was dropped or renamed; compare everything next round
+                self._close_stream()
+                self.last_reconcile = None
+                break
+            recipe_id = change['documentKey']['_id']
+            document = change.get('fullDocument')
+            if change['operationType'] in ('insert', 'update', 'replace') and document is not None:
+                documents[recipe_id] = document
+                deleted.pop(recipe_id, None)
+                self._advance_marks(document)
+            elif change['operationType'] in ('delete', 'update', 'replace'):
+                # A changed document that is already gone again counts as deleted
+                deleted[recipe_id] = str(recipe_id)
+                documents.pop(recipe_id, None)
+        return list(documents.values()), list(deleted.values())
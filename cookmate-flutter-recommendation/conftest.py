@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+from recommender import RecipeRecommender
+
+# Common ingredients first; the tail is made up so rarer terms come in all sizes
+COMMON_INGREDIENTS = [
+    'salt', 'olive oil', 'garlic', 'onion', 'black pepper', 'butter', 'sugar', 'eggs', 'all purpose flour',
+    'milk', 'lemon juice', 'parsley', 'tomatoes', 'parmesan cheese', 'honey', 'ground cumin', 'soy sauce',
+    'chicken broth', 'carrots', 'heavy cream', 'cilantro', 'ginger', 'lime juice', 'paprika', 'cinnamon',
+    'dijon mustard', 'basil', 'thyme', 'potatoes', 'rice', 'scallions', 'bacon', 'chicken breasts',
+    'ground beef', 'cheddar cheese', 'shallots', 'white wine', 'spinach', 'mushrooms', 'zucchini',
+    'walnuts', 'almonds', 'maple syrup', 'yogurt',
+]
+SYLLABLES = ['ka', 'ro', 'mi', 'tan', 'sel', 'bo', 'ri', 'qui', 'nu', 'pe', 'lo', 'zar', 've', 'shi']
+
+
+def synthetic_recipes(count, vocabulary_size=300, seed=0):
+    """Recipe documents shaped like the MongoDB collection, with Zipf-distributed ingredients"""
+    rng = np.random.default_rng(seed)
+    vocabulary = list(COMMON_INGREDIENTS[:vocabulary_size])
+    while len(vocabulary) < vocabulary_size:
+        name = ''.join(rng.choice(SYLLABLES, rng.integers(2, 5)))
+        if name not in vocabulary:
+            vocabulary.append(name)
+    weights = 1.0 / np.arange(1, vocabulary_size + 1) ** 1.1
+    weights /= weights.sum()
+    documents = []
+    for index in range(count):
+        chosen = rng.choice(vocabulary_size, 3 + rng.poisson(5), p=weights)
+        documents.append({
+            '_id': f'{index:024x}',
+            'Title': f'Recipe {index}',
+            'Cleaned_Ingredients': list(dict.fromkeys(vocabulary[term] for term in chosen)),
+            'Instructions': ''
+        })
+    return documents
+
+
+def synthetic_events(documents, users, events_per_user=10, seed=0):
+    """(user_id, recipe_id, ingredients used) events of users who favour the first recipes"""
+    rng = np.random.default_rng(seed + 1)
+    weights = 1.0 / np.arange(1, len(documents) + 1) ** 0.8
+    weights /= weights.sum()
+    events = []
+    for index, row in enumerate(rng.choice(len(documents), users * events_per_user, p=weights)):
+        doc = documents[row]
+        words = ' '.join(doc['Cleaned_Ingredients']).split()
+        used = [str(word) for word in rng.choice(words, min(len(words), int(rng.integers(1, 5))), replace=False)]
+        events.append((f'user-{index % users}', str(doc['_id']), used))
+    return events
+
+
+@pytest.fixture(scope='session')
+def make_recipes():
+    return synthetic_recipes
+
+
+@pytest.fixture(scope='session')
+def make_events():
+    return synthetic_events
+
+
+@pytest.fixture(scope='session')
+def build_recommender():
+    """Index recipe documents into a new RecipeRecommender(**options) and finalize it"""
+    def build(documents, **options):
+        recommender = RecipeRecommender(**options)
+        for doc in documents:
+            recommender.add_recipe(str(doc['_id']), doc['Title'], doc['Cleaned_Ingredients'],
+                                   doc.get('Instructions', ''))
+        recommender.finalize()
+        return recommender
+    return build
@@ -0,0 +1,108 @@
+import numpy as np
+
+DENSE_FRACTION = 1 / 32  # Terms in at least this share of recipes get a bitmap
+
+
+class RecipeFilters:
+    """Constraints one request puts on the recipes it may be recommended.
+
+    ``include`` and ``exclude`` are ingredients, matched by their words: a
+    recipe passes when it has every word of every ``include`` ingredient and
+    no word of an ``exclude`` one ("chicken" matches "chicken breasts",
+    "nuts" does not match "walnuts"). ``exclude_ids`` are recipes never to
+    return, e.g. ones the user already cooked.
+    """
+
+    __slots__ = ('include', 'exclude', 'exclude_ids')
+
+    def __init__(self, include=(), exclude=(), exclude_ids=()):
+        self.include = tuple(include)
+        self.exclude = tuple(exclude)
+        self.exclude_ids = tuple(str(recipe_id) for recipe_id in exclude_ids)
+
+    def __bool__(self):
+        return bool(self.include or self.exclude or self.exclude_ids)
+
+    def as_dict(self):
+        return {'include': list(self.include), 'exclude': list(self.exclude), 'exclude_ids': list(self.exclude_ids)}
+
+
+class FacetIndex:
+    """Which recipes contain each term, as masks to filter recommendations with.
+
+    Like a roaring bitmap, each term is kept the smaller of two ways. Terms
+    in at least ``DENSE_FRACTION`` of the recipes get a packed bitmap, one
+    bit per recipe, built with the index and saved in the snapshot; filters
+    on them are combined eight recipes per byte and unpacked once. Rarer
+    terms use their posting list in the inverted index, whose row numbers
+    take less room than a bitmap would. Either way a filter comes out as a
+    boolean mask over matrix rows, applied with the tombstones before
+    top-k selection, so filtering never shrinks a result that enough
+    recipes could fill.
+    """
+
+    def __init__(self, postings, bitmap_terms, bitmaps):
+        self.postings = postings  # CSC: column j holds the recipes containing term j
+        self.bitmap_terms = bitmap_terms  # Sorted columns that have a bitmap
+        self.bitmaps = bitmaps  # uint8, one packed row of n_recipes bits per bitmap term
+
+    @classmethod
+    def build(cls, postings, dense_fraction=DENSE_FRACTION):
+        n_recipes = postings.shape[0]
+        document_frequency = np.diff(postings.indptr)
+        bitmap_terms = np.flatnonzero(document_frequency >= max(n_recipes * dense_fraction, 1))
+        bitmaps = np.zeros((len(bitmap_terms), (n_recipes + 7) // 8), dtype=np.uint8)
+        contains = np.zeros(n_recipes, dtype=bool)
+        for position, term in enumerate(bitmap_terms):
+            rows = postings.indices[postings.indptr[term]:postings.indptr[term + 1]]
+            contains[:] = False
+            contains[rows] = True
+            bitmaps[position] = np.packbits(contains)
+        return cls(postings, bitmap_terms, bitmaps)
+
+    @property
+    def n_recipes(self):
+        return self.postings.shape[0]
+
+    def _bitmap(self, term):
+        position = np.searchsorted(self.bitmap_terms, term)
+        if position < len(self.bitmap_terms) and self.bitmap_terms[position] == term:
+            return self.bitmaps[position]
+        return None
+
+    def excluded_rows(self, include, exclude):
+        """Mask of the rows lacking a term of ``include`` or having one of ``exclude``.
+
+        Terms are matrix columns; -1 stands for a term no recipe has.
+        """
+        n_recipes = self.n_recipes
+        if any(term < 0 for term in include):
+            return np.ones(n_recipes, dtype=bool)
+        exclude = [term for term in exclude if term >= 0]
+
+        sparse_include = []
+        sparse_exclude = []
+        packed = None
+        for terms, sparse, required in ((include, sparse_include, True), (exclude, sparse_exclude, False)):
+            for term in terms:
+                bitmap = self._bitmap(term)
+                if bitmap is None:
+                    sparse.append(term)
+                    continue
+                if packed is None:
+                    packed = np.zeros(self.bitmaps.shape[1], dtype=np.uint8)
+                packed |= ~bitmap if required else bitmap
+
+        if packed is not None:
+            excluded = np.unpackbits(packed, count=n_recipes).view(bool)
+        else:
+            excluded = np.zeros(n_recipes, dtype=bool)
+        for term in sparse_exclude:
+            excluded[self.postings.indices[self.postings.indptr[term]:self.postings.indptr[term + 1]]] = True
+        for term in sparse_include:
+            # Only rows in the posting list can still pass
+            rows = self.postings.indices[self.postings.indptr[term]:self.postings.indptr[term + 1]]
+            kept = excluded[rows]
+            excluded = np.ones(n_recipes, dtype=bool)
+            excluded[rows] = kept
+        return excluded
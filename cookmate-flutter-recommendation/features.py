@@ -0,0 +1,134 @@
+import re
+
+import numpy as np
+from sklearn.feature_extraction import FeatureHasher
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS, CountVectorizer, HashingVectorizer, TfidfVectorizer
+
+from tfidf_index import IncrementalTfidfIndex, HashingTfidfIndex, fit_idf, apply_tfidf
+
+# 'vocabulary' keeps every term seen; 'pruned' drops word pairs found in fewer
+# than min_bigram_df recipes; 'hashing' maps terms to a fixed number of columns
+FEATURE_MODES = ('vocabulary', 'pruned', 'hashing')
+DEFAULT_MIN_BIGRAM_DF = 2
+DEFAULT_HASH_FEATURES = 2 ** 20
+
+# Tokenization, the same in every mode
+STOP_WORDS = 'english'
+TOKEN_PATTERN = r'(?u)\b\w+\b'
+NGRAM_RANGE = (1, 2)  # Allow both single words and pairs of words
+
+
+class HashingTfidfVectorizer:
+    """TF-IDF over hashed terms, with the parts of TfidfVectorizer's interface the index uses.
+
+    Terms are tokenized like TfidfVectorizer does and hashed into
+    ``n_features`` columns like HashingVectorizer does, so there is no
+    vocabulary to hold, grow or renumber, and recipes added later land in
+    the same columns. Terms whose hashes collide share a column. Only the
+    IDF of each column is fitted; columns no recipe used get the highest.
+    """
+
+    vocabulary_ = None  # Columns have no terms to look up
+
+    def __init__(self, n_features=DEFAULT_HASH_FEATURES, stop_words=STOP_WORDS, token_pattern=TOKEN_PATTERN,
+                 ngram_range=NGRAM_RANGE, lowercase=True, norm='l2', use_idf=True, smooth_idf=True,
+                 sublinear_tf=False):
+        self.n_features = n_features
+        self.stop_words = stop_words
+        self.token_pattern = token_pattern
+        self.ngram_range = ngram_range
+        self.lowercase = lowercase
+        self.norm = norm
+        self.use_idf = use_idf
+        self.smooth_idf = smooth_idf
+        self.sublinear_tf = sublinear_tf
+        self.idf_ = None
+        self._tokenizer = HashingVectorizer(
+            n_features=n_features, stop_words=stop_words, token_pattern=token_pattern,
+            ngram_range=ngram_range, lowercase=lowercase
+        )
+        self._analyzer = self._tokenizer.build_analyzer()
+        # What HashingVectorizer hashes with, minus its signs and normalisation
+        self._hasher = FeatureHasher(n_features, input_type='string', alternate_sign=False, dtype=np.float64)
+
+    def get_params(self):
+        return {
+            'n_features': self.n_features, 'stop_words': self.stop_words, 'token_pattern': self.token_pattern,
+            'ngram_range': self.ngram_range, 'lowercase': self.lowercase, 'norm': self.norm,
+            'use_idf': self.use_idf, 'smooth_idf': self.smooth_idf, 'sublinear_tf': self.sublinear_tf
+        }
+
+    def build_analyzer(self):
+        return self._analyzer
+
+    def count_tokens(self, token_lists):
+        """Raw term counts of tokenized documents, one CSR row each"""
+        return self._hasher.transform(token_lists)
+
+    def term_counts(self, documents):
+        """Raw term counts of documents, one CSR row each"""
+        return self.count_tokens(self._analyzer(doc) for doc in documents)
+
+    def fit_transform(self, documents):
+        counts = self.term_counts(documents)
+        self.idf_ = fit_idf(self, np.bincount(counts.indices, minlength=self.n_features), counts.shape[0])
+        return apply_tfidf(self, counts, self.idf_)
+
+    def transform(self, documents):
+        return apply_tfidf(self, self.term_counts(documents), self.idf_)
+
+    def get_feature_names_out(self):
+        """None: hashed columns have no names"""
+        return None
+
+
+def create_vectorizer(mode='vocabulary', hash_features=DEFAULT_HASH_FEATURES):
+    """The vectorizer for a feature mode, unfitted"""
+    if mode not in FEATURE_MODES:
+        raise ValueError(f"Unknown feature mode: {mode}")
+    if mode == 'hashing':
+        return HashingTfidfVectorizer(hash_features)
+    return TfidfVectorizer(
+        stop_words=STOP_WORDS,
+        min_df=1,
+        max_df=1.0,
+        token_pattern=TOKEN_PATTERN,
+        ngram_range=NGRAM_RANGE
+    )
+
+
+def create_index(vectorizer, mode='vocabulary', min_bigram_df=DEFAULT_MIN_BIGRAM_DF):
+    """An empty incremental index that fits ``vectorizer`` the way ``mode`` asks"""
+    if mode == 'hashing':
+        return HashingTfidfIndex(vectorizer)
+    return IncrementalTfidfIndex(vectorizer, min_bigram_df if mode == 'pruned' else 1)
+
+
+def word_columns(vectorizer, text):
+    """Columns of the single words of ``text``, tokenized like recipes are.
+
+    Stop words are dropped; a word no indexed recipe has gives -1. Hashed
+    features give every word a column, which rare collisions may share.
+    """
+    words = [word for word in re.findall(TOKEN_PATTERN, text.lower()) if word not in ENGLISH_STOP_WORDS]
+    if not words:
+        return []
+    # One word per document, so each row holds at most its unigram
+    if isinstance(vectorizer, CountVectorizer):
+        counts = CountVectorizer.transform(vectorizer, words)
+    else:
+        counts = vectorizer.term_counts(words)
+    return [
+        int(counts.indices[counts.indptr[row]]) if counts.indptr[row + 1] > counts.indptr[row] else -1
+        for row in range(len(words))
+    ]
+
+
+def feature_signature(mode='vocabulary', hash_features=DEFAULT_HASH_FEATURES,
+                      min_bigram_df=DEFAULT_MIN_BIGRAM_DF):
+    """JSON-friendly view of the feature settings a snapshot depends on"""
+    if mode == 'hashing':
+        return {'mode': mode, 'hash_features': hash_features}
+    if mode == 'pruned':
+        return {'mode': mode, 'min_bigram_df': min_bigram_df}
+    return {'mode': mode}
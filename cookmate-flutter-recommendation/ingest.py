@@ -0,0 +1,173 @@
+import argparse
+import itertools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Only the fields the recommender scores on; Instructions are never read here
+RECIPE_PROJECTION = {'_id': 1, 'Title': 1, 'Cleaned_Ingredients': 1}
+# Recipes normalize_ingredients leaves something of: a string, or an array with a
+# string, that is not all whitespace. The others are never indexed.
+INDEXABLE_QUERY = {'Cleaned_Ingredients': {'$regex': r'\S'}}
+DEFAULT_BATCH_SIZE = 2000
+
+_analyzer = None  # Set in each pool process by _init_worker
+
+
+def _init_worker(analyzer):
+    global _analyzer
+    _analyzer = analyzer
+
+
+def normalize_ingredients(ingredients):
+    """Turn a raw ingredients field into a clean list of lowercase strings"""
+    if isinstance(ingredients, str):
+        ingredients = [ingredients]
+    elif not isinstance(ingredients, list):
+        ingredients = []
+    return [str(ing).strip().lower() for ing in ingredients if str(ing).strip()]
+
+
+def prepare_batch(documents, analyzer=None):
+    """Clean and tokenize a batch of raw recipe documents.
+
+    Runs in the pool processes. Returns the prepared records along with the
+    number of documents read, since recipes without ingredients are dropped.
+    """
+    analyzer = analyzer or _analyzer
+    records = []
+    for doc in documents:
+        ingredients = normalize_ingredients(doc.get('Cleaned_Ingredients', []))
+        if not ingredients:
+            continue
+        text = ' '.join(ingredients)
+        records.append({
+            'id': str(doc['_id']),
+            'name': doc.get('Title', ''),
+            'ingredients': text,
+            'instructions': doc.get('Instructions', ''),
+            'tokens': analyzer(text)
+        })
+    return records, len(documents)
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_mongo_batches(collection, batch_size=DEFAULT_BATCH_SIZE, projection=RECIPE_PROJECTION):
+    """Read a recipes collection in large batches with a tight projection"""
+    cursor = collection.find({}, projection, batch_size=batch_size)
+    return _chunks(cursor, batch_size)
+
+
+def iter_jsonl_batches(path, batch_size=DEFAULT_BATCH_SIZE):
+    """Read recipe documents from a JSONL file, a stand-in for MongoDB"""
+    with open(path) as f:
+        yield from _chunks((json.loads(line) for line in f if line.strip()), batch_size)
+
+
+def ingest_recipes(recommender, batches, workers=None, max_pending=4, progress=None):
+    """Stream batches of raw recipe documents into the recommender.
+
+    Cleaning and tokenization run in a process pool. A reader thread submits
+    batches as they arrive and a bounded queue of at most ``max_pending``
+    batches in flight applies backpressure to it. This thread feeds the
+    results to the index in catalog order. By default there is one worker per
+    spare CPU; ``workers=0`` prepares batches inline, which is also what a
+    single CPU gets. ``progress``, if given, is called with the recipes
+    indexed so far after every batch. Returns counts and the ingest rate in
+    recipes per second.
+    """
+    if workers is None:
+        # The calling process is busy indexing, so leave it a CPU of its own
+        workers = max((os.cpu_count() or 1) - 1, 0)
+    analyzer = recommender.vectorizer.build_analyzer()
+    stats = {'read': 0, 'indexed': 0}
+    started = time.perf_counter()
+
+    def add(records, read):
+        recommender.add_prepared_batch(records)
+        stats['read'] += read
+        stats['indexed'] += len(records)
+        if progress is not None:
+            progress(stats['indexed'])
+        elapsed = time.perf_counter() - started
+        logger.info(f"Ingested {stats['indexed']} recipes ({stats['indexed'] / elapsed:.0f} recipes/s)")
+
+    if workers <= 0:
+        for documents in batches:
+            add(*prepare_batch(documents, analyzer))
+    else:
+        pending = queue.Queue(maxsize=max_pending)
+        stop = threading.Event()
+
+        with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(analyzer,)) as pool:
+            def read_batches():
+                try:
+                    for documents in batches:
+                        if stop.is_set():
+                            break
+                        pending.put(pool.submit(prepare_batch, documents))
+                except Exception as e:
+                    pending.put(e)
+                pending.put(None)
+
+            reader = threading.Thread(target=read_batches, daemon=True)
+            reader.start()
+            try:
+                while True:
+                    item = pending.get()
+                    if item is None:
+                        break
+                    if isinstance(item, Exception):
+                        raise item
+                    add(*item.result())
+            finally:
+                # Unblock the reader if we stopped early
+                stop.set()
+                while reader.is_alive():
+                    try:
+                        pending.get(timeout=0.1)
+                    except queue.Empty:
+                        pass
+
+    elapsed = time.perf_counter() - started
+    stats['seconds'] = elapsed
+    stats['recipes_per_second'] = stats['indexed'] / elapsed if elapsed else 0.0
+    logger.info(
+        f"Ingest finished: {stats['indexed']} of {stats['read']} recipes in {elapsed:.2f}s "
+        f"({stats['recipes_per_second']:.0f} recipes/s)"
+    )
+    return stats
+
+
+if __name__ == '__main__':
+    # Benchmark ingestion from a JSONL dump instead of MongoDB
+    from recommender import RecipeRecommender
+    from log_config import configure_logging
+
+    configure_logging(log_file='')
+    parser = argparse.ArgumentParser(description='Benchmark recipe ingestion from a JSONL file')
+    parser.add_argument('path', help='JSONL file with one recipe document per line')
+    parser.add_argument('--workers', type=int, default=None, help='tokenizer processes, 0 for inline')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    recommender = RecipeRecommender()
+    stats = ingest_recipes(recommender, iter_jsonl_batches(args.path, args.batch_size), workers=args.workers)
+    finalize_started = time.perf_counter()
+    recommender.finalize()
+    stats['finalize_seconds'] = time.perf_counter() - finalize_started
+    print(json.dumps(stats, indent=2))
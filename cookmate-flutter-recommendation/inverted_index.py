@@ -0,0 +1,101 @@
+import numpy as np
+import scipy.sparse as sp
+
+from scoring import top_n_indices
+
+
+class InvertedIndex:
+    """Term -> recipe postings over the TF-IDF matrix, for candidate generation.
+
+    Scoring only visits recipes that share a term with the user vector. Terms
+    are taken one at a time, highest possible contribution first, and
+    accumulated into a sparse set of candidates. Once the remaining terms can
+    add up to less than the current n-th best score (MaxScore), no unseen
+    recipe can reach the top n. After that the remaining terms only update the
+    candidates already found. The result matches exhaustive scoring, so cost
+    follows posting-list length rather than catalog size.
+    """
+
+    def __init__(self, postings, max_weights):
+        self.postings = postings  # CSC: column j holds the recipes containing term j
+        self.max_weights = max_weights  # Largest weight in each posting list
+
+    @classmethod
+    def build(cls, recipe_vectors):
+        postings = sp.csc_matrix(recipe_vectors)
+        postings.sort_indices()
+        max_weights = np.asarray(postings.max(axis=0).toarray()).ravel()
+        return cls(postings, max_weights)
+
+    @property
+    def n_recipes(self):
+        return self.postings.shape[0]
+
+    def _posting(self, term):
+        start, end = self.postings.indptr[term], self.postings.indptr[term + 1]
+        return self.postings.indices[start:end], self.postings.data[start:end]
+
+    def top_n(self, user_vector, n, excluded=None):
+        """Return (rows, scores, candidates visited) of the n best recipes, best first.
+
+        Rows set in the boolean mask ``excluded`` are skipped as if they had
+        no postings.
+        """
+        terms = user_vector.indices
+        weights = user_vector.data
+        bounds = weights * self.max_weights[terms]
+        order = np.argsort(-bounds, kind='stable')
+        terms, weights, bounds = terms[order], weights[order], bounds[order]
+        # remaining[i] is the most terms i.. can still add to any recipe
+        remaining = np.cumsum(bounds[::-1])[::-1]
+
+        candidates = np.empty(0, dtype=np.int64)
+        scores = np.empty(0, dtype=np.float64)
+        first_pruned = len(terms)
+        for i, (term, weight) in enumerate(zip(terms, weights)):
+            if len(candidates) >= n:
+                threshold = np.partition(scores, len(scores) - n)[len(scores) - n]
+                if remaining[i] < threshold:
+                    first_pruned = i
+                    break
+            rows, values = self._posting(term)
+            if excluded is not None:
+                kept = ~excluded[rows]
+                rows, values = rows[kept], values[kept]
+            merged_rows, inverse = np.unique(np.concatenate([candidates, rows]), return_inverse=True)
+            scores = np.bincount(inverse, weights=np.concatenate([scores, values * weight]),
+                                 minlength=len(merged_rows))
+            candidates = merged_rows
+
+        # Remaining terms can only reorder the candidates we already have
+        for term, weight in zip(terms[first_pruned:], weights[first_pruned:]):
+            rows, values = self._posting(term)
+            if len(rows) == 0:
+                continue
+            positions = np.minimum(np.searchsorted(rows, candidates), len(rows) - 1)
+            hits = rows[positions] == candidates
+            scores[hits] += values[positions[hits]] * weight
+
+        best = top_n_indices(scores, n)
+        top_rows = candidates[best]
+        top_scores = scores[best]
+
+        # Fewer matches than n: fill up with zero-score recipes in catalog order,
+        # as exhaustive scoring would
+        available = self.n_recipes
+        if excluded is not None:
+            available -= int(np.count_nonzero(excluded))
+        missing = min(n, available) - len(top_rows)
+        if missing > 0:
+            pool_size = missing + len(candidates)
+            while True:
+                pool = np.arange(min(self.n_recipes, pool_size))
+                if excluded is not None:
+                    pool = pool[~excluded[pool]]
+                filler = np.setdiff1d(pool, candidates, assume_unique=True)[:missing]
+                if len(filler) == missing or pool_size >= self.n_recipes:
+                    break
+                pool_size *= 2
+            top_rows = np.concatenate([top_rows, filler])
+            top_scores = np.concatenate([top_scores, np.zeros(len(filler))])
+        return top_rows, top_scores, len(candidates)
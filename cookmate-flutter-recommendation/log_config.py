@@ -0,0 +1,134 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+
+REQUEST_LOGGER = 'cookmate.requests'
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# level: root level; request_level: level of the per-request records;
+# sample_rate: share of requests that get a record; werkzeug: level of the
+# dev server's own access log, which the request records replace in production
+PROFILES = {
+    'debug': {'level': logging.DEBUG, 'request_level': logging.INFO, 'sample_rate': 1.0,
+              'werkzeug': logging.INFO},
+    'default': {'level': logging.INFO, 'request_level': logging.INFO, 'sample_rate': 1.0,
+                'werkzeug': logging.INFO},
+    'production': {'level': logging.WARNING, 'request_level': logging.INFO, 'sample_rate': 0.01,
+                   'werkzeug': logging.WARNING},
+}
+
+_queue_handler = None
+_listener = None
+_handlers = ()
+_sample_rate = 1.0
+request_logger = logging.getLogger(REQUEST_LOGGER)
+
+
+class JsonFormatter(logging.Formatter):
+    """Render request records as one JSON object per line"""
+
+    def format(self, record):
+        fields = {'time': self.formatTime(record), 'level': record.levelname, 'event': record.getMessage()}
+        fields.update(getattr(record, 'fields', {}))
+        return json.dumps(fields, default=str)
+
+
+class _RoutingFormatter(logging.Formatter):
+    def __init__(self, text_formatter, json_formatter):
+        super().__init__()
+        self.text_formatter = text_formatter
+        self.json_formatter = json_formatter
+
+    def format(self, record):
+        if record.name == REQUEST_LOGGER:
+            return self.json_formatter.format(record)
+        return self.text_formatter.format(record)
+
+
+def _start_listener():
+    """Hand queued records to the real handlers on a background thread"""
+    global _listener
+    log_queue = queue.SimpleQueue()
+    _queue_handler.queue = log_queue
+    _listener = logging.handlers.QueueListener(log_queue, *_handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def _restart_after_fork():
+    # The listener thread does not survive a fork; without a new one the
+    # child's records would pile up in a queue nobody drains
+    if _queue_handler is not None:
+        _start_listener()
+
+
+def _stop_listener():
+    if _listener is not None:
+        _listener.stop()
+
+
+def configure_logging(profile=None, log_file=None, sample_rate=None):
+    """Route all logging through a queue drained by a background thread.
+
+    ``profile`` is one of PROFILES and defaults to the LOG_PROFILE env var,
+    then 'default'. Records go to stdout and, unless ``log_file`` (LOG_FILE,
+    default app.log) is empty, to a file, but the calling thread only
+    enqueues them. Per-request records are JSON lines on the
+    cookmate.requests logger, sampled at ``sample_rate``
+    (REQUEST_LOG_SAMPLE_RATE, else the profile's rate). Safe to call again
+    to switch profiles.
+    """
+    global _queue_handler, _handlers, _sample_rate
+    profile = profile or os.getenv('LOG_PROFILE', 'default')
+    if profile not in PROFILES:
+        raise ValueError(f"Unknown log profile {profile!r}, expected one of {sorted(PROFILES)}")
+    settings = PROFILES[profile]
+    if log_file is None:
+        log_file = os.getenv('LOG_FILE', 'app.log')
+    if sample_rate is None:
+        sample_rate = float(os.getenv('REQUEST_LOG_SAMPLE_RATE', settings['sample_rate']))
+    _sample_rate = sample_rate
+
+    text_formatter = logging.Formatter(LOG_FORMAT)
+    json_formatter = JsonFormatter()
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if log_file:
+        handlers.append(logging.FileHandler(log_file))
+    for handler in handlers:
+        # Request records carry their own fields; everything else is plain text
+        handler.setFormatter(_RoutingFormatter(text_formatter, json_formatter))
+
+    _stop_listener()
+    for handler in _handlers:
+        handler.close()
+    _handlers = tuple(handlers)
+
+    root = logging.getLogger()
+    if _queue_handler is None:
+        _queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+        os.register_at_fork(after_in_child=_restart_after_fork)
+        atexit.register(_stop_listener)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(_queue_handler)
+    root.setLevel(settings['level'])
+    request_logger.setLevel(settings['request_level'])
+    logging.getLogger('werkzeug').setLevel(settings['werkzeug'])
+    _start_listener()
+    return profile
+
+
+def should_log_request():
+    """Decide up front whether this request gets a record, before building it"""
+    if not request_logger.isEnabledFor(logging.INFO):
+        return False
+    return _sample_rate >= 1.0 or random.random() < _sample_rate
+
+
+def log_request(**fields):
+    """Emit one structured record for a request chosen by should_log_request"""
+    request_logger.info('request', extra={'fields': fields})
@@ -0,0 +1,194 @@
+import bisect
+import contextlib
+import contextvars
+import mmap
+import os
+import threading
+import time
+
+import numpy as np
+
+# Upper bounds in seconds of the histogram buckets, from a cached lookup to a full rebuild
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+           1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+# Stages timed per pipeline. Index engines pick the top k while they score, so
+# their requests spend all of that under 'scoring' and none under 'top_k'.
+STAGES = {
+    'recommend': ('cache', 'user_profile', 'user_vector', 'scoring', 'top_k', 'materialize', 'total'),
+    'recommend_batch': ('cache', 'user_profile', 'user_vector', 'scoring', 'top_k', 'materialize', 'total'),
+    'similar': ('lookup', 'materialize', 'total'),
+    'index': ('ingest', 'fit', 'inverted_index', 'facets', 'ann_index', 'neighbors', 'snapshot_save', 'snapshot_load',
+              'sync', 'compaction'),
+}
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_profile = contextvars.ContextVar('stage_profile', default=None)
+
+
+class StageClock:
+    """Times consecutive stages of one pipeline run.
+
+    ``lap`` closes the stage that just ran; lapping a stage again, e.g. once
+    per chunk of a batch, adds to its time. ``finish`` adds the run's total
+    and records every stage in one go, so a run costs one lock acquisition
+    however many stages it has.
+    """
+
+    __slots__ = ('_metrics', '_pipeline', '_started', '_last', '_laps')
+
+    def __init__(self, metrics, pipeline):
+        self._metrics = metrics
+        self._pipeline = pipeline
+        self._started = self._last = time.perf_counter()
+        self._laps = {}
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self._laps[stage] = self._laps.get(stage, 0.0) + now - self._last
+        self._last = now
+
+    def finish(self):
+        self._laps['total'] = time.perf_counter() - self._started
+        self._metrics.observe(self._pipeline, self._laps.items())
+
+
+class _NullClock:
+    __slots__ = ()
+
+    def lap(self, stage):
+        pass
+
+    def finish(self):
+        pass
+
+
+NULL_CLOCK = _NullClock()
+
+
+class PipelineMetrics:
+    """Latency histograms of every stage in STAGES, rendered for Prometheus.
+
+    Counts are kept per slot: one per process writing to them, so no lock
+    is shared between processes. With ``shared=True`` the slots live in
+    anonymous shared memory created before the pre-fork workers are, and
+    each worker records into the slot ``use_slot`` gave it; ``render`` sums
+    all of them, so whichever worker answers /metrics reports the whole
+    pool. A slot outlives its worker and is reused by its replacement, so
+    the counts only ever grow, as Prometheus counters must.
+
+    Runs recorded while a profile is active (see ``start_profile``) also report
+    their stages there, for the per-request breakdown.
+    """
+
+    def __init__(self, slots=1, shared=False, enabled=True):
+        self.enabled = enabled
+        self.series = [(pipeline, stage) for pipeline, stages in STAGES.items() for stage in stages]
+        self._series_index = {key: index for index, key in enumerate(self.series)}
+        shape = (slots, len(self.series), len(BUCKETS) + 1)
+        count_size = int(np.prod(shape))
+        if shared:
+            # MAP_SHARED anonymous memory: forked children write to the same pages
+            self._buffer = mmap.mmap(-1, count_size * 8 + slots * len(self.series) * 8)
+            self._counts = np.frombuffer(self._buffer, dtype=np.int64, count=count_size).reshape(shape)
+            self._sums = np.frombuffer(self._buffer, dtype=np.float64, offset=count_size * 8).reshape(shape[:2])
+        else:
+            self._counts = np.zeros(shape, dtype=np.int64)
+            self._sums = np.zeros(shape[:2], dtype=np.float64)
+        self._slot = 0
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def use_slot(self, slot):
+        """Record into ``slot`` from now on; each live process needs its own"""
+        self._lock = threading.Lock()  # A lock copied by fork may be held by a thread that is gone
+        self._pid = os.getpid()
+        self._slot = slot
+
+    def clock(self, pipeline):
+        """A StageClock for one run of ``pipeline``, or a no-op one when disabled"""
+        if not self.enabled:
+            return NULL_CLOCK
+        return StageClock(self, pipeline)
+
+    @contextlib.contextmanager
+    def timed(self, pipeline, stage):
+        """Time the body as one stage, for the coarse index build stages"""
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(pipeline, [(stage, time.perf_counter() - started)])
+
+    def observe(self, pipeline, laps):
+        """Record (stage, seconds) pairs of one pipeline run"""
+        if not self.enabled:
+            return
+        if self._pid != os.getpid():
+            self.use_slot(self._slot)
+        profile = _profile.get()
+        if profile is not None:
+            profile.extend((pipeline, stage, seconds) for stage, seconds in laps)
+        series_index = self._series_index
+        with self._lock:
+            counts = self._counts[self._slot]
+            sums = self._sums[self._slot]
+            for stage, seconds in laps:
+                series = series_index[pipeline, stage]
+                counts[series, bisect.bisect_left(BUCKETS, seconds)] += 1
+                sums[series] += seconds
+
+    def snapshot(self):
+        """Counts per bucket and sums of every series, summed over the slots"""
+        return self._counts.sum(axis=0), self._sums.sum(axis=0)
+
+    def render(self, gauges=None):
+        """The histograms, plus any ``gauges`` (name -> (help, value)), in Prometheus text format"""
+        counts, sums = self.snapshot()
+        cumulative = np.cumsum(counts, axis=1)
+        bounds = [format_value(bound) for bound in BUCKETS] + ['+Inf']
+        lines = [
+            '# HELP cookmate_stage_seconds Time spent in each stage of recommendation requests and index builds',
+            '# TYPE cookmate_stage_seconds histogram'
+        ]
+        for series, (pipeline, stage) in enumerate(self.series):
+            labels = f'pipeline="{pipeline}",stage="{stage}"'
+            for bound, count in zip(bounds, cumulative[series]):
+                lines.append(f'cookmate_stage_seconds_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'cookmate_stage_seconds_sum{{{labels}}} {format_value(sums[series])}')
+            lines.append(f'cookmate_stage_seconds_count{{{labels}}} {cumulative[series, -1]}')
+        for name, (help_text, value) in (gauges or {}).items():
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            lines.append(f'{name} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_value(value):
+    return repr(float(value))
+
+
+def start_profile():
+    """Collect the stages timed from now on in this context (thread or request).
+
+    Returns the list (pipeline, stage, seconds) triples are appended to, and
+    a token to hand to ``stop_profile``.
+    """
+    stages = []
+    return stages, _profile.set(stages)
+
+
+def stop_profile(token):
+    _profile.reset(token)
+
+
+def server_timing(stages):
+    """Render profiled stages as a Server-Timing header value, durations in ms"""
+    return ', '.join(
+        f'{pipeline}-{stage};dur={seconds * 1000:.3f}'
+        for pipeline, stage, seconds in stages
+    )
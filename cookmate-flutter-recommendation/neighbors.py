@@ -0,0 +1,193 @@
+import argparse
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import scipy.sparse as sp
+
+from scoring import top_n_indices
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_K = 20
+DEFAULT_SCORE_BUDGET = 2 ** 22  # Max recipe x recipe scores one block may hold
+# Terms in more than this share of the recipes, and at least MIN_MAX_POSTINGS, do not propose candidates
+DEFAULT_MAX_POSTINGS_SHARE = 0.1
+MIN_MAX_POSTINGS = 1000
+CANDIDATE_FACTOR = 8  # Candidates rescored exactly per neighbour kept
+
+_matrix = None  # Set in each pool worker by _init_worker
+_transposed = None
+_candidate_terms = None
+
+
+class RecipeNeighbors:
+    """The top ``k`` most similar recipes of every recipe, as two n x k arrays.
+
+    Row r of ``rows`` holds the matrix rows of recipe r's neighbours, best
+    first, padded with -1 when fewer than k similar recipes were found;
+    ``scores`` holds their cosine similarities. Looking one recipe up is a
+    slice, so serving costs O(k) whatever the catalog size.
+    """
+
+    def __init__(self, rows, scores):
+        self.rows = rows
+        self.scores = scores
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def k(self):
+        return self.rows.shape[1]
+
+    def of(self, row):
+        """Return (rows, scores) of one recipe's neighbours, without the padding"""
+        rows = self.rows[row]
+        kept = rows >= 0
+        return rows[kept], self.scores[row][kept]
+
+
+def max_postings_for(n_recipes):
+    """The default ``max_postings`` of compute_neighbors for a catalog of n_recipes"""
+    return max(int(n_recipes * DEFAULT_MAX_POSTINGS_SHARE), MIN_MAX_POSTINGS)
+
+
+def _init_worker(recipe_vectors, max_postings):
+    global _matrix, _transposed, _candidate_terms
+    _matrix = recipe_vectors
+    _transposed = recipe_vectors.T.tocsr()
+    # Common terms (salt, oil, ...) pair almost every recipe with every other
+    # while adding little to the scores, so only rarer terms propose candidates
+    document_frequency = np.bincount(recipe_vectors.indices, minlength=recipe_vectors.shape[1])
+    common = document_frequency > max_postings
+    if common.any():
+        rare = sp.diags((~common).astype(recipe_vectors.dtype))
+        _candidate_terms = (recipe_vectors @ rare).T.tocsr()
+        _candidate_terms.eliminate_zeros()
+    else:
+        _candidate_terms = _transposed
+
+
+def _row_candidates(products, offset, row):
+    """Columns and scores of one row of a block product, without the row itself"""
+    begin, end = products.indptr[offset], products.indptr[offset + 1]
+    columns = products.indices[begin:end]
+    kept = columns != row
+    return columns[kept], products.data[begin:end][kept]
+
+
+def _block_neighbors(start, stop, k):
+    """Top k neighbours of rows start:stop.
+
+    One sparse product over the rarer terms finds candidates; the best
+    CANDIDATE_FACTOR * k of each row are then rescored with all terms.
+    Rows with fewer candidates than that, such as recipes made of common
+    ingredients only, are scored against the whole catalog instead.
+    """
+    wanted = CANDIDATE_FACTOR * k
+    products = (_matrix[start:stop] @ _candidate_terms).tocsr()
+    products.sort_indices()  # Ties then keep catalog order, as exhaustive scoring does
+    few = np.diff(products.indptr) <= wanted
+    full = None
+    if few.any() and _candidate_terms is not _transposed:
+        full = (_matrix[start + np.flatnonzero(few)] @ _transposed).tocsr()
+        full.sort_indices()
+        full_offsets = np.cumsum(few) - 1
+    pair_rows = []
+    pair_columns = []
+    for offset in range(stop - start):
+        if full is not None and few[offset]:
+            columns, values = _row_candidates(full, full_offsets[offset], start + offset)
+        else:
+            columns, values = _row_candidates(products, offset, start + offset)
+        candidates = np.sort(columns[top_n_indices(values, wanted)])
+        pair_rows.append(np.full(len(candidates), start + offset))
+        pair_columns.append(candidates)
+
+    # Exact cosine of every (recipe, candidate) pair in one elementwise product
+    pair_rows = np.concatenate(pair_rows)
+    pair_columns = np.concatenate(pair_columns)
+    exact = np.asarray(_matrix[pair_rows].multiply(_matrix[pair_columns]).sum(axis=1)).ravel()
+    bounds = np.searchsorted(pair_rows, np.arange(start, stop + 1))
+
+    rows = np.full((stop - start, k), -1, dtype=np.int32)
+    scores = np.zeros((stop - start, k), dtype=np.float32)
+    for offset in range(stop - start):
+        columns = pair_columns[bounds[offset]:bounds[offset + 1]]
+        values = exact[bounds[offset]:bounds[offset + 1]]
+        best = top_n_indices(values, k)
+        best = best[values[best] > 0]
+        rows[offset, :len(best)] = columns[best]
+        scores[offset, :len(best)] = values[best]
+    return start, rows, scores
+
+
+def compute_neighbors(recipe_vectors, k=DEFAULT_K, workers=None, score_budget=DEFAULT_SCORE_BUDGET,
+                      max_postings=None):
+    """Find the k most similar recipes of every recipe.
+
+    Rows are taken in blocks sized so a block's scores against the whole
+    catalog stay within ``score_budget``; each block is one sparse product
+    with the transposed matrix, so only recipes sharing a term are ever
+    scored. Terms found in more than ``max_postings`` recipes are left out
+    of that product, which keeps it sparse on big catalogs; candidates are
+    rescored with every term, so the scores are exact, but two recipes
+    that share mostly common terms may not be paired. By default
+    ``max_postings`` grows with the catalog (max_postings_for), and
+    catalogs no bigger than it are searched exhaustively. Blocks are
+    spread over ``workers`` processes, one per CPU by default;
+    ``workers=0`` runs them inline.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    n_recipes = recipe_vectors.shape[0]
+    if max_postings is None:
+        max_postings = max_postings_for(n_recipes)
+    block_size = max(1, min(n_recipes, score_budget // max(n_recipes, 1)))
+    blocks = [(start, min(start + block_size, n_recipes)) for start in range(0, n_recipes, block_size)]
+    rows = np.full((n_recipes, k), -1, dtype=np.int32)
+    scores = np.zeros((n_recipes, k), dtype=np.float32)
+    started = time.perf_counter()
+
+    def store(result):
+        start, block_rows, block_scores = result
+        rows[start:start + len(block_rows)] = block_rows
+        scores[start:start + len(block_rows)] = block_scores
+
+    if workers <= 0 or len(blocks) == 1:
+        _init_worker(recipe_vectors, max_postings)
+        for start, stop in blocks:
+            store(_block_neighbors(start, stop, k))
+    else:
+        with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                 initargs=(recipe_vectors, max_postings)) as pool:
+            for result in pool.map(_block_neighbors, *zip(*blocks), [k] * len(blocks)):
+                store(result)
+    logger.info(
+        f"Computed {k} neighbours for {n_recipes} recipes in {len(blocks)} blocks "
+        f"({time.perf_counter() - started:.1f}s)"
+    )
+    return RecipeNeighbors(rows, scores)
+
+
+if __name__ == '__main__':
+    # Offline job: add neighbours to an existing snapshot
+    from recommender import RecipeRecommender
+    from log_config import configure_logging
+
+    parser = argparse.ArgumentParser(description='Precompute similar recipes into a snapshot')
+    parser.add_argument('snapshot', help='snapshot directory to update')
+    parser.add_argument('--k', type=int, default=DEFAULT_K)
+    parser.add_argument('--workers', type=int, default=None, help='processes, 0 for inline')
+    args = parser.parse_args()
+
+    configure_logging('default', log_file='')
+    recommender = RecipeRecommender(cache_size=0, similar_k=args.k, similar_workers=args.workers)
+    if not recommender.load_snapshot(args.snapshot):
+        parser.error(f'no usable snapshot at {args.snapshot}')
+    recommender.build_neighbors()
+    if recommender.save_snapshot(args.snapshot) is None:
+        parser.exit(1, 'could not save the snapshot\n')
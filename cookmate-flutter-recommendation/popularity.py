@@ -0,0 +1,153 @@
+import heapq
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HALF_LIFE = 24 * 3600
+DEFAULT_REFRESH_INTERVAL = 60
+DEFAULT_TOP_SIZE = 100
+DEFAULT_MAX_RECIPES = 100000
+MAX_EXPONENT = 64  # Counters are rescaled before the event weight grows past 2 ** this
+
+
+class PopularityRanking:
+    """Time-decayed popularity of recipes, from tracking events.
+
+    Each event adds 1 to its recipe's counter and counters halve every
+    ``half_life`` seconds. Rather than decaying every counter, events are
+    weighted by 2 ** (age of the stream / half_life), which ranks the same;
+    the counters are rescaled now and then to keep the numbers small. At
+    most ``max_recipes`` counters are kept: beyond that the weakest are
+    dropped, since they could not make the top list anyway.
+
+    A background thread ranks the counters every ``refresh_interval``
+    seconds into a list of the ``top_size`` most popular recipe ids, so
+    ``top`` is only a slice; until that list has anything, ``top`` ranks
+    the counters itself. The thread is started lazily per process, like
+    the user store's writer, so an instance created before forking works in
+    every worker.
+
+    ``seed``, if given, returns the (recipe_id, tracked_at) pairs tracked
+    before, such as UserStore.tracked_recipes. Each process then starts its
+    counters from it on the background thread, so a restarted server or a
+    new worker ranks the history kept in the store rather than nothing.
+    Later events are only counted by the process that served them.
+    """
+
+    def __init__(self, half_life=DEFAULT_HALF_LIFE, refresh_interval=DEFAULT_REFRESH_INTERVAL,
+                 top_size=DEFAULT_TOP_SIZE, max_recipes=DEFAULT_MAX_RECIPES, seed=None):
+        self.half_life = half_life
+        self.refresh_interval = refresh_interval
+        self.top_size = top_size
+        self.max_recipes = max_recipes
+        self.seed = seed
+        self._counters = {}  # recipe_id -> weighted count, in units of the epoch
+        self._epoch = time.time()
+        self._ranking = []  # (recipe_id, score) pairs, most popular first
+        self._ranked_events = 0  # Events counted when the ranking was last made
+        self._lock = threading.Lock()
+        self._pid = None
+        self.events = 0
+        self.seeded = 0
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            seed_before = time.time()
+            if self.seed is not None:
+                # The store holds what a parent process counted too
+                self._counters = {}
+                self._ranking = []
+        threading.Thread(target=self._run, args=(seed_before,), name='popularity-refresh', daemon=True).start()
+
+    def record(self, recipe_id, now=None):
+        """Count one tracking event of a recipe"""
+        self._ensure_started()
+        with self._lock:
+            self._count(recipe_id, time.time() if now is None else now)
+
+    def _count(self, recipe_id, now):
+        exponent = (now - self._epoch) / self.half_life if self.half_life else 0.0
+        if exponent > MAX_EXPONENT:
+            self._rescale(now)
+            exponent = 0.0
+        self._counters[recipe_id] = self._counters.get(recipe_id, 0.0) + 2.0 ** exponent
+        self.events += 1
+        if len(self._counters) > 2 * self.max_recipes:
+            self._prune()
+
+    def seed_from(self, tracked, before):
+        """Count earlier events, (recipe_id, tracked_at) pairs, tracked before ``before``.
+
+        Later ones are left out, since this process counts them as they come.
+        Returns how many were counted.
+        """
+        counted = 0
+        for recipe_id, tracked_at in tracked:
+            if tracked_at < before:
+                with self._lock:
+                    self._count(recipe_id, tracked_at)
+                counted += 1
+        self.seeded += counted
+        return counted
+
+    def top(self, n):
+        """The n most popular recipes as of the last refresh, as (recipe_id, score) pairs"""
+        self._ensure_started()
+        if not self._ranking and self.events != self._ranked_events:
+            # Nothing ranked yet: a new process should not wait a refresh interval
+            self.refresh()
+        return self._ranking[:n]
+
+    def refresh(self, now=None):
+        """Rank the counters into the top list that ``top`` serves"""
+        now = time.time() if now is None else now
+        with self._lock:
+            if len(self._counters) > self.max_recipes:
+                self._prune()
+            best = heapq.nlargest(self.top_size, self._counters.items(), key=lambda item: item[1])
+            # Scores are reported as decayed event counts as of now
+            scale = 2.0 ** (-(now - self._epoch) / self.half_life) if self.half_life else 1.0
+            self._ranked_events = self.events
+        self._ranking = [(recipe_id, count * scale) for recipe_id, count in best]
+        return self._ranking
+
+    def _rescale(self, now):
+        factor = 2.0 ** (-(now - self._epoch) / self.half_life)
+        self._counters = {recipe_id: count * factor for recipe_id, count in self._counters.items()}
+        self._epoch = now
+
+    def _prune(self):
+        self._counters = dict(heapq.nlargest(self.max_recipes, self._counters.items(), key=lambda item: item[1]))
+
+    def _run(self, seed_before):
+        if self.seed is not None:
+            try:
+                started = time.perf_counter()
+                counted = self.seed_from(self.seed(), seed_before)
+                self.refresh()
+                logger.info(f"Ranked {counted} earlier tracking events in {time.perf_counter() - started:.2f}s")
+            except Exception as e:
+                logger.error(f"Error loading earlier tracking events: {str(e)}")
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.error(f"Error ranking popular recipes: {str(e)}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                'events': self.events,
+                'seeded': self.seeded,
+                'recipes': len(self._counters),
+                'ranked': len(self._ranking)
+            }
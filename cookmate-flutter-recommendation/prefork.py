@@ -0,0 +1,203 @@
+import logging
+import os
+import select
+import signal
+import socket
+import threading
+import time
+
+from serving import serve
+
+logger = logging.getLogger(__name__)
+
+READY_TIMEOUT = 60  # Seconds a replacement worker gets to start before a restart gives up
+STOP_TIMEOUT = 30  # Seconds a stopped worker gets to finish its requests before it is killed
+
+
+class PreforkServer:
+    """Serve a WSGI app from a pool of forked worker processes.
+
+    The parent binds the listening socket once and forks ``workers`` children
+    that all accept on it. ``on_worker_start`` runs in each child right after
+    the fork, which is where it should map the shared index, and
+    ``on_worker_exit`` runs as the child exits, e.g. to commit buffered
+    writes. ``serve``, if given, is called in each child with the listening
+    socket and an Event set once the worker is asked to stop, and serves
+    the app on that socket until then; werkzeug's threaded server is the
+    default. Each live worker has its own ``worker_slot``, from 0 to
+    ``workers`` (a rolling restart briefly runs one extra worker), which
+    replacements reuse, e.g. to index per-worker shared counters. The parent
+    only supervises: it respawns workers that die, and replaces all of them
+    one by one when ``reload()`` is called or it receives SIGHUP.
+
+    A worker tells the parent it is ready through a pipe once
+    ``on_worker_start`` returned, and a rolling restart only stops the
+    worker being replaced after that. Stopped workers (SIGTERM) stop
+    accepting and finish the requests they have before exiting.
+    """
+
+    def __init__(self, app, host, port, workers, on_worker_start=None, on_worker_exit=None, backlog=128,
+                 serve=None, ready_timeout=READY_TIMEOUT, stop_timeout=STOP_TIMEOUT):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.on_worker_start = on_worker_start
+        self.on_worker_exit = on_worker_exit
+        self.backlog = backlog
+        self.serve = serve
+        self.ready_timeout = ready_timeout
+        self.stop_timeout = stop_timeout
+        self.socket = None
+        self.children = {}  # pid -> worker slot
+        self.worker_slot = None  # Set in each worker
+        self._ready_pipes = {}  # pid -> read end of the pipe the worker reports ready on
+        self._stopping = False
+        self._reload_requested = False
+
+    def reload(self):
+        """Ask the supervisor to replace every worker, e.g. after a new snapshot"""
+        self._reload_requested = True
+
+    def serve_forever(self):
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((self.host, self.port))
+        self.socket.listen(self.backlog)
+        self.socket.set_inheritable(True)
+
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, lambda signum, frame: self.reload())
+
+        logger.info(f"Starting {self.workers} workers on {self.host}:{self.port}")
+        for _ in range(self.workers):
+            self._spawn()
+
+        try:
+            while not self._stopping:
+                self._reap()
+                if self._reload_requested:
+                    self._reload_requested = False
+                    self._rolling_restart()
+                while len(self.children) < self.workers and not self._stopping:
+                    self._spawn()
+                time.sleep(0.5)
+        finally:
+            self._terminate(*self.children)
+            self.socket.close()
+
+    def _handle_stop(self, signum, frame):
+        self._stopping = True
+
+    def _spawn(self):
+        slot = min(set(range(self.workers + 1)) - set(self.children.values()))
+        ready_read, ready_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_read)
+            for fd in self._ready_pipes.values():
+                os.close(fd)
+            self._ready_pipes = {}
+            self.worker_slot = slot
+            self._run_worker(ready_write)
+        os.close(ready_write)
+        self.children[pid] = slot
+        self._ready_pipes[pid] = ready_read
+        return pid
+
+    def _run_worker(self, ready):
+        """Body of a worker process; never returns"""
+        status = 0
+        stop = threading.Event()
+        try:
+            signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGHUP, signal.SIG_DFL)
+            if self.on_worker_start is not None:
+                self.on_worker_start()
+            os.write(ready, b'1')
+            os.close(ready)
+            logger.info(f"Worker {os.getpid()} ready")
+            if self.serve is not None:
+                self.serve(self.socket, stop)
+            else:
+                serve(self.app, self.host, self.port, sock=self.socket, stop=stop)
+        except SystemExit:
+            pass
+        except Exception as e:
+            logger.error(f"Worker {os.getpid()} failed: {str(e)}")
+            status = 1
+        finally:
+            if self.on_worker_exit is not None:
+                try:
+                    self.on_worker_exit()
+                except Exception as e:
+                    logger.error(f"Worker {os.getpid()} exit hook failed: {str(e)}")
+            os._exit(status)
+
+    def _wait_ready(self, pid):
+        """Whether the worker reported ready within ready_timeout; False if it exited first"""
+        fd = self._ready_pipes.pop(pid)
+        try:
+            readable, _, _ = select.select([fd], [], [], self.ready_timeout)
+            # A worker that exits without reporting closes the pipe, which reads as b''
+            return bool(readable) and os.read(fd, 1) == b'1'
+        finally:
+            os.close(fd)
+
+    def _forget(self, pid):
+        self.children.pop(pid, None)
+        fd = self._ready_pipes.pop(pid, None)
+        if fd is not None:
+            os.close(fd)
+
+    def _reap(self):
+        """Forget workers that exited so the supervisor loop replaces them"""
+        for pid in list(self.children):
+            try:
+                done, status = os.waitpid(pid, os.WNOHANG)
+            except ChildProcessError:
+                done = pid
+            if done:
+                self._forget(pid)
+                if not self._stopping:
+                    logger.warning(f"Worker {pid} exited, starting a replacement")
+
+    def _rolling_restart(self):
+        """Replace workers one at a time so the pool keeps serving"""
+        for pid in list(self.children):
+            if self._stopping:
+                return
+            fresh = self._spawn()
+            if not self._wait_ready(fresh):
+                logger.error(f"Worker {fresh} did not get ready, keeping worker {pid} and the rest")
+                self._terminate(fresh)
+                return
+            self._terminate(pid)
+        logger.info("All workers restarted")
+
+    def _terminate(self, *pids):
+        """Stop workers and wait for them to finish their requests, killing any still busy after stop_timeout"""
+        for pid in pids:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        deadline = time.time() + self.stop_timeout
+        for pid in pids:
+            while time.time() < deadline:
+                try:
+                    done, _ = os.waitpid(pid, os.WNOHANG)
+                except ChildProcessError:
+                    break
+                if done:
+                    break
+                time.sleep(0.1)
+            else:
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                    os.waitpid(pid, 0)
+                except (ProcessLookupError, ChildProcessError):
+                    pass
+            self._forget(pid)
@@ -0,0 +1,93 @@
+import math
+import threading
+import time
+
+DEFAULT_RETRY_AFTER = 5
+MAX_RETRY_AFTER = 300
+
+
+class LoadProgress:
+    """Where loading the index stands, for /healthz, /readyz and 503 responses.
+
+    The server answers as soon as it starts; the index is loaded on a
+    background thread, from the snapshot when there is one and then from
+    MongoDB. ``ready`` turns true once a first index is served and stays
+    true through later rebuilds, which swap in only when finished, so
+    ``phase`` can be a reload in progress while requests are still served
+    from the previous index.
+
+    Phases: 'starting', 'snapshot', 'waiting_for_snapshot', 'connecting',
+    'indexing', 'weighting', 'neighbours', 'saving', 'ready' and 'failed'.
+    """
+
+    def __init__(self, retry_after=DEFAULT_RETRY_AFTER):
+        self.retry_interval = retry_after
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.ready = False
+        self.source = None  # 'snapshot' or 'mongodb' (or 'benchmark'), once ready
+        self.recipes = 0
+        self.phase = 'starting'
+        self.phase_started = time.time()
+        self.loaded = 0
+        self.expected = None
+        self.attempts = 0
+        self.error = None
+
+    def begin(self, phase, expected=None):
+        """Enter a phase of the load; ``expected`` is how many recipes it should reach"""
+        with self._lock:
+            if phase == 'connecting':
+                self.attempts += 1
+                self.loaded = 0
+                self.expected = None
+            self.phase = phase
+            self.phase_started = time.time()
+            if expected is not None:
+                self.expected = expected
+
+    def advance(self, loaded):
+        """Recipes indexed so far by the load in progress"""
+        self.loaded = loaded
+
+    def fail(self, error):
+        with self._lock:
+            self.phase = 'failed'
+            self.phase_started = time.time()
+            self.error = str(error)
+
+    def mark_ready(self, source, recipes):
+        """A freshly loaded index from ``source`` is now the one served"""
+        with self._lock:
+            self.ready = True
+            self.source = source
+            self.recipes = recipes
+            self.phase = 'ready'
+            self.phase_started = time.time()
+            self.error = None
+
+    def retry_after(self):
+        """Seconds a client turned away should wait, from the indexing rate when there is one"""
+        with self._lock:
+            elapsed = time.time() - self.phase_started
+            if self.phase == 'indexing' and self.expected and self.loaded and elapsed > 0:
+                remaining = max(self.expected - self.loaded, 0) / (self.loaded / elapsed)
+                return min(max(math.ceil(remaining), 1), MAX_RETRY_AFTER)
+            return self.retry_interval
+
+    def status(self):
+        """JSON-friendly view of the load"""
+        with self._lock:
+            now = time.time()
+            return {
+                'ready': self.ready,
+                'source': self.source,
+                'recipes': self.recipes,
+                'phase': self.phase,
+                'phase_seconds': round(now - self.phase_started, 3),
+                'loaded': self.loaded,
+                'expected': self.expected,
+                'attempts': self.attempts,
+                'error': self.error,
+                'uptime_seconds': round(now - self.started, 3)
+            }
@@ -0,0 +1,241 @@
+import os
+import tempfile
+import threading
+from array import array
+
+import numpy as np
+
+INSTRUCTIONS_FETCH_BATCH = 1000
+RECIPE_FIELDS = ('id', 'name', 'ingredients', 'instructions')
+
+
+class StringBuffer:
+    """Append-only column of strings packed into one UTF-8 buffer.
+
+    Costs the encoded bytes plus an 8-byte offset per string, instead of a
+    Python str object each.
+    """
+
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = array('q', [0])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def append(self, value):
+        self.data += str(value).encode('utf-8')
+        self.offsets.append(len(self.data))
+
+    def __getitem__(self, row):
+        return self.data[self.offsets[row]:self.offsets[row + 1]].decode('utf-8')
+
+    def tolist(self):
+        return [self[row] for row in range(len(self))]
+
+
+class SpillColumn:
+    """Append-only string column kept in an unnamed temp file, read back with pread.
+
+    Used for long text such as instructions that is rarely read. Nothing but
+    the offsets stays in memory, and forked workers can read the inherited
+    file descriptor concurrently.
+    """
+
+    def __init__(self):
+        self.file = None
+        self.size = 0
+        self.offsets = array('q', [0])
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def append(self, value):
+        encoded = str(value or '').encode('utf-8')
+        with self._lock:
+            if encoded:
+                if self.file is None:
+                    self.file = tempfile.TemporaryFile()
+                os.pwrite(self.file.fileno(), encoded, self.size)
+                self.size += len(encoded)
+            self.offsets.append(self.size)
+
+    def __getitem__(self, row):
+        start, end = self.offsets[row], self.offsets[row + 1]
+        if start == end:
+            return ''
+        return os.pread(self.file.fileno(), end - start, start).decode('utf-8')
+
+
+class IdIndex:
+    """Open-addressing hash index from recipe id to row.
+
+    Keys are never stored; a probe checks the candidate row's id in the id
+    column. Costs one hash and about two table slots (8 bytes each) per id.
+    An id added again points at its newest row.
+    """
+
+    def __init__(self, ids):
+        self.ids = ids  # The id column the rows refer to
+        self.hashes = array('q')
+        self.table = np.full(8, -1, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def add(self, recipe_id):
+        """Index the id stored at the next row"""
+        row = len(self.hashes)
+        self.hashes.append(hash(recipe_id))
+        if 2 * len(self.hashes) > len(self.table):
+            self._resize(2 * len(self.table))
+        else:
+            self._insert(row)
+
+    def get(self, recipe_id, default=None):
+        mask = len(self.table) - 1
+        recipe_hash = hash(recipe_id)
+        slot = recipe_hash & mask
+        while True:
+            row = self.table[slot]
+            if row < 0:
+                return default
+            if self.hashes[row] == recipe_hash and self.ids[row] == recipe_id:
+                return int(row)
+            slot = (slot + 1) & mask
+
+    def _insert(self, row):
+        mask = len(self.table) - 1
+        recipe_hash = self.hashes[row]
+        slot = recipe_hash & mask
+        while self.table[slot] >= 0:
+            other = self.table[slot]
+            if self.hashes[other] == recipe_hash and self.ids[other] == self.ids[row]:
+                break
+            slot = (slot + 1) & mask
+        self.table[slot] = row
+
+    def _resize(self, size):
+        self.table = np.full(size, -1, dtype=np.int64)
+        for row in range(len(self.hashes)):
+            self._insert(row)
+
+
+def fill_instructions(recipe_ids, values, loader):
+    """Fetch missing instructions through ``loader`` in batches"""
+    if loader is None:
+        return values
+    missing = [position for position, value in enumerate(values) if not value]
+    for start in range(0, len(missing), INSTRUCTIONS_FETCH_BATCH):
+        positions = missing[start:start + INSTRUCTIONS_FETCH_BATCH]
+        fetched = loader([recipe_ids[position] for position in positions])
+        for position in positions:
+            values[position] = fetched.get(recipe_ids[position], '')
+    return values
+
+
+class RecordsMixin:
+    """Builds recipe dicts from whichever columns a caller asks for.
+
+    Subclasses provide ``column_values(field, rows)``; instructions are only
+    fetched when they are asked for.
+    """
+
+    def records(self, rows=None, fields=RECIPE_FIELDS):
+        """Records of the given rows, or all of them, with only ``fields``"""
+        rows = range(len(self)) if rows is None else rows
+        columns = [self.column_values(field, rows) for field in fields]
+        return [dict(zip(fields, values)) for values in zip(*columns)]
+
+
+class RecipeStore(RecordsMixin):
+    """Compact columnar store of recipe metadata.
+
+    Ids and names are packed string buffers, and ingredients are interned word
+    ids, so each recipe costs a few dozen bytes of arrays instead of several
+    Python objects. An IdIndex finds the row of an id in O(1). Instructions
+    are never held in memory: ones given when a recipe is added are spilled to
+    a temp file, and missing ones are fetched by ``instructions_loader``
+    (recipe ids -> {id: text}) only when a response asks for them.
+    """
+
+    def __init__(self, instructions_loader=None):
+        self.ids = StringBuffer()
+        self.names = StringBuffer()
+        self.words = []  # Interned ingredient words, by id
+        self.word_ids = {}
+        self.ingredient_tokens = array('i')
+        self.ingredient_offsets = array('q', [0])
+        self.instructions_column = SpillColumn()
+        self.id_index = IdIndex(self.ids)
+        self.instructions_loader = instructions_loader
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def empty(self):
+        return len(self) == 0
+
+    def extend(self, records):
+        """Append recipes given as dicts with id, name, ingredients and instructions"""
+        for record in records:
+            recipe_id = str(record['id'])
+            self.ids.append(recipe_id)
+            self.id_index.add(recipe_id)
+            self.names.append(record.get('name') or '')
+            for word in str(record.get('ingredients') or '').split():
+                word_id = self.word_ids.get(word)
+                if word_id is None:
+                    word_id = self.word_ids[word] = len(self.words)
+                    self.words.append(word)
+                self.ingredient_tokens.append(word_id)
+            self.ingredient_offsets.append(len(self.ingredient_tokens))
+            self.instructions_column.append(record.get('instructions'))
+
+    def row_of(self, recipe_id):
+        """Row of a recipe id, or None"""
+        return self.id_index.get(str(recipe_id))
+
+    def ingredient_words(self, row):
+        tokens = self.ingredient_tokens[self.ingredient_offsets[row]:self.ingredient_offsets[row + 1]]
+        return [self.words[token] for token in tokens]
+
+    def ingredients(self, row):
+        return ' '.join(self.ingredient_words(row))
+
+    def ingredient_texts(self):
+        """Joined ingredients of every recipe, in row order, for refitting the vectorizer"""
+        return [self.ingredients(row) for row in range(len(self))]
+
+    def instructions(self, rows, fetch=True):
+        """Instructions of the given rows, fetching missing ones unless ``fetch`` is off"""
+        values = [self.instructions_column[row] for row in rows]
+        if fetch:
+            fill_instructions([self.ids[row] for row in rows], values, self.instructions_loader)
+        return values
+
+    def record(self, row):
+        """Id, name and ingredients of one row; instructions are left to records()"""
+        return {'id': self.ids[row], 'name': self.names[row], 'ingredients': self.ingredients(row)}
+
+    def column_values(self, field, rows):
+        if field == 'id':
+            return [self.ids[row] for row in rows]
+        if field == 'name':
+            return [self.names[row] for row in rows]
+        if field == 'ingredients':
+            return [self.ingredients(row) for row in rows]
+        if field == 'instructions':
+            return self.instructions(rows)
+        raise KeyError(field)
+
+    def columns(self):
+        """(ids, names, ingredients, instructions) lists, as written to a snapshot.
+
+        Only instructions held locally are included; fetching every one would
+        mean a full scan of the source.
+        """
+        rows = range(len(self))
+        return self.ids.tolist(), self.names.tolist(), self.ingredient_texts(), self.instructions(rows, fetch=False)
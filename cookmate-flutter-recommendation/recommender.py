@@ -1,51 +1,103 @@
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import pandas as pd
+import scipy.sparse as sp
 import logging
+import threading
+import time
+import uuid
+from scoring import score_recipes, top_n_indices, weighted_query_vectors
+from features import (create_vectorizer, create_index, feature_signature, word_columns,
+                      DEFAULT_HASH_FEATURES, DEFAULT_MIN_BIGRAM_DF)
+from inverted_index import InvertedIndex
+from facets import FacetIndex
+from ann import IvfIndex
+from neighbors import RecipeNeighbors, compute_neighbors
+import snapshot
+from ingest import normalize_ingredients
+from cache import RecommendationCache
+from recipe_store import RecipeStore, RECIPE_FIELDS
+from user_store import MemoryUserStore
+from popularity import PopularityRanking
+from metrics import PipelineMetrics
 
-# Set up logging
-logging.basicConfig(level=logging.INFO, format='%(message)s')
+# Handlers and levels are set by log_config; per-request detail is DEBUG and
+# only formatted when DEBUG is enabled
 logger = logging.getLogger(__name__)
 
 class RecipeRecommender:
-    def __init__(self):
-        self.recipes = pd.DataFrame(columns=['id', 'name', 'ingredients', 'instructions'])
-        self.user_preferences = {}
-        self.vectorizer = TfidfVectorizer(
-            stop_words='english',
-            min_df=1,
-            max_df=1.0,
-            token_pattern=r'(?u)\b\w+\b',
-            ngram_range=(1, 2)  # Allow both single words and pairs of words
-        )
+    def __init__(self, incremental=True, cache_size=10000, cache_ttl=300,
+                 engine='exact', ann_probes=8, ann_min_recipes=100000, instructions_loader=None,
+                 user_store=None, exclude_seen=True, similar_k=0, similar_workers=None, popularity=None,
+                 metrics=None, feature_mode='vocabulary', hash_features=DEFAULT_HASH_FEATURES,
+                 min_bigram_df=DEFAULT_MIN_BIGRAM_DF):
+        # Row i of recipe_vectors is row i of the store. Instructions are not kept
+        # in memory; instructions_loader(recipe_ids) -> {id: text} fetches them.
+        self.instructions_loader = instructions_loader
+        self.recipes = RecipeStore(instructions_loader)
+        # Tracked ingredients per user; see user_store for the backends
+        self.user_store = user_store if user_store is not None else MemoryUserStore()
+        self.exclude_seen = exclude_seen  # Leave out recipes the user already tracked
+        # Decayed tracking counts per recipe, served to users the content model cannot score
+        self.popularity = popularity if popularity is not None else PopularityRanking()
+        # Stage latency histograms of requests and index builds, served at /metrics
+        self.metrics = metrics if metrics is not None else PipelineMetrics()
+        # 'vocabulary' keeps every word and word pair seen, 'pruned' drops pairs found in
+        # fewer than min_bigram_df recipes, 'hashing' hashes terms into hash_features columns
+        self.feature_mode = feature_mode
+        self.hash_features = hash_features
+        self.min_bigram_df = min_bigram_df
+        self.vectorizer = create_vectorizer(feature_mode, hash_features)
         self.recipe_vectors = None
+        self.inverted_index = None  # Term -> recipe postings, rebuilt with recipe_vectors
+        self.facets = None  # Bitmaps of the common terms over those postings, for filters
+        # 'ann' scores only recipes from the closest clusters once the catalog has
+        # ann_min_recipes; ann_probes trades latency for recall
+        self.engine = engine
+        self.ann_probes = ann_probes
+        self.ann_min_recipes = ann_min_recipes
+        self.ann_index = None
+        # Top similar_k neighbours of every recipe for "more like this", built by
+        # build_neighbors (0 leaves them to be scored per request)
+        self.similar_k = similar_k
+        self.similar_workers = similar_workers
+        self.neighbors = None
+        # Tombstones: True for rows of deleted or replaced recipes, None while there are none.
+        # live_rows lists the other rows in order, for listings.
+        self.deleted = None
+        self.live_rows = None
+        self.stale_rows = 0  # Rows added with the vocabulary and IDF of an earlier fit
+        self.feature_names = None  # Cached vocabulary terms, refreshed on every fit
         self.batch_size = 1000  # Process recipes in batches
         self.current_batch = []
         self.vectorizer_ready = False  # Flag to track if vectorizer is ready
+        # Incremental mode tokenizes each batch once and weights the index lazily,
+        # instead of refitting every recipe loaded so far on each batch
+        self.incremental = incremental
+        self.index = create_index(self.vectorizer, feature_mode, min_bigram_df) if incremental else None
+        self.pending_recipes = []  # Record batches not yet merged into self.recipes
+        self._index_lock = threading.RLock()
+        self.catalog_fingerprint = None  # Set when the index is saved to or loaded from a snapshot
+        self.index_version = None  # Changes whenever the indexed catalog does, for ETags
+        self.read_only = False  # True while serving a shared, memory-mapped snapshot
+        self.batch_score_budget = 2 ** 22  # Max user x recipe scores held at once by batch scoring
+        # Recent results per (user, n); dropped when the user's ingredients or the index change
+        self.recommendation_cache = RecommendationCache(cache_size, cache_ttl)
         logger.info("Recipe recommender system initialized")
         
     def add_recipe(self, recipe_id, name, ingredients, instructions):
         """Add a new recipe to the system"""
+        if self.read_only:
+            logger.warning(f"Index is a read-only shared snapshot, ignoring recipe {recipe_id}")
+            return
         try:
-            # Ensure ingredients is a list of strings
-            if isinstance(ingredients, str):
-                ingredients = [ingredients]
-            elif not isinstance(ingredients, list):
-                ingredients = []
-            
             # Clean and process ingredients
-            processed_ingredients = [str(ing).strip().lower() for ing in ingredients if str(ing).strip()]
+            processed_ingredients = normalize_ingredients(ingredients)
             
             if not processed_ingredients:
                 logger.warning(f"Recipe {recipe_id} has no valid ingredients")
                 return
             
             # Log recipe details
-            logger.info(f"Adding recipe: {name}")
-            logger.info(f"Recipe ID: {recipe_id}")
-            logger.info(f"Number of ingredients: {len(processed_ingredients)}")
-            logger.info(f"Sample ingredients: {processed_ingredients[:5]}")
+            logger.debug(f"Adding recipe {recipe_id}: {name} ({len(processed_ingredients)} ingredients)")
             
             # Add to current batch
             self.current_batch.append({
@@ -66,30 +118,31 @@ class RecipeRecommender:
             import traceback
             logger.error(f"Traceback: {traceback.format_exc()}")
     
+    def add_prepared_batch(self, records):
+        """Add a batch of recipes already cleaned and tokenized by the ingest pipeline"""
+        if self.read_only:
+            logger.warning(f"Index is a read-only shared snapshot, ignoring {len(records)} recipes")
+            return
+        if not records:
+            return
+        
+        # Recipes queued through add_recipe go first so rows stay in arrival order
+        self._process_batch()
+        try:
+            self._index_batch(records, [record['tokens'] for record in records])
+        except Exception as e:
+            logger.error(f"Error adding prepared batch: {str(e)}")
+            logger.error(f"Error details: {type(e).__name__}: {str(e)}")
+            import traceback
+            logger.error(f"Traceback: {traceback.format_exc()}")
+    
     def _process_batch(self):
         """Process the current batch of recipes"""
         if not self.current_batch:
             return
             
         try:
-            # Convert batch to DataFrame
-            batch_df = pd.DataFrame(self.current_batch)
-            
-            # Log batch details
-            logger.info(f"Processing batch of {len(self.current_batch)} recipes")
-            logger.info(f"Total recipes before batch: {len(self.recipes)}")
-            
-            # Add to main recipes DataFrame
-            self.recipes = pd.concat([self.recipes, batch_df], ignore_index=True)
-            
-            # Log recipe statistics
-            logger.info(f"Total recipes after batch: {len(self.recipes)}")
-            logger.info(f"Sample recipe names in batch: {batch_df['name'].head(3).tolist()}")
-            
-            # Update vectors for all recipes
-            self._update_vectors()
-            
-            logger.info(f"Processed batch. Total recipes: {len(self.recipes)}")
+            self._index_batch(self.current_batch)
             
             # Clear the batch
             self.current_batch = []
@@ -100,40 +153,144 @@ class RecipeRecommender:
             import traceback
             logger.error(f"Traceback: {traceback.format_exc()}")
     
+    def _index_batch(self, records, token_lists=None):
+        """Add a batch of recipe dicts to the index, tokenizing it unless tokens are given"""
+        # Log batch details
+        logger.info(f"Processing batch of {len(records)} recipes")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Sample recipe names in batch: {[record['name'] for record in records[:3]]}")
+        
+        if self.incremental:
+            # Only tokenize this batch; weighting waits for the next query or finalize()
+            with self._index_lock:
+                if token_lists is None:
+                    self.index.add_documents([record['ingredients'] for record in records])
+                else:
+                    self.index.add_tokenized(token_lists)
+                self.pending_recipes.append(records)
+            logger.info(f"Indexed batch. Total recipes: {self.index.n_docs}")
+        else:
+            # Add to the recipe store
+            self.recipes.extend(records)
+            
+            # Update vectors for all recipes
+            self._update_vectors()
+            
+            logger.info(f"Processed batch. Total recipes: {len(self.recipes)}")
+    
     def track_user_behavior(self, user_id, recipe_id, ingredients_used):
         """Track which ingredients a user has used"""
         try:
-            if user_id not in self.user_preferences:
-                self.user_preferences[user_id] = set()
+            # Add ingredients to user's weighted profile
+            ingredients = {str(ingredient).strip().lower() for ingredient in ingredients_used}
+            ingredients.discard('')
+            recipe_id = str(recipe_id) if recipe_id is not None else None
             
-            # Add ingredients to user's preferences
-            for ingredient in ingredients_used:
-                ingredient = str(ingredient).strip().lower()
-                if ingredient:
-                    self.user_preferences[user_id].add(ingredient)
+            # Cached results are stale once the profile changed
+            if self.user_store.add(user_id, ingredients, recipe_id):
+                self.recommendation_cache.invalidate_user(user_id)
+            if recipe_id is not None:
+                self.popularity.record(recipe_id)
             
-            logger.info(f"Tracked {len(ingredients_used)} ingredients for user {user_id}")
-            logger.info(f"User {user_id} now has {len(self.user_preferences[user_id])} total ingredients")
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Tracked {len(ingredients_used)} ingredients for user {user_id}")
             
         except Exception as e:
             logger.error(f"Error tracking behavior: {str(e)}")
             logger.error(f"Error details: {type(e).__name__}: {str(e)}")
                 
+    def finalize(self):
+        """Process the last partial batch and weight the index before serving"""
+        self._process_batch()
+        self._ensure_vectors()
+    
+    def _ensure_vectors(self):
+        """Bring the recipe vectors up to date with every indexed batch"""
+        if self.incremental and self.index.dirty:
+            with self._index_lock:
+                if self.index.dirty:
+                    self._update_vectors()
+    
     def _update_vectors(self):
-        """Update the TF-IDF vectors for all recipes"""
+        """Update the TF-IDF vectors for all recipes.
+        
+        The matrix and everything derived from it are built aside and swapped
+        in together, so queries meanwhile are served from the previous index.
+        """
         try:
-            if not self.recipes.empty:
+            started = time.perf_counter()
+            vectorizer = self.vectorizer
+            deleted, live_rows = self.deleted, self.live_rows
+            if self.incremental:
+                # Merge the pending batches once, then weight the accumulated counts
+                for records in self.pending_recipes:
+                    self.recipes.extend(records)
+                self.pending_recipes = []
+                recipe_vectors = self.index.finalize()
+                vocabulary = self.index.feature_names
+            elif not self.recipes.empty:
                 # Get all recipe ingredients
-                all_ingredients = self.recipes['ingredients'].tolist()
+                all_ingredients = self.recipes.ingredient_texts()
+                n_rows = len(all_ingredients)
+                if self.deleted is not None:
+                    # Tombstones left by a sync stay in the store; fit on the live rows
+                    # only and keep the others as empty rows, so rows still match the store
+                    deleted = np.zeros(n_rows, dtype=bool)
+                    deleted[:len(self.deleted)] = self.deleted
+                    live_rows = np.flatnonzero(~deleted)
+                    all_ingredients = [all_ingredients[row] for row in live_rows]
                 
-                # Fit and transform all recipes at once
-                self.recipe_vectors = self.vectorizer.fit_transform(all_ingredients)
+                # A fresh vectorizer, so queries keep the one that matches the served matrix
+                vectorizer = create_vectorizer(self.feature_mode, self.hash_features)
+                if self.feature_mode == 'pruned':
+                    # The vectorizer's own min_df would prune single words too
+                    index = create_index(vectorizer, self.feature_mode, self.min_bigram_df)
+                    index.add_documents(all_ingredients)
+                    recipe_vectors = index.finalize()
+                    vocabulary = index.feature_names
+                else:
+                    # Fit and transform all recipes at once
+                    recipe_vectors = vectorizer.fit_transform(all_ingredients)
+                    # Get vocabulary information (None for hashed features)
+                    vocabulary = vectorizer.get_feature_names_out()
+                if live_rows is not None:
+                    spread = sp.csr_matrix(
+                        (np.ones(len(live_rows)), (live_rows, np.arange(len(live_rows)))),
+                        shape=(n_rows, len(live_rows))
+                    )
+                    recipe_vectors = (spread @ recipe_vectors).tocsr()
+            else:
+                recipe_vectors = vocabulary = None
+            
+            if recipe_vectors is not None:
+                self.metrics.observe('index', [('fit', time.perf_counter() - started)])
+                with self.metrics.timed('index', 'inverted_index'):
+                    inverted_index = InvertedIndex.build(recipe_vectors)
+                with self.metrics.timed('index', 'facets'):
+                    facets = FacetIndex.build(inverted_index.postings)
+                ann_index = self._build_ann_index(recipe_vectors)
                 
-                # Get vocabulary information
-                vocabulary = self.vectorizer.get_feature_names_out()
+                # Reentrant: the incremental path gets here under _ensure_vectors' hold
+                with self._index_lock:
+                    self.vectorizer = vectorizer
+                    self.recipe_vectors = recipe_vectors
+                    self.feature_names = vocabulary
+                    self.inverted_index = inverted_index
+                    self.facets = facets
+                    self.ann_index = ann_index
+                    self.neighbors = None  # Scored with the old weights; build_neighbors redoes them
+                    self.deleted = deleted
+                    self.live_rows = live_rows
+                    self.stale_rows = 0
+                    # Results scored against the old index are no longer valid
+                    self.recommendation_cache.clear()
+                    self.index_version = uuid.uuid4().hex[:16]
+            
+            if not self.recipes.empty:
                 logger.info(f"Updated vectors for {len(self.recipes)} recipes")
-                logger.info(f"Vectorizer features: {len(vocabulary)}")
-                logger.info(f"Sample vocabulary words: {list(vocabulary[:10])}")
+                logger.info(f"Vectorizer features: {self.recipe_vectors.shape[1]}")
+                if vocabulary is not None:
+                    logger.info(f"Sample vocabulary words: {list(vocabulary[:10])}")
                 
                 # Log some statistics about the vectors
                 if self.recipe_vectors is not None:
@@ -150,27 +307,47 @@ class RecipeRecommender:
             import traceback
             logger.error(f"Traceback: {traceback.format_exc()}")
             
-    def get_recommendations(self, user_id, n=5):
-        """Get recipe recommendations for a user"""
+    def get_recommendations(self, user_id, n=5, filters=None):
+        """Get recipe recommendations for a user.
+        
+        ``filters``, a RecipeFilters, restricts them to recipes with or
+        without given ingredients, and not among given ids. They are applied
+        as a mask before the top n are picked, so a filtered request still
+        gets n recipes when n pass. Filtered results are not cached.
+        """
+        clock = self.metrics.clock('recommend')
         try:
-            logger.info(f"Getting recommendations for user {user_id}")
+            verbose = logger.isEnabledFor(logging.DEBUG)
+            if verbose:
+                logger.debug(f"Getting recommendations for user {user_id}")
+            self._ensure_vectors()
             
-            # Check if user exists
-            if user_id not in self.user_preferences:
-                logger.warning(f"User {user_id} not found in user_preferences")
-                return {
+            # Read before the profile, so a change landing in between makes the result stale
+            generation = self.user_store.generation(user_id)
+            cached = self.recommendation_cache.get(user_id, n, generation) if not filters else None
+            clock.lap('cache')
+            if cached is not None:
+                if verbose:
+                    logger.debug(f"Serving cached recommendations for user {user_id}")
+                return cached
+            
+            # Get user's weighted profile, None if the user is unknown
+            profile = self.user_store.get(user_id)
+            clock.lap('user_profile')
+            if profile is None:
+                logger.warning(f"User {user_id} not found in the user store")
+                return self._cold_start(None, n, {
                     'error': 'User not found',
                     'message': f'User {user_id} has not tracked any recipes yet',
                     'exists': False
-                }
+                }, filters)
             
-            # Get user's ingredient preferences
-            user_ingredients = self.user_preferences[user_id]
-            logger.info(f"User {user_id} has {len(user_ingredients)} tracked ingredients")
-            logger.info(f"User ingredients: {user_ingredients}")
+            if verbose:
+                logger.debug(f"User {user_id} has {len(profile.weights)} tracked ingredients")
+                logger.debug(f"User ingredient weights: {profile.weights}")
             
             # Check if we have any recipes
-            if self.recipes.empty:
+            if len(self.recipes) == 0:
                 logger.warning("No recipes available for recommendations")
                 return {
                     'error': 'No recipes available',
@@ -179,77 +356,72 @@ class RecipeRecommender:
                 }
             
             # Get user's ingredient vector
-            user_vector = self._get_user_vector(user_id)
+            user_vector = self._get_user_vector(user_id, profile)
+            clock.lap('user_vector')
             if user_vector is None:
                 logger.warning(f"Could not generate user vector for {user_id}")
-                return {
+                return self._cold_start(profile, n, {
                     'error': 'Invalid user vector',
                     'message': 'Could not generate recommendations for this user',
                     'exists': True
-                }
+                }, filters)
             
-            logger.info(f"User vector shape: {user_vector.shape}")
-            
-            # Calculate similarities with all recipes
-            similarities = []
-            for idx, recipe in self.recipes.iterrows():
-                try:
-                    recipe_id = recipe['id']
-                    recipe_ingredients = recipe['ingredients']
-                    
-                    # Ensure recipe ingredients are in the correct format
-                    if isinstance(recipe_ingredients, str):
-                        recipe_ingredients = [recipe_ingredients]
-                    elif not isinstance(recipe_ingredients, list):
-                        recipe_ingredients = []
-                    
-                    # Convert recipe ingredients to text
-                    recipe_text = ' '.join(recipe_ingredients)
-                    
-                    # Vectorize recipe
-                    recipe_vector = self.vectorizer.transform([recipe_text])
-                    
-                    # Calculate similarity
-                    similarity = cosine_similarity(user_vector, recipe_vector)[0][0]
-                    similarities.append((recipe_id, similarity))
-                    
-                except Exception as e:
-                    logger.error(f"Error processing recipe {recipe_id}: {str(e)}")
-                    continue
-            
-            if not similarities:
+            if verbose:
+                logger.debug(f"User vector shape: {user_vector.shape}")
+            
+            # Score all recipes at once against the cached recipe matrix. The store
+            # only grows, so it may briefly hold rows the matrix does not have yet.
+            recipe_vectors, inverted_index, ann_index, deleted, facets = self._serving_state()
+            if recipe_vectors is None or recipe_vectors.shape[0] > len(self.recipes):
                 logger.warning("No similarities calculated - no valid recipe vectors")
                 return {
                     'error': 'No similarities found',
                     'message': 'Could not find similar recipes',
                     'exists': True
                 }
+            if filters:
+                deleted = self._filtered_rows(deleted, facets, filters, recipe_vectors.shape[0])
+            excluded = self._excluded_rows(deleted, profile, recipe_vectors.shape[0])
             
-            logger.info(f"Calculated similarities for {len(similarities)} recipes")
-            
-            # Sort by similarity and get top n
-            similarities.sort(key=lambda x: x[1], reverse=True)
-            top_n = similarities[:n]
+            if ann_index is not None:
+                # Only recipes in the lists closest to the user are visited
+                rows, scores, visited = ann_index.top_n(recipe_vectors, user_vector, n, self.ann_probes, excluded)
+                if filters and len(rows) < n and inverted_index is not None:
+                    # Too few recipes passing the filters in those lists: search them all
+                    rows, scores, visited = inverted_index.top_n(user_vector, n, excluded)
+                clock.lap('scoring')
+                if verbose:
+                    logger.debug(f"Scored {visited} ANN candidate recipes of {len(self.recipes)}")
+            elif inverted_index is not None:
+                # Only recipes sharing a term with the user are visited
+                rows, scores, visited = inverted_index.top_n(user_vector, n, excluded)
+                clock.lap('scoring')
+                if verbose:
+                    logger.debug(f"Scored {visited} candidate recipes of {len(self.recipes)}")
+            else:
+                similarities = score_recipes(recipe_vectors, user_vector)
+                clock.lap('scoring')
+                if verbose:
+                    logger.debug(f"Calculated similarities for {len(similarities)} recipes")
+                rows = top_n_indices(similarities, n, excluded)
+                scores = similarities[rows]
+                clock.lap('top_k')
             
-            logger.info(f"Top {n} recipe similarities: {top_n}")
+            recommendations = self._recommendations_for_rows(rows, scores)
+            clock.lap('materialize')
             
-            # Get recipe details
-            recommendations = []
-            for recipe_id, similarity in top_n:
-                recipe = self.recipes[self.recipes['id'] == recipe_id].iloc[0]
-                recommendations.append({
-                    'id': recipe_id,
-                    'name': recipe['name'],
-                    'ingredients': recipe['ingredients'].split(),
-                    'similarity': float(similarity)
-                })
-            
-            logger.info(f"Generated {len(recommendations)} recommendations")
-            return {
+            if verbose:
+                logger.debug(f"Generated {len(recommendations)} recommendations")
+            result = {
                 'exists': True,
                 'recommendations': recommendations,
-                'user_ingredients': list(user_ingredients)
+                'user_ingredients': profile.ingredients
             }
+            if filters:
+                result['filters'] = filters.as_dict()
+            else:
+                self.recommendation_cache.put(user_id, n, result, generation)
+            return result
             
         except Exception as e:
             logger.error(f"Error getting recommendations: {str(e)}")
@@ -261,28 +433,633 @@ class RecipeRecommender:
                 'message': str(e),
                 'exists': False
             }
+        finally:
+            clock.finish()
+        
+    def get_recommendations_batch(self, user_ids, n=5, filters=None):
+        """Get recipe recommendations for many users at once.
+        
+        User vectors are built with a single tokenizer pass and scored with
+        one sparse matrix product per chunk of users. Chunks are sized so that
+        at most batch_score_budget scores are held in memory. ``filters``
+        apply to every user, and their mask is built once. Returns a dict
+        from user id to the same payload get_recommendations gives that user.
+        """
+        clock = self.metrics.clock('recommend_batch')
+        try:
+            logger.debug(f"Getting batch recommendations for {len(user_ids)} users")
+            self._ensure_vectors()
+            results = {}
+            
+            users = []
+            uncached = []
+            generations = {}
+            for user_id in dict.fromkeys(user_ids):
+                generations[user_id] = self.user_store.generation(user_id)
+                cached = self.recommendation_cache.get(user_id, n, generations[user_id]) if not filters else None
+                if cached is not None:
+                    results[user_id] = cached
+                else:
+                    uncached.append(user_id)
+            clock.lap('cache')
+            
+            preferences = self.user_store.get_many(uncached)
+            clock.lap('user_profile')
+            for user_id in uncached:
+                if preferences[user_id] is None:
+                    results[user_id] = self._cold_start(None, n, {
+                        'error': 'User not found',
+                        'message': f'User {user_id} has not tracked any recipes yet',
+                        'exists': False
+                    }, filters)
+                elif len(self.recipes) == 0:
+                    results[user_id] = {
+                        'error': 'No recipes available',
+                        'message': 'The system has no recipes loaded',
+                        'exists': True
+                    }
+                elif not self.vectorizer_ready or not preferences[user_id].weights:
+                    results[user_id] = self._cold_start(preferences[user_id], n, {
+                        'error': 'Invalid user vector',
+                        'message': 'Could not generate recommendations for this user',
+                        'exists': True
+                    }, filters)
+                else:
+                    users.append(user_id)
+            
+            recipe_vectors, _, _, deleted, facets = self._serving_state()
+            if users and (recipe_vectors is None or recipe_vectors.shape[0] > len(self.recipes)):
+                logger.warning("No similarities calculated - no valid recipe vectors")
+                for user_id in users:
+                    results[user_id] = {
+                        'error': 'No similarities found',
+                        'message': 'Could not find similar recipes',
+                        'exists': True
+                    }
+                users = []
+            
+            if users and filters:
+                deleted = self._filtered_rows(deleted, facets, filters, recipe_vectors.shape[0])
+            
+            chunk_size = max(1, self.batch_score_budget // max(len(self.recipes), 1))
+            for start in range(0, len(users), chunk_size):
+                chunk = users[start:start + chunk_size]
+                user_vectors = weighted_query_vectors(self.vectorizer, [preferences[user_id].weights for user_id in chunk])
+                clock.lap('user_vector')
+                
+                # One product scores the whole chunk. Multiplying from the recipe side
+                # keeps the big matrix in CSR; the result is transposed to users x recipes.
+                scores = (recipe_vectors @ user_vectors.T).toarray(order='F').T
+                clock.lap('scoring')
+                
+                for row, user_id in enumerate(chunk):
+                    if user_vectors.indptr[row] == user_vectors.indptr[row + 1]:
+                        results[user_id] = self._cold_start(preferences[user_id], n, {
+                            'error': 'Invalid user vector',
+                            'message': 'Could not generate recommendations for this user',
+                            'exists': True
+                        }, filters)
+                        clock.lap('materialize')
+                        continue
+                    # Pick the top n without sorting the whole catalog
+                    top_n = top_n_indices(
+                        scores[row], n, self._excluded_rows(deleted, preferences[user_id], len(scores[row])))
+                    clock.lap('top_k')
+                    results[user_id] = {
+                        'exists': True,
+                        'recommendations': self._recommendations_for_rows(top_n, scores[row][top_n]),
+                        'user_ingredients': preferences[user_id].ingredients
+                    }
+                    if filters:
+                        results[user_id]['filters'] = filters.as_dict()
+                    else:
+                        self.recommendation_cache.put(user_id, n, results[user_id], generations[user_id])
+                    clock.lap('materialize')
+            
+            logger.debug(f"Generated batch recommendations for {len(users)} users")
+            return {user_id: results[user_id] for user_id in user_ids}
+            
+        except Exception as e:
+            logger.error(f"Error getting batch recommendations: {str(e)}")
+            logger.error(f"Error details: {type(e).__name__}: {str(e)}")
+            import traceback
+            logger.error(f"Traceback: {traceback.format_exc()}")
+            return {
+                user_id: {
+                    'error': 'Internal server error',
+                    'message': str(e),
+                    'exists': False
+                }
+                for user_id in user_ids
+            }
+        finally:
+            clock.finish()
+    
+    def _cold_start(self, profile, n, unavailable, filters=None):
+        """The n most popular recipes, for a user the content model cannot score.
+        
+        Walks the precomputed popularity list, so the cost is O(n) plus any
+        recipes skipped as seen, deleted or filtered out. Returns
+        ``unavailable`` when nothing has been tracked yet to rank by.
+        """
+        seen = profile.seen if profile is not None and self.exclude_seen else ()
+        filtered = None
+        if filters:
+            recipe_vectors, _, _, _, facets = self._serving_state()
+            if recipe_vectors is not None:
+                filtered = self._filtered_rows(None, facets, filters, recipe_vectors.shape[0])
+        rows = []
+        scores = []
+        for recipe_id, score in self.popularity.top(self.popularity.top_size):
+            if len(rows) == n:
+                break
+            if recipe_id in seen:
+                continue
+            row = self.get_recipe_row(recipe_id)
+            if row is not None and (filtered is None or (row < len(filtered) and not filtered[row])):
+                rows.append(row)
+                scores.append(score)
+        if not rows:
+            return unavailable
+        
+        recommendations = self._recommendations_for_rows(rows, np.zeros(len(rows)))
+        for recommendation, score in zip(recommendations, scores):
+            recommendation['popularity'] = score
+        result = {
+            'exists': unavailable['exists'],
+            'recommendations': recommendations,
+            'user_ingredients': profile.ingredients if profile is not None else [],
+            'fallback': 'popular'
+        }
+        if filters:
+            result['filters'] = filters.as_dict()
+        return result
+    
+    def _filtered_rows(self, deleted, facets, filters, n_rows):
+        """Tombstones plus the rows ``filters`` rule out, as a new mask"""
+        include = [column for text in filters.include for column in word_columns(self.vectorizer, text)]
+        exclude = [column for text in filters.exclude for column in word_columns(self.vectorizer, text)]
+        excluded = facets.excluded_rows(include, exclude)[:n_rows]
+        if deleted is not None:
+            excluded |= deleted
+        blocked = [row for row in map(self.recipes.row_of, filters.exclude_ids) if row is not None and row < n_rows]
+        excluded[blocked] = True
+        return excluded
+    
+    def _excluded_rows(self, deleted, profile, n_rows):
+        """Tombstones plus the rows of recipes the user has seen, as one mask or None"""
+        if not self.exclude_seen or not profile.seen:
+            return deleted
+        # Profiles keep at most max_seen recipes, so this is a bounded number of lookups
+        seen_rows = [row for row in map(self.recipes.row_of, profile.seen) if row is not None and row < n_rows]
+        if not seen_rows:
+            return deleted
+        excluded = np.zeros(n_rows, dtype=bool) if deleted is None else deleted.copy()
+        excluded[seen_rows] = True
+        return excluded
+    
+    def _build_ann_index(self, recipe_vectors):
+        """Build the ANN index if the ANN engine is on and the catalog is big enough"""
+        if self.engine != 'ann' or recipe_vectors is None:
+            return None
+        if recipe_vectors.shape[0] < self.ann_min_recipes:
+            logger.info(f"Catalog below {self.ann_min_recipes} recipes, scoring exactly")
+            return None
+        with self.metrics.timed('index', 'ann_index'):
+            return IvfIndex.build(recipe_vectors, probes=self.ann_probes)
+    
+    def _recommendations_for_rows(self, rows, scores):
+        """Build recommendation payloads for ranked matrix rows and their scores"""
+        # Get recipe details
+        recommendations = []
+        for row, score in zip(rows, scores):
+            recipe = self._recipe_record(row)
+            recommendations.append({
+                'id': recipe['id'],
+                'name': recipe['name'],
+                'ingredients': recipe['ingredients'].split(),
+                'similarity': float(score)
+            })
+        return recommendations
+    
+    def save_snapshot(self, path):
+        """Save the fitted index to disk so a restart can skip rebuilding it"""
+        try:
+            self._ensure_vectors()
+            if self.read_only:
+                logger.warning("Index was loaded from a shared snapshot, nothing new to save")
+                return None
+            if not self.vectorizer_ready or self.recipes.empty:
+                logger.warning("Nothing to snapshot, no recipes are indexed")
+                return None
+            if self.deleted is not None:
+                # Snapshots hold no tombstones; compacted() gives a clean index to save
+                logger.warning("Index has tombstones, compact it before saving a snapshot")
+                return None
+            
+            with self.metrics.timed('index', 'snapshot_save'):
+                manifest = snapshot.save_snapshot(
+                    path, self.recipes, self.recipe_vectors, self.vectorizer, self.feature_names,
+                    self.inverted_index, self.ann_index, self.neighbors, self.feature_signature(), self.facets
+                )
+            self.catalog_fingerprint = manifest['fingerprint']
+            logger.info(f"Saved snapshot of {manifest['recipe_count']} recipes to {path}")
+            return manifest
+            
+        except Exception as e:
+            logger.error(f"Error saving snapshot: {str(e)}")
+            logger.error(f"Error details: {type(e).__name__}: {str(e)}")
+            import traceback
+            logger.error(f"Traceback: {traceback.format_exc()}")
+            return None
+    
+    def load_snapshot(self, path, mmap=True, shared=False):
+        """Replace the index with one saved by save_snapshot.
         
+        The matrix arrays are memory mapped by default, so the cost does not
+        grow with the catalog. With shared=True the vocabulary and recipe
+        columns stay memory mapped too and the index becomes read-only, so
+        worker processes mapping the same snapshot share one copy of it.
+        Returns False if there is no compatible snapshot.
+        """
+        try:
+            started = time.perf_counter()
+            loaded = snapshot.load_snapshot(path, mmap_mode='r' if mmap else None)
+            if loaded is None:
+                logger.warning(f"No usable snapshot found at {path}")
+                return False
+            
+            manifest = loaded['manifest']
+            if manifest['vectorizer'] != snapshot.vectorizer_signature(self.vectorizer):
+                logger.warning("Snapshot was built with different vectorizer settings, ignoring it")
+                return False
+            if manifest.get('features', feature_signature()) != self.feature_signature():
+                logger.warning("Snapshot was built with a different feature mode, ignoring it")
+                return False
+            
+            if shared:
+                # Terms are looked up by binary search and recipe fields decoded per
+                # row, straight from the mapped pages
+                vocabulary = None
+                if loaded['vocabulary'] is not None:
+                    vocabulary = snapshot.SortedVocabulary(*loaded['vocabulary'])
+                feature_names = vocabulary
+                recipes = snapshot.MappedRecipes(
+                    snapshot.StringColumn(*loaded['ids']),
+                    snapshot.StringColumn(*loaded['names']),
+                    snapshot.StringColumn(*loaded['ingredients']),
+                    snapshot.StringColumn(*loaded['instructions']),
+                    loaded['id_order'],
+                    self.instructions_loader
+                )
+            else:
+                vocabulary = feature_names = None
+                if loaded['vocabulary'] is not None:
+                    terms = snapshot.decode_strings(*loaded['vocabulary'])
+                    vocabulary = dict(zip(terms, range(len(terms))))
+                    feature_names = np.asarray(terms, dtype=object)
+                recipes = RecipeStore(self.instructions_loader)
+                recipes.extend(
+                    {'id': recipe_id, 'name': name, 'ingredients': ingredients, 'instructions': instructions}
+                    for recipe_id, name, ingredients, instructions in zip(
+                        snapshot.decode_strings(*loaded['ids']),
+                        snapshot.decode_strings(*loaded['names']),
+                        snapshot.decode_strings(*loaded['ingredients']),
+                        snapshot.decode_strings(*loaded['instructions'])
+                    )
+                )
+            
+            if loaded['postings'] is not None:
+                inverted_index = InvertedIndex(loaded['postings'], loaded['max_weights'])
+            else:
+                # Older snapshot without postings
+                inverted_index = InvertedIndex.build(loaded['recipe_vectors'])
+            if loaded['facets'] is not None:
+                facets = FacetIndex(inverted_index.postings, *loaded['facets'])
+            else:
+                # Older snapshot without facet bitmaps
+                facets = FacetIndex.build(inverted_index.postings)
+            
+            if self.engine == 'ann' and loaded['ann'] is not None:
+                ann_index = IvfIndex(*loaded['ann'], probes=self.ann_probes)
+            else:
+                ann_index = self._build_ann_index(loaded['recipe_vectors'])
+            neighbors = RecipeNeighbors(*loaded['neighbors']) if loaded['neighbors'] is not None else None
+            
+            with self._index_lock:
+                self.vectorizer.vocabulary_ = vocabulary
+                self.vectorizer.idf_ = loaded['idf']
+                self.feature_names = feature_names
+                self.recipes = recipes
+                self.recipe_vectors = loaded['recipe_vectors']
+                self.inverted_index = inverted_index
+                self.facets = facets
+                self.ann_index = ann_index
+                self.neighbors = neighbors
+                self.deleted = None
+                self.live_rows = None
+                self.stale_rows = 0
+                self.catalog_fingerprint = manifest['fingerprint']
+                # Derived from the snapshot, so every worker mapping it agrees
+                self.index_version = f"{manifest['fingerprint'][:12]}-{int(manifest['created_at'])}"
+                self.current_batch = []
+                self.pending_recipes = []
+                # A snapshot keeps weighted vectors, not raw counts, so any recipes
+                # added after loading go through the full refit path
+                self.incremental = False
+                self.index = None
+                self.read_only = shared
+                self.vectorizer_ready = True
+                self.recommendation_cache.clear()
+            
+            self.metrics.observe('index', [('snapshot_load', time.perf_counter() - started)])
+            logger.info(f"Loaded snapshot of {len(recipes)} recipes from {path}")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Error loading snapshot: {str(e)}")
+            logger.error(f"Error details: {type(e).__name__}: {str(e)}")
+            import traceback
+            logger.error(f"Traceback: {traceback.format_exc()}")
+            return False
+    
+    def feature_signature(self):
+        """The feature settings, as recorded in snapshots"""
+        return feature_signature(self.feature_mode, self.hash_features, self.min_bigram_df)
+    
     def get_all_recipes(self):
         """Get all recipes in the system"""
-        return self.recipes.to_dict('records')
+        self._ensure_vectors()
+        return self.recipes.records(self._listed_rows())
+    
+    def get_index_version(self):
+        """Token that changes whenever the indexed catalog changes"""
+        self._ensure_vectors()
+        return self.index_version
+    
+    def get_recipe_count(self):
+        """Number of recipes served, not counting tombstones"""
+        self._ensure_vectors()
+        return len(self._listed_rows())
+    
+    def get_recipes_page(self, offset, limit, fields=RECIPE_FIELDS):
+        """Return up to limit recipes from position offset on, with only the given fields"""
+        self._ensure_vectors()
+        return self.recipes.records(self._listed_rows()[offset:offset + limit], fields)
+    
+    def iter_recipes(self, offset=0, limit=None, fields=RECIPE_FIELDS, chunk_size=1000):
+        """Yield lists of recipe records chunk_size at a time, for streaming responses"""
+        self._ensure_vectors()
+        recipes = self.recipes
+        rows = self._listed_rows()
+        stop = len(rows) if limit is None else min(len(rows), offset + limit)
+        for start in range(offset, stop, chunk_size):
+            yield recipes.records(rows[start:min(start + chunk_size, stop)], fields)
+    
+    def get_recipe_row(self, recipe_id):
+        """Return the matrix row of a recipe id, or None if it is not indexed"""
+        self._ensure_vectors()
+        row = self.recipes.row_of(recipe_id)
+        deleted = self.deleted
+        if row is None or (deleted is not None and (row >= len(deleted) or deleted[row])):
+            return None
+        return row
+    
+    def live_recipe_ids(self):
+        """Ids of every recipe served, for comparing the index with its source"""
+        self._ensure_vectors()
+        return set(self.recipes.column_values('id', self._listed_rows()))
+    
+    def _listed_rows(self):
+        """Rows that listings show: every indexed row except tombstones"""
+        with self._index_lock:
+            if self.live_rows is not None:
+                return self.live_rows
+            if self.recipe_vectors is None:
+                return range(len(self.recipes))
+            return range(self.recipe_vectors.shape[0])
+    
+    def _serving_state(self):
+        """The matrix, indexes, tombstones and facets of one index version, read together"""
+        with self._index_lock:
+            return self.recipe_vectors, self.inverted_index, self.ann_index, self.deleted, self.facets
+    
+    def apply_catalog_changes(self, records, deleted_ids=()):
+        """Apply new, changed and deleted recipes without refitting the index.
+        
+        ``records`` are recipe dicts (id, name, ingredients, instructions) that
+        are new or replace the recipe with the same id. They are weighted with
+        the vocabulary and IDF of the last fit and appended. The rows they
+        replace and the rows of ``deleted_ids`` become tombstones, which
+        scoring and listings skip. The new matrix, postings and tombstones are
+        built aside and swapped in together, so queries keep being served from
+        the previous version meanwhile. Returns counts that tell when a
+        compaction is due, or None if the index cannot be changed.
+        """
+        try:
+            self.finalize()
+            if self.read_only:
+                logger.warning("Index is a read-only shared snapshot, ignoring catalog changes")
+                return None
+            started = time.perf_counter()
+            # The last version of each recipe wins
+            records = list({str(record['id']): record for record in records}.values())
+            if self.recipe_vectors is None:
+                # Nothing fitted yet, so there is nothing to patch
+                if records:
+                    self._index_batch(records)
+                    self.finalize()
+                return self.catalog_stats()
+            
+            recipe_vectors = self.recipe_vectors
+            n_rows = recipe_vectors.shape[0]
+            deleted = np.zeros(n_rows + len(records), dtype=bool)
+            if self.deleted is not None:
+                deleted[:n_rows] = self.deleted
+            tombstoned = 0
+            for recipe_id in [*deleted_ids, *(record['id'] for record in records)]:
+                row = self.recipes.row_of(recipe_id)
+                if row is not None and row < n_rows and not deleted[row]:
+                    deleted[row] = True
+                    tombstoned += 1
+            if not records and not tombstoned:
+                # Nothing to change: keep the index version, and with it ETags and cached results
+                return self.catalog_stats()
+            
+            if records:
+                added = self.vectorizer.transform([record['ingredients'] for record in records])
+                recipe_vectors = sp.vstack([recipe_vectors, added], format='csr')
+            inverted_index = InvertedIndex.build(recipe_vectors)
+            facets = FacetIndex.build(inverted_index.postings)
+            ann_index = self.ann_index
+            if ann_index is not None and records:
+                ann_index = ann_index.extended(recipe_vectors, n_rows)
+            has_tombstones = bool(deleted.any())
+            live_rows = np.flatnonzero(~deleted) if has_tombstones else None
+            
+            with self._index_lock:
+                self.recipes.extend(records)
+                self.recipe_vectors = recipe_vectors
+                self.inverted_index = inverted_index
+                self.facets = facets
+                self.ann_index = ann_index
+                self.deleted = deleted if has_tombstones else None
+                self.live_rows = live_rows
+                self.stale_rows += len(records)
+                # Counts of the old rows are gone once rows are patched in; a later
+                # add_recipe refits the live rows
+                self.incremental = False
+                self.index = None
+                self.catalog_fingerprint = None  # No longer matches a saved snapshot
+                self.recommendation_cache.clear()
+                self.index_version = uuid.uuid4().hex[:16]
+            
+            self.metrics.observe('index', [('sync', time.perf_counter() - started)])
+            logger.info(f"Applied catalog changes: {len(records)} recipes added or updated, {tombstoned} rows tombstoned")
+            return self.catalog_stats()
+            
+        except Exception as e:
+            logger.error(f"Error applying catalog changes: {str(e)}")
+            logger.error(f"Error details: {type(e).__name__}: {str(e)}")
+            import traceback
+            logger.error(f"Traceback: {traceback.format_exc()}")
+            return None
+    
+    def catalog_stats(self):
+        """Rows in the matrix, how many are tombstones and how many use an old fit"""
+        recipe_vectors, _, _, deleted, _ = self._serving_state()
+        return {
+            'rows': 0 if recipe_vectors is None else recipe_vectors.shape[0],
+            'tombstones': 0 if deleted is None else int(np.count_nonzero(deleted)),
+            'stale_rows': self.stale_rows
+        }
+    
+    def compacted(self):
+        """Return a new recommender fitted on the live rows only.
+        
+        Drops the tombstones and refits the vocabulary and IDF that recipes
+        added by apply_catalog_changes were weighted without. Tracked users
+        are shared with this recommender.
+        """
+        self.finalize()
+        started = time.perf_counter()
+        fresh = RecipeRecommender(
+            cache_size=self.recommendation_cache.max_entries, cache_ttl=self.recommendation_cache.ttl,
+            exclude_seen=self.exclude_seen, similar_k=self.similar_k, similar_workers=self.similar_workers,
+            popularity=self.popularity, metrics=self.metrics,
+            feature_mode=self.feature_mode, hash_features=self.hash_features, min_bigram_df=self.min_bigram_df,
+            engine=self.engine, ann_probes=self.ann_probes, ann_min_recipes=self.ann_min_recipes,
+            instructions_loader=self.instructions_loader
+        )
+        fresh.user_store = self.user_store
+        rows = self._listed_rows()
+        for start in range(0, len(rows), fresh.batch_size):
+            chunk = rows[start:start + fresh.batch_size]
+            records = self.recipes.records(chunk, ('id', 'name', 'ingredients'))
+            # Only instructions held locally are carried over; the rest are fetched on demand
+            for record, instructions in zip(records, self.recipes.instructions(chunk, fetch=False)):
+                record['instructions'] = instructions
+            fresh._index_batch(records)
+        fresh.finalize()
+        fresh.build_neighbors()
+        self.metrics.observe('index', [('compaction', time.perf_counter() - started)])
+        logger.info(f"Compacted index: {len(rows)} live recipes of {len(self.recipes)} rows")
+        return fresh
+    
+    def build_neighbors(self):
+        """Precompute the similar_k most similar recipes of every recipe.
+        
+        Meant for load time and offline jobs: it scores the catalog against
+        itself. Recipes added later by apply_catalog_changes are scored per
+        request until the next build.
+        """
+        self.finalize()
+        recipe_vectors = self.recipe_vectors
+        if self.similar_k <= 0 or recipe_vectors is None:
+            return None
+        with self.metrics.timed('index', 'neighbors'):
+            neighbors = compute_neighbors(recipe_vectors, self.similar_k, self.similar_workers)
+        with self._index_lock:
+            if self.recipe_vectors is recipe_vectors:
+                self.neighbors = neighbors
+        return neighbors
+    
+    def get_similar_recipes(self, recipe_id, n=10):
+        """Return up to n recipes most like the given one, or None if it is not indexed"""
+        clock = self.metrics.clock('similar')
+        try:
+            row = self.get_recipe_row(recipe_id)
+            if row is None:
+                clock.lap('lookup')
+                return None
+            with self._index_lock:
+                recipe_vectors, inverted_index, deleted = self.recipe_vectors, self.inverted_index, self.deleted
+                neighbors = self.neighbors
+            
+            rows = None
+            if neighbors is not None and row < len(neighbors):
+                # Precomputed: one slice, minus recipes deleted since
+                rows, scores = neighbors.of(row)
+                if deleted is not None:
+                    live = ~deleted[rows]
+                    rows, scores = rows[live], scores[live]
+                if len(rows) < n:
+                    # More asked for than were kept, or deletions left too few
+                    rows = None
+            if rows is None:
+                # Not precomputed, or too few left: score it like a user with the recipe's own vector
+                query = recipe_vectors[row]
+                if inverted_index is not None:
+                    rows, scores, _ = inverted_index.top_n(query, n + 1, deleted)
+                else:
+                    scores = score_recipes(recipe_vectors, query)
+                    rows = top_n_indices(scores, n + 1, deleted)
+                    scores = scores[rows]
+                similar = (rows != row) & (scores > 0)
+                rows, scores = rows[similar], scores[similar]
+            clock.lap('lookup')
+            similar = self._recommendations_for_rows(rows[:n], scores[:n])
+            clock.lap('materialize')
+            return similar
+        finally:
+            # Misses and errors are requests too
+            clock.finish()
+    
+    def set_instructions_loader(self, loader):
+        """Set where instructions missing from memory are fetched from"""
+        self.instructions_loader = loader
+        self.recipes.instructions_loader = loader
+    
+    def _recipe_record(self, row):
+        """Return the id, name and ingredients of the recipe stored at a matrix row"""
+        return self.recipes.record(row)
 
-    def _get_user_vector(self, user_id):
-        """Get the vector representation of a user's ingredient preferences"""
+    def _get_user_vector(self, user_id, profile=None):
+        """Get the vector representation of a user's weighted ingredient profile.
+        
+        ``profile`` saves a second store lookup when the caller already has
+        it. Decay scales every weight of a profile alike, so the stored
+        weights give the same normalised vector as decayed ones would.
+        """
         try:
-            logger.info(f"Generating user vector for {user_id}")
+            verbose = logger.isEnabledFor(logging.DEBUG)
+            if verbose:
+                logger.debug(f"Generating user vector for {user_id}")
             
             if not self.vectorizer_ready:
                 logger.warning("Vectorizer not ready yet, waiting for recipe processing to complete")
                 return None
             
-            if user_id not in self.user_preferences:
-                logger.warning(f"User {user_id} not found in user_preferences")
+            # Get user's weighted profile
+            if profile is None:
+                profile = self.user_store.get(user_id)
+            if profile is None:
+                logger.warning(f"User {user_id} not found in the user store")
                 return None
-            
-            # Get user's ingredient preferences
-            user_ingredients = self.user_preferences[user_id]
-            logger.info(f"User {user_id} has {len(user_ingredients)} tracked ingredients")
-            logger.debug(f"User ingredients: {user_ingredients}")
+            user_ingredients = profile.weights
+            if verbose:
+                logger.debug(f"User {user_id} has {len(user_ingredients)} tracked ingredients")
+                logger.debug(f"User ingredient weights: {user_ingredients}")
             
             if not user_ingredients:
                 logger.warning(f"No ingredients tracked for user {user_id}")
@@ -290,42 +1067,46 @@ class RecipeRecommender:
             
             # Convert ingredients to text for vectorization
             ingredients_text = ' '.join(user_ingredients)
-            logger.info(f"User ingredients text: {ingredients_text}")
-            
-            # Get the vocabulary from the vectorizer
-            vocabulary = self.vectorizer.get_feature_names_out()
-            logger.info(f"Vectorizer vocabulary size: {len(vocabulary)}")
             
-            # Check if any user ingredients are in the vocabulary
-            user_words = set(ingredients_text.lower().split())
-            matching_words = user_words.intersection(vocabulary)
-            logger.info(f"Found {len(matching_words)} matching words in vocabulary")
-            logger.info(f"Matching words: {matching_words}")
+            # Get the vocabulary cached by the last fit; hashed features have none,
+            # and an ingredient unseen in any recipe just gives an empty vector below
+            vocabulary = self.feature_names
+            if verbose:
+                logger.debug(f"User ingredients text: {ingredients_text}")
+                logger.debug(f"Vectorizer features: {self.recipe_vectors.shape[1]}")
             
-            if not matching_words:
-                logger.warning("No matching words found between user ingredients and vocabulary")
-                return None
+            if vocabulary is not None:
+                # Check if any user ingredients are in the vocabulary
+                user_words = set(ingredients_text.lower().split())
+                matching_words = {word for word in user_words if word in self.vectorizer.vocabulary_}
+                if verbose:
+                    logger.debug(f"Found {len(matching_words)} matching words in vocabulary")
+                    logger.debug(f"Matching words: {matching_words}")
+                
+                if not matching_words:
+                    logger.warning("No matching words found between user ingredients and vocabulary")
+                    return None
             
             # Vectorize ingredients using the existing vectorizer
             try:
-                user_vector = self.vectorizer.transform([ingredients_text])
-                logger.info(f"Generated user vector with shape: {user_vector.shape}")
-                logger.debug(f"User vector non-zero elements: {user_vector.nnz}")
+                user_vector = weighted_query_vectors(self.vectorizer, [user_ingredients])
+                if verbose:
+                    logger.debug(f"Generated user vector with shape: {user_vector.shape}")
+                    logger.debug(f"User vector non-zero elements: {user_vector.nnz}")
                 
                 # Check if the vector is empty (all zeros)
                 if user_vector.nnz == 0:
                     logger.warning("Generated user vector is empty (all zeros)")
                     return None
                 
-                # Get the non-zero elements and their values
-                non_zero_indices = user_vector.nonzero()[1]
-                non_zero_values = user_vector.data
-                logger.info(f"Non-zero elements: {len(non_zero_indices)}")
-                
-                # Log some of the matching words and their values
-                for idx, value in zip(non_zero_indices[:5], non_zero_values[:5]):
-                    word = vocabulary[idx]
-                    logger.info(f"Word '{word}' has value {value}")
+                if verbose:
+                    # Log some of the matching words and their values
+                    non_zero_indices = user_vector.nonzero()[1]
+                    non_zero_values = user_vector.data
+                    logger.debug(f"Non-zero elements: {len(non_zero_indices)}")
+                    for idx, value in zip(non_zero_indices[:5], non_zero_values[:5]):
+                        word = vocabulary[idx] if vocabulary is not None else f'#{idx}'
+                        logger.debug(f"Word '{word}' has value {value}")
                 
                 return user_vector
                 
@@ -0,0 +1,74 @@
+import numpy as np
+import scipy.sparse as sp
+from sklearn.feature_extraction.text import CountVectorizer
+from sklearn.preprocessing import normalize
+
+
+def score_recipes(recipe_vectors, user_vector):
+    """Score every recipe against a user vector in one sparse mat-vec product.
+
+    Both sides come out of the TF-IDF vectorizer already L2-normalised, so the
+    dot product is the cosine similarity. The user side is densified because a
+    CSR matrix times a dense vector is a single pass over the matrix data.
+    """
+    user_dense = np.asarray(user_vector.toarray()).ravel()
+    return np.asarray(recipe_vectors @ user_dense).ravel()
+
+
+def top_n_indices(scores, n, excluded=None):
+    """Return the row indices of the ``n`` highest scores, best first.
+
+    Uses a partial selection instead of a full sort. Ties keep catalog order,
+    exactly like a stable descending sort over all rows would. Rows set in
+    the boolean mask ``excluded`` are never returned.
+    """
+    scores = np.asarray(scores).ravel()
+    if excluded is not None:
+        scores = np.where(excluded[:len(scores)], -np.inf, scores)
+        n = min(n, len(scores) - int(np.count_nonzero(excluded[:len(scores)])))
+    size = scores.shape[0]
+    if n <= 0 or size == 0:
+        return np.empty(0, dtype=np.intp)
+    if n >= size:
+        return np.argsort(-scores, kind='stable')
+
+    # Value of the n-th best score; everything above it is in, ties on it are
+    # taken in row order until we have n rows
+    threshold = scores[np.argpartition(-scores, n - 1)[n - 1]]
+    above = np.flatnonzero(scores > threshold)
+    ties = np.flatnonzero(scores == threshold)[:n - len(above)]
+    candidates = np.sort(np.concatenate([above, ties]))
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+def weighted_query_vectors(vectorizer, weight_maps):
+    """TF-IDF vectors of weighted ingredient lists, one row per dict of ingredient -> weight.
+
+    Each ingredient's term counts are scaled by its weight before IDF
+    weighting and normalisation, so heavily used ingredients pull the vector
+    towards their terms. With every weight 1 this is what the vectorizer's
+    own transform gives for the joined ingredients, except that no n-gram
+    spans two ingredients. All users are tokenized in one call.
+    """
+    texts = [ingredient for weights in weight_maps for ingredient in weights]
+    values = np.fromiter((weight for weights in weight_maps for weight in weights.values()),
+                         dtype=np.float64, count=len(texts))
+    indptr = np.zeros(len(weight_maps) + 1, dtype=np.int64)
+    np.cumsum([len(weights) for weights in weight_maps], out=indptr[1:])
+    mixing = sp.csr_matrix((values, np.arange(len(texts)), indptr), shape=(len(weight_maps), len(texts)))
+
+    # Raw counts from the fitted vocabulary, or hashed; the weighting below is
+    # what the vectorizer's own transform would apply to them
+    if isinstance(vectorizer, CountVectorizer):
+        counts = CountVectorizer.transform(vectorizer, texts)
+    else:
+        counts = vectorizer.term_counts(texts)
+    vectors = sp.csr_matrix(mixing @ counts, dtype=np.float64)
+    if vectorizer.sublinear_tf:
+        np.log(vectors.data, vectors.data)
+        vectors.data += 1.0
+    if vectorizer.use_idf:
+        vectors.data *= vectorizer.idf_[vectors.indices]
+    if vectorizer.norm is not None:
+        vectors = normalize(vectors, norm=vectorizer.norm, copy=False)
+    return vectors
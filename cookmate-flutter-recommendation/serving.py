@@ -0,0 +1,131 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from werkzeug.serving import make_server
+
+logger = logging.getLogger(__name__)
+
+SERVER_MODES = ('development', 'production')
+DEFAULT_THREADS = 16
+DEFAULT_CONNECTION_LIMIT = 100
+DRAIN_TIMEOUT = 25  # Seconds a stopped server waits for its requests before dropping them
+DRAIN_GRACE = 1  # Seconds a quiet connection is still given to send a request while draining
+
+
+class Overloaded(Exception):
+    """Raised when more work is waiting than a BoundedExecutor accepts"""
+
+
+class BoundedExecutor:
+    """Runs CPU-bound work on at most ``workers`` threads, with at most ``queue_depth`` more waiting.
+
+    A request thread hands its scoring over and waits for the result, so
+    however many requests are scoring at once, at most ``workers`` of them
+    compete for the CPU. Anything past the queue raises Overloaded straight
+    away, for a 429, instead of queueing without bound; server threads
+    beyond ``workers + queue_depth`` are then always free for cheap
+    requests such as tracking. The pool is started lazily per process, so
+    an instance created before forking works in every worker. Work runs in
+    a copy of the caller's context, so per-request profiling still sees it.
+    """
+
+    def __init__(self, workers, queue_depth):
+        self.workers = workers
+        self.queue_depth = queue_depth
+        self._slots = None
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # Threads do not survive a fork, and neither do slots held by them
+            self._slots = threading.BoundedSemaphore(self.workers + self.queue_depth)
+            self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix='scoring')
+            self._pid = os.getpid()
+
+    def run(self, fn, *args, **kwargs):
+        """Call ``fn`` on the pool and return its result, or raise Overloaded if the queue is full"""
+        if self.workers <= 0:
+            return fn(*args, **kwargs)
+        self._ensure_started()
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise Overloaded(f'{self.workers + self.queue_depth} requests are already scoring or waiting')
+        try:
+            context = contextvars.copy_context()
+            return self._pool.submit(context.run, fn, *args, **kwargs).result()
+        finally:
+            self._slots.release()
+
+
+def serve(app, host, port, mode='development', threads=DEFAULT_THREADS,
+          connection_limit=DEFAULT_CONNECTION_LIMIT, sock=None, stop=None):
+    """Serve ``app`` until the process is stopped, on ``host:port`` or an already bound ``sock``.
+
+    'development' is werkzeug's server, one new thread per request.
+    'production' is waitress: ``threads`` threads serve requests and at
+    most ``connection_limit`` connections are open at once; more wait in
+    the listen backlog. Once the Event ``stop`` is set, the server stops
+    accepting, finishes the requests it has and returns: waitress gives
+    them DRAIN_TIMEOUT seconds, werkzeug waits for their connections to close.
+    """
+    if mode == 'development':
+        server = make_server(host, port, app, threaded=True, fd=sock.fileno() if sock else None)
+        if stop is not None:
+            def shut_down():
+                stop.wait()
+                server.shutdown()
+            # shutdown() waits for serve_forever to return, so it cannot run on its thread
+            threading.Thread(target=shut_down, daemon=True).start()
+            # Request threads are then joined when the server closes, so their requests finish
+            server.daemon_threads = False
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+        return
+    if mode != 'production':
+        raise ValueError(f"Unknown server mode: {mode}")
+    try:
+        import waitress
+    except ImportError:
+        raise RuntimeError("The production server needs waitress: pip install waitress")
+    listen = {'sockets': [sock]} if sock else {'host': host, 'port': port}
+    server = waitress.create_server(app, threads=threads, connection_limit=connection_limit, **listen)
+    if stop is not None:
+        threading.Thread(target=_drain_waitress, args=(server, stop), daemon=True).start()
+    server.print_listen('Serving on http://{}:{}')
+    try:
+        server.run()
+    finally:
+        server.task_dispatcher.shutdown()
+
+
+def _drain_waitress(server, stop):
+    """Once ``stop`` is set, stop accepting, wait for open requests, then end the server's loop"""
+    from waitress import wasyncore
+
+    stop.wait()
+    server.accepting = False
+    server.trigger.pull_trigger()  # Wakes the loop, so it stops polling the listening socket
+    deadline = time.monotonic() + DRAIN_TIMEOUT
+
+    def busy(channel):
+        # A connection accepted just now may not have sent its request yet
+        return (channel.request is not None or channel.requests or channel.total_outbufs_len
+                or time.time() - channel.last_activity < DRAIN_GRACE)
+
+    while time.monotonic() < deadline and any(busy(channel) for channel in list(server.active_channels.values())):
+        time.sleep(0.05)
+    # The loop runs while its map holds anything; closing everything from the loop's own thread ends it
+    server.trigger.pull_trigger(lambda: wasyncore.close_all(server._map))
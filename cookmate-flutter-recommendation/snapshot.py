@@ -0,0 +1,325 @@
+import bisect
+import hashlib
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+import scipy.sparse as sp
+
+from recipe_store import RecordsMixin, fill_instructions
+
+SNAPSHOT_VERSION = 1
+MANIFEST_FILE = 'manifest.json'
+
+# Vectorizer settings that must match for a snapshot to be reusable
+VECTORIZER_PARAMS = ('lowercase', 'stop_words', 'token_pattern', 'ngram_range',
+                     'norm', 'use_idf', 'smooth_idf', 'sublinear_tf')
+
+
+def catalog_fingerprint(recipe_ids):
+    """Hash of the set of recipe ids, independent of load order"""
+    digest = hashlib.sha1()
+    for recipe_id in sorted(str(recipe_id) for recipe_id in recipe_ids):
+        digest.update(recipe_id.encode('utf-8'))
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+def vectorizer_signature(vectorizer):
+    """JSON-friendly view of the vectorizer settings a snapshot depends on"""
+    params = vectorizer.get_params()
+    return json.loads(json.dumps({name: params[name] for name in VECTORIZER_PARAMS}, default=sorted))
+
+
+def write_strings(directory, name, values):
+    """Store strings as one mmap-able UTF-8 blob plus an offsets array.
+
+    Strings are NUL separated so a whole column decodes with a single split,
+    while ``offsets[i]:offsets[i + 1] - 1`` still gives random access to one.
+    """
+    encoded = [str(value).replace('\x00', '').encode('utf-8') for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) + 1 for value in encoded], out=offsets[1:])
+    np.save(os.path.join(directory, f'{name}.npy'), np.frombuffer(b'\x00'.join(encoded), dtype=np.uint8))
+    np.save(os.path.join(directory, f'{name}_offsets.npy'), offsets)
+
+
+def read_strings(directory, name, mmap_mode='r'):
+    """Return the (blob, offsets) pair written by write_strings"""
+    blob = np.load(os.path.join(directory, f'{name}.npy'), mmap_mode=mmap_mode)
+    offsets = np.load(os.path.join(directory, f'{name}_offsets.npy'), mmap_mode=mmap_mode)
+    return blob, offsets
+
+
+def decode_strings(blob, offsets):
+    """Decode a whole string column back into a list of str"""
+    if len(offsets) <= 1:
+        return []
+    return blob.tobytes().decode('utf-8').split('\x00')
+
+
+class StringColumn:
+    """Random access to a string column without decoding all of it.
+
+    Over a memory-mapped blob, only the strings that are read are decoded, so
+    processes mapping the same snapshot share the pages instead of each keeping
+    its own list of str.
+    """
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, row):
+        start = int(self.offsets[row])
+        end = int(self.offsets[row + 1]) - 1
+        return self.blob[start:end].tobytes().decode('utf-8')
+
+    def tolist(self):
+        return decode_strings(self.blob, self.offsets)
+
+    def slice(self, start, stop):
+        """Decode rows start:stop with a single split"""
+        if stop <= start:
+            return []
+        end = int(self.offsets[stop]) - 1
+        return self.blob[int(self.offsets[start]):end].tobytes().decode('utf-8').split('\x00')
+
+    def values(self, rows):
+        """Decode the given rows, contiguous ranges in one go"""
+        if isinstance(rows, range) and rows.step == 1:
+            return self.slice(rows.start, rows.stop)
+        return [self[row] for row in rows]
+
+
+class SortedVocabulary(StringColumn):
+    """Read-only term -> column mapping over the alphabetical vocabulary column.
+
+    Looks terms up by binary search, so it can stand in for the
+    ``vocabulary_`` dict of a fitted vectorizer without building that dict.
+    """
+
+    def __contains__(self, term):
+        return self.get(term) is not None
+
+    def __getitem__(self, term):
+        if isinstance(term, str):
+            column = self.get(term)
+            if column is None:
+                raise KeyError(term)
+            return column
+        return super().__getitem__(term)
+
+    def get(self, term, default=None):
+        # bisect indexes with ints, which __getitem__ resolves to terms
+        column = bisect.bisect_left(self, term)
+        if column < len(self) and super().__getitem__(column) == term:
+            return column
+        return default
+
+
+class MappedRecipes(RecordsMixin):
+    """Read-only recipe metadata served straight from snapshot columns.
+
+    Has the read side of RecipeStore. Ids are found by binary search over
+    ``id_order``, the rows sorted by id, so no per-process hash index is built.
+    """
+
+    def __init__(self, ids, names, ingredients, instructions, id_order=None, instructions_loader=None):
+        self.ids = ids
+        self.names = names
+        self.ingredients_column = ingredients
+        self.instructions_column = instructions
+        self._id_order = id_order
+        self.instructions_loader = instructions_loader
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def empty(self):
+        return len(self) == 0
+
+    @property
+    def id_order(self):
+        if self._id_order is None:
+            # Older snapshots do not store the order
+            self._id_order = np.argsort(np.asarray(self.ids.tolist(), dtype=object), kind='stable')
+        return self._id_order
+
+    def row_of(self, recipe_id):
+        recipe_id = str(recipe_id)
+        order = self.id_order
+        low, high = 0, len(order)
+        while low < high:
+            middle = (low + high) // 2
+            if self.ids[int(order[middle])] < recipe_id:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(order) and self.ids[int(order[low])] == recipe_id:
+            return int(order[low])
+        return None
+
+    def ingredients(self, row):
+        return self.ingredients_column[row]
+
+    def instructions(self, rows, fetch=True):
+        values = self.instructions_column.values(rows)
+        if fetch:
+            fill_instructions(self.ids.values(rows), values, self.instructions_loader)
+        return values
+
+    def record(self, row):
+        return {'id': self.ids[row], 'name': self.names[row], 'ingredients': self.ingredients_column[row]}
+
+    def column_values(self, field, rows):
+        if field == 'id':
+            return self.ids.values(rows)
+        if field == 'name':
+            return self.names.values(rows)
+        if field == 'ingredients':
+            return self.ingredients_column.values(rows)
+        if field == 'instructions':
+            return self.instructions(rows)
+        raise KeyError(field)
+
+
+def save_snapshot(path, recipes, recipe_vectors, vectorizer, feature_names, inverted_index=None,
+                  ann_index=None, neighbors=None, features=None, facets=None):
+    """Write a fitted index to ``path`` and return its manifest.
+
+    ``feature_names`` is None for hashed features, which have no vocabulary
+    to save; ``features`` records the feature mode in the manifest. Only the
+    bitmaps of ``facets`` are saved, since the rest of it is the postings.
+
+    The snapshot is written to a sibling temp directory and swapped into place,
+    so a reader never sees a half-written snapshot. Processes that still map
+    the old files keep reading them until they close them.
+    """
+    path = os.path.abspath(path)
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+
+    recipe_ids, names, ingredients, instructions = recipes.columns()
+    np.save(os.path.join(tmp_path, 'data.npy'), recipe_vectors.data)
+    np.save(os.path.join(tmp_path, 'indices.npy'), recipe_vectors.indices)
+    np.save(os.path.join(tmp_path, 'indptr.npy'), recipe_vectors.indptr)
+    np.save(os.path.join(tmp_path, 'idf.npy'), vectorizer.idf_)
+    if inverted_index is not None:
+        postings = inverted_index.postings
+        np.save(os.path.join(tmp_path, 'postings_data.npy'), postings.data)
+        np.save(os.path.join(tmp_path, 'postings_indices.npy'), postings.indices)
+        np.save(os.path.join(tmp_path, 'postings_indptr.npy'), postings.indptr)
+        np.save(os.path.join(tmp_path, 'max_weights.npy'), inverted_index.max_weights)
+    if ann_index is not None:
+        np.save(os.path.join(tmp_path, 'ann_features.npy'), ann_index.features)
+        np.save(os.path.join(tmp_path, 'ann_projection.npy'), ann_index.projection)
+        np.save(os.path.join(tmp_path, 'ann_centroids.npy'), ann_index.centroids)
+        np.save(os.path.join(tmp_path, 'ann_list_offsets.npy'), ann_index.list_offsets)
+        np.save(os.path.join(tmp_path, 'ann_list_rows.npy'), ann_index.list_rows)
+    if neighbors is not None:
+        np.save(os.path.join(tmp_path, 'neighbor_rows.npy'), neighbors.rows)
+        np.save(os.path.join(tmp_path, 'neighbor_scores.npy'), neighbors.scores)
+    if facets is not None:
+        np.save(os.path.join(tmp_path, 'facet_terms.npy'), facets.bitmap_terms)
+        np.save(os.path.join(tmp_path, 'facet_bitmaps.npy'), facets.bitmaps)
+    if feature_names is not None:
+        write_strings(tmp_path, 'vocabulary', feature_names)
+    write_strings(tmp_path, 'ids', recipe_ids)
+    np.save(os.path.join(tmp_path, 'id_order.npy'),
+            np.argsort(np.asarray(recipe_ids, dtype=object), kind='stable').astype(np.int64))
+    write_strings(tmp_path, 'names', names)
+    write_strings(tmp_path, 'ingredients', ingredients)
+    write_strings(tmp_path, 'instructions', instructions)
+
+    manifest = {
+        'version': SNAPSHOT_VERSION,
+        'created_at': time.time(),
+        'recipe_count': len(recipe_ids),
+        'feature_count': recipe_vectors.shape[1],
+        'fingerprint': catalog_fingerprint(recipe_ids),
+        'vectorizer': vectorizer_signature(vectorizer),
+        'features': features or {'mode': 'vocabulary'},
+    }
+    with open(os.path.join(tmp_path, MANIFEST_FILE), 'w') as f:
+        json.dump(manifest, f)
+
+    old_path = f'{path}.old-{os.getpid()}'
+    if os.path.exists(path):
+        os.rename(path, old_path)
+    os.rename(tmp_path, path)
+    shutil.rmtree(old_path, ignore_errors=True)
+    return manifest
+
+
+def read_manifest(path):
+    """Return the snapshot manifest, or None if there is no usable snapshot"""
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get('version') != SNAPSHOT_VERSION:
+        return None
+    return manifest
+
+
+def load_snapshot(path, mmap_mode='r'):
+    """Load the arrays of a snapshot written by save_snapshot.
+
+    With ``mmap_mode='r'`` the matrix arrays are memory mapped rather than read,
+    so loading costs about the same whatever the catalog size. ``postings`` and
+    ``max_weights`` are None for snapshots saved without an inverted index, and
+    ``ann``, ``neighbors`` and ``facets`` are None unless an ANN index,
+    precomputed similar recipes or facet bitmaps were saved. ``vocabulary``
+    is None for hashed features.
+    """
+    manifest = read_manifest(path)
+    if manifest is None:
+        return None
+
+    def load(name):
+        return np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode)
+
+    shape = (manifest['recipe_count'], manifest['feature_count'])
+    postings = max_weights = None
+    if os.path.exists(os.path.join(path, 'postings_data.npy')):
+        postings = sp.csc_matrix(
+            (load('postings_data'), load('postings_indices'), load('postings_indptr')), shape=shape
+        )
+        postings.has_sorted_indices = True
+        max_weights = load('max_weights')
+    ann = None
+    if os.path.exists(os.path.join(path, 'ann_projection.npy')):
+        ann = (load('ann_features'), load('ann_projection'), load('ann_centroids'),
+               load('ann_list_offsets'), load('ann_list_rows'))
+    neighbors = None
+    if os.path.exists(os.path.join(path, 'neighbor_rows.npy')):
+        neighbors = (load('neighbor_rows'), load('neighbor_scores'))
+    facets = None
+    if os.path.exists(os.path.join(path, 'facet_bitmaps.npy')):
+        facets = (load('facet_terms'), load('facet_bitmaps'))
+    return {
+        'manifest': manifest,
+        'recipe_vectors': sp.csr_matrix((load('data'), load('indices'), load('indptr')), shape=shape),
+        'postings': postings,
+        'max_weights': max_weights,
+        'ann': ann,
+        'neighbors': neighbors,
+        'facets': facets,
+        'idf': load('idf'),
+        'vocabulary': (read_strings(path, 'vocabulary', mmap_mode)
+                       if os.path.exists(os.path.join(path, 'vocabulary.npy')) else None),
+        'ids': read_strings(path, 'ids', mmap_mode),
+        'id_order': load('id_order') if os.path.exists(os.path.join(path, 'id_order.npy')) else None,
+        'names': read_strings(path, 'names', mmap_mode),
+        'ingredients': read_strings(path, 'ingredients', mmap_mode),
+        'instructions': read_strings(path, 'instructions', mmap_mode),
+    }
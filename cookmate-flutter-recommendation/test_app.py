@@ -0,0 +1,187 @@
+import importlib
+import json
+import threading
+import time
+
+import pytest
+
+from readiness import MAX_RETRY_AFTER, LoadProgress
+from serving import BoundedExecutor
+
+
+@pytest.fixture(scope='module')
+def service():
+    # Settings are read on import; nothing here reaches MongoDB
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv('LOG_FILE', '')
+        patch.setenv('SYNC_INTERVAL', '0')
+        patch.setenv('SIMILAR_K', '5')
+        patch.setenv('SIMILAR_WORKERS', '0')
+        return importlib.import_module('app')
+
+
+@pytest.fixture(scope='module')
+def documents(make_recipes):
+    return make_recipes(300)
+
+
+@pytest.fixture(scope='module')
+def indexed(documents, build_recommender):
+    recommender = build_recommender(documents, similar_k=5, similar_workers=0)
+    recommender.build_neighbors()
+    return recommender
+
+
+@pytest.fixture
+def client(service, indexed):
+    service.use_index(indexed, 'test')
+    return service.app.test_client()
+
+
+def test_similar_recipes(client, documents):
+    recipe_id = documents[0]['_id']
+    response = client.get(f'/api/recipes/{recipe_id}/similar?n=3')
+    assert response.status_code == 200
+    similar = response.get_json()['similar']
+    assert len(similar) == 3 and recipe_id not in [item['id'] for item in similar]
+
+
+def test_similar_recipes_of_an_unknown_recipe(client):
+    response = client.get('/api/recipes/missing/similar')
+    assert response.status_code == 404
+    assert response.get_json()['error'] == 'Recipe missing not found'
+
+
+def test_recipe_pages_follow_the_cursor(client, documents):
+    ids = []
+    response = client.get('/api/recipes?limit=120&fields=id,name')
+    while True:
+        assert response.status_code == 200
+        assert response.headers['X-Total-Count'] == '300'
+        ids.extend(recipe['id'] for recipe in response.get_json())
+        cursor = response.headers.get('X-Next-Cursor')
+        if cursor is None:
+            break
+        assert 'rel="next"' in response.headers['Link']
+        response = client.get(f'/api/recipes?limit=120&fields=id,name&cursor={cursor}')
+    assert ids == [doc['_id'] for doc in documents]
+
+
+def test_cursor_from_an_older_catalog_is_gone(client, service, documents, build_recommender):
+    cursor = client.get('/api/recipes?limit=10&fields=id').headers['X-Next-Cursor']
+    service.use_index(build_recommender(documents), 'test')
+    response = client.get(f'/api/recipes?limit=10&fields=id&cursor={cursor}')
+    assert response.status_code == 410
+
+
+def test_unchanged_page_answers_not_modified(client):
+    response = client.get('/api/recipes?limit=5&fields=id')
+    etag = response.headers['ETag']
+    again = client.get('/api/recipes?limit=5&fields=id', headers={'If-None-Match': etag})
+    assert again.status_code == 304 and not again.data
+    other = client.get('/api/recipes?limit=6&fields=id', headers={'If-None-Match': etag})
+    assert other.status_code == 200
+
+
+def test_recipes_stream_as_ndjson(client, documents):
+    response = client.get('/api/recipes?format=ndjson&offset=250&fields=id,name')
+    assert response.status_code == 200
+    assert response.mimetype == 'application/x-ndjson'
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert [line['id'] for line in lines] == [doc['_id'] for doc in documents[250:]]
+    assert set(lines[0]) == {'id', 'name'}
+
+
+@pytest.mark.parametrize('query', ['offset=abc', 'limit=ten', 'limit=2.5', 'offset=-1', 'limit=0',
+                                   'cursor=not-a-cursor', 'fields=id,calories'])
+def test_malformed_recipe_queries_are_rejected(client, query):
+    response = client.get(f'/api/recipes?{query}')
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
+
+
+def test_requests_wait_for_the_index_load(client, service, indexed, monkeypatch):
+    progress = LoadProgress(retry_after=7)
+    monkeypatch.setattr(service, 'load_progress', progress)
+    progress.begin('connecting')
+
+    response = client.get('/api/recipes')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '7'
+    assert response.get_json()['status']['phase'] == 'connecting'
+    assert client.get('/readyz').status_code == 503
+    assert client.get('/healthz').status_code == 200
+
+    progress.begin('indexing', expected=1000)
+    progress.advance(100)
+    response = client.get('/api/recommendations/user-0')
+    assert response.status_code == 503
+    assert 1 <= int(response.headers['Retry-After']) <= MAX_RETRY_AFTER
+    assert response.get_json()['status']['loaded'] == 100
+
+    service.use_index(indexed, 'test')
+    ready = client.get('/readyz')
+    assert ready.status_code == 200
+    assert ready.get_json()['recipes'] == 300 and ready.get_json()['source'] == 'test'
+    assert client.get('/api/recipes?limit=1').status_code == 200
+
+
+def test_saturated_scoring_answers_too_many_requests_then_recovers(client, service, documents, monkeypatch):
+    pool = BoundedExecutor(1, 1)
+    monkeypatch.setattr(service, 'scoring_pool', pool)
+    similar = f"/api/recipes/{documents[0]['_id']}/similar?n=3"
+    # One request scoring and one waiting fill the pool
+    gate = threading.Event()
+    holders = [threading.Thread(target=pool.run, args=(gate.wait,)) for _ in range(2)]
+    for holder in holders:
+        holder.start()
+    try:
+        deadline = time.time() + 5
+        response = client.get(similar)
+        while response.status_code == 200 and time.time() < deadline:
+            response = client.get(similar)
+        assert response.status_code == 429
+        assert response.headers['Retry-After'] == '1'
+        assert client.get('/api/recommendations/user-0').status_code == 429
+        # Tracking does not score, so it is still answered
+        tracked = client.post('/api/track', json={'user_id': 'busy-user', 'recipe_id': documents[0]['_id'],
+                                                  'ingredients_used': ['rice']})
+        assert tracked.status_code == 200
+    finally:
+        gate.set()
+        for holder in holders:
+            holder.join()
+
+    assert client.get(similar).status_code == 200
+    assert pool.rejected >= 2
+
+
+def test_batch_recommendations(client, documents):
+    client.post('/api/track', json={'user_id': 'batch-user', 'recipe_id': documents[0]['_id'],
+                                    'ingredients_used': ['rice', 'garlic']})
+    response = client.post('/api/recommendations/batch', json={'user_ids': ['batch-user', 'nobody'], 'n': 3})
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert list(results) == ['batch-user', 'nobody']
+    assert len(results['batch-user']['recommendations']) == 3
+    assert results['nobody']['exists'] is False
+
+
+@pytest.mark.parametrize('body, error', [
+    (None, 'user_ids'),
+    ([], 'user_ids'),
+    ({'n': 3}, 'user_ids'),
+    ({'user_ids': []}, 'user_ids'),
+    ({'user_ids': 'user-0'}, 'user_ids'),
+    ({'user_ids': ['user-0'], 'n': 0}, 'n '),
+    ({'user_ids': ['user-0'], 'n': '5'}, 'n '),
+    ({'user_ids': ['user-0'], 'n': 2.5}, 'n '),
+    ({'user_ids': ['user-0'], 'n': True}, 'n '),
+    ({'user_ids': ['user-0'], 'filters': ['rice']}, 'filters'),
+    ({'user_ids': ['user-0'], 'filters': {'include': 'rice'}}, 'filters'),
+    ({'user_ids': ['user-0'], 'filters': {'exclude_ids': [1]}}, 'filters'),
+])
+def test_malformed_batch_requests_are_rejected(client, body, error):
+    response = client.post('/api/recommendations/batch', json=body)
+    assert response.status_code == 400
+    assert response.get_json()['error'].startswith(error)
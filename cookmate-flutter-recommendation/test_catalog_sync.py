@@ -0,0 +1,155 @@
+from bson import ObjectId
+
+from catalog_sync import CatalogSync
+from facets import FacetIndex
+
+
+INGREDIENTS = ['chicken breasts', 'rice', 'garlic', 'onion', 'butter', 'walnuts', 'spinach', 'lemon juice',
+               'soy sauce', 'ginger', 'basil', 'tomatoes']
+
+
+class FakeCollection:
+    """The parts of a pymongo Collection CatalogSync uses, without change streams"""
+
+    def __init__(self, documents=()):
+        self.documents = {doc['_id']: doc for doc in documents}
+
+    def insert(self, doc):
+        self.documents[doc['_id']] = doc
+
+    def delete(self, object_id):
+        del self.documents[object_id]
+
+    def find(self, query, projection=None):
+        condition = query.get('_id', {})
+        documents = [
+            doc for object_id, doc in sorted(self.documents.items())
+            if ('$in' not in condition or object_id in condition['$in'])
+            and ('$gt' not in condition or object_id > condition['$gt'])
+        ]
+        if projection:
+            documents = [{field: doc[field] for field in projection if field in doc} for doc in documents]
+        return FakeCursor(documents)
+
+
+class FakeCursor(list):
+    def sort(self, field, direction):
+        return FakeCursor(sorted(self, key=lambda doc: doc[field], reverse=direction < 0))
+
+
+def recipe(index, ingredients=None):
+    return {
+        '_id': ObjectId(f'{index:024x}'),
+        'Title': f'Recipe {index}',
+        'Cleaned_Ingredients': ingredients if ingredients is not None else [
+            INGREDIENTS[index % len(INGREDIENTS)], INGREDIENTS[(index * 7 + 3) % len(INGREDIENTS)],
+            INGREDIENTS[(index * 5 + 1) % len(INGREDIENTS)]
+        ]
+    }
+
+
+def make_sync(collection, holder, compact_ratio=0.5):
+    def swap(fresh):
+        holder[0] = fresh
+    return CatalogSync(collection, lambda: holder[0], swap, compact_ratio=compact_ratio, use_change_stream=False)
+
+
+def test_reconcile_applies_inserts_and_deletions(build_recommender):
+    documents = [recipe(index) for index in range(1, 301)]
+    collection = FakeCollection(documents)
+    holder = [build_recommender(documents, cache_size=0)]
+    sync = make_sync(collection, holder)
+    assert sync.sync_once()['deleted'] == 0
+
+    collection.delete(documents[0]['_id'])
+    collection.insert(recipe(1000))
+    sync.last_reconcile = None
+    stats = sync.sync_once()
+
+    assert (stats['upserted'], stats['deleted']) == (1, 1)
+    recommender = holder[0]
+    assert recommender.get_recipe_row(str(documents[0]['_id'])) is None
+    assert recommender.get_recipe_row(str(recipe(1000)['_id'])) is not None
+    assert recommender.live_recipe_ids() == {str(object_id) for object_id in collection.documents}
+
+
+def test_recipe_without_ingredients_is_not_a_change(build_recommender):
+    documents = [recipe(index) for index in range(1, 301)]
+    collection = FakeCollection(documents + [recipe(999, ingredients=[])])
+    holder = [build_recommender(documents, cache_size=0)]
+    sync = make_sync(collection, holder)
+    version = holder[0].index_version
+
+    for _ in range(3):
+        sync.last_reconcile = None
+        stats = sync.sync_once()
+        assert (stats['upserted'], stats['deleted']) == (0, 0)
+    assert holder[0].index_version == version
+
+
+def test_compaction_drops_tombstones(build_recommender):
+    documents = [recipe(index) for index in range(1, 101)]
+    collection = FakeCollection(documents)
+    holder = [build_recommender(documents, cache_size=0)]
+    sync = make_sync(collection, holder, compact_ratio=0.2)
+    sync.sync_once()
+
+    for doc in documents[:30]:
+        collection.delete(doc['_id'])
+    sync.last_reconcile = None
+    stats = sync.sync_once()
+
+    assert stats['compacted']
+    assert holder[0].catalog_stats() == {'rows': 70, 'tombstones': 0, 'stale_rows': 0}
+
+
+def test_add_recipe_after_tombstones_refits_live_rows(build_recommender):
+    documents = [recipe(index) for index in range(1, 301)]
+    collection = FakeCollection(documents)
+    holder = [build_recommender(documents, cache_size=0)]
+    sync = make_sync(collection, holder)
+    sync.sync_once()
+    collection.delete(documents[0]['_id'])
+    sync.last_reconcile = None
+    sync.sync_once()
+
+    recommender = holder[0]
+    recommender.add_recipe('new-1', 'New', ['chicken breasts', 'rice'], '')
+    recommender.finalize()
+    recommender.track_user_behavior('user', None, ['chicken breasts'])
+
+    assert recommender.get_recipe_row('new-1') == 300
+    assert recommender.get_recipe_row(str(documents[0]['_id'])) is None
+    assert recommender.catalog_stats() == {'rows': 301, 'tombstones': 1, 'stale_rows': 0}
+    result = recommender.get_recommendations('user', 400)
+    assert 'error' not in result
+    ids = [item['id'] for item in result['recommendations']]
+    assert 'new-1' in ids and str(documents[0]['_id']) not in ids
+
+
+def test_refit_keeps_serving_the_previous_index_whole(build_recommender, monkeypatch):
+    documents = [recipe(index) for index in range(1, 301)]
+    collection = FakeCollection(documents)
+    holder = [build_recommender(documents, cache_size=0)]
+    sync = make_sync(collection, holder)
+    sync.sync_once()
+    collection.delete(documents[0]['_id'])
+    sync.last_reconcile = None
+    sync.sync_once()
+
+    recommender = holder[0]
+    served = []
+    build = FacetIndex.build
+
+    def observed(postings, *args, **kwargs):
+        served.append(recommender._serving_state())
+        return build(postings, *args, **kwargs)
+    monkeypatch.setattr(FacetIndex, 'build', observed)
+    recommender.add_recipe('new-1', 'New', ['chicken breasts', 'rice'], '')
+    recommender.finalize()
+
+    # While the refit builds its facets, queries still get the old version in full
+    recipe_vectors, inverted_index, _, deleted, facets = served[-1]
+    assert recipe_vectors.shape[0] == inverted_index.postings.shape[0] == facets.n_recipes == len(deleted) == 300
+    recipe_vectors, inverted_index, _, deleted, facets = recommender._serving_state()
+    assert recipe_vectors.shape[0] == inverted_index.postings.shape[0] == facets.n_recipes == len(deleted) == 301
@@ -0,0 +1,126 @@
+import re
+
+import numpy as np
+import pytest
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+from facets import FacetIndex, RecipeFilters
+from recommender import RecipeRecommender
+
+
+def words(text):
+    return {word for word in re.findall(r'(?u)\b\w+\b', text.lower()) if word not in ENGLISH_STOP_WORDS}
+
+
+def passes(item, filters):
+    found = words(' '.join(item['ingredients']))
+    return (all(words(text) <= found for text in filters.include)
+            and not any(words(text) & found for text in filters.exclude)
+            and item['id'] not in filters.exclude_ids)
+
+
+@pytest.fixture(scope='module')
+def built(make_recipes, make_events, build_recommender):
+    documents = make_recipes(3000, vocabulary_size=500)
+    events = make_events(documents, 50)
+
+    def build(**options):
+        recommender = build_recommender(documents, cache_size=100, ann_min_recipes=0, ann_probes=1, **options)
+        for user_id, recipe_id, used in events:
+            recommender.track_user_behavior(user_id, recipe_id, used)
+        return recommender
+    return build
+
+
+@pytest.fixture(scope='module')
+def recommender(built):
+    return built()
+
+
+def test_masks_match_the_postings(recommender):
+    rng = np.random.default_rng(0)
+    postings = recommender.inverted_index.postings
+    facets = FacetIndex.build(postings, dense_fraction=0.05)
+    assert 0 < len(facets.bitmap_terms) < postings.shape[1]
+    contains = postings.toarray() > 0
+    dense = list(facets.bitmap_terms[:20])
+    sparse = [term for term in range(postings.shape[1]) if term not in set(facets.bitmap_terms)][:200]
+    for _ in range(50):
+        include = list(rng.choice(dense, 1)) + list(rng.choice(sparse, rng.integers(0, 2)))
+        exclude = list(rng.choice(dense, rng.integers(0, 2))) + list(rng.choice(sparse, rng.integers(0, 3)))
+        expected = ~contains[:, include].all(axis=1) | contains[:, exclude].any(axis=1)
+        assert np.array_equal(facets.excluded_rows(include, exclude), expected)
+
+
+def test_unknown_word_to_include_excludes_everything(recommender):
+    assert recommender.facets.excluded_rows([-1], []).all()
+    assert not recommender.facets.excluded_rows([], [-1]).any()
+
+
+@pytest.mark.parametrize('filters', [
+    RecipeFilters(include=['chicken']),
+    RecipeFilters(exclude=['salt', 'olive oil']),
+    RecipeFilters(include=['garlic', 'onion'], exclude=['butter']),
+    RecipeFilters(include=['zucchini']),
+])
+def test_results_pass_the_filters_and_fill_n(recommender, filters):
+    ids = recommender.live_recipe_ids()
+    passing = sum(passes({'id': recipe_id, 'ingredients': recommender.recipes.ingredient_words(row)}, filters)
+                  for recipe_id, row in ((recipe_id, recommender.get_recipe_row(recipe_id)) for recipe_id in ids))
+    for index in range(20):
+        result = recommender.get_recommendations(f'user-{index}', 10, filters)
+        items = result['recommendations']
+        assert result['filters'] == filters.as_dict()
+        assert all(passes(item, filters) for item in items)
+        assert len(items) == min(10, passing)
+
+
+def test_exclude_ids_moves_the_rest_up(recommender):
+    filters = RecipeFilters(include=['chicken'])
+    before = [item['id'] for item in recommender.get_recommendations('user-1', 10, filters)['recommendations']]
+    blocked = RecipeFilters(include=['chicken'], exclude_ids=before[:2])
+    after = [item['id'] for item in recommender.get_recommendations('user-1', 10, blocked)['recommendations']]
+    assert after[:8] == before[2:]
+
+
+def test_filtered_results_are_not_cached(recommender):
+    recommender.get_recommendations('user-2', 10, RecipeFilters(include=['chicken']))
+    unfiltered = recommender.get_recommendations('user-2', 10)
+    assert 'filters' not in unfiltered
+    assert recommender.get_recommendations('user-2', 10) == unfiltered
+
+
+def test_batch_and_ann_agree_with_exact(recommender, built):
+    filters = RecipeFilters(include=['garlic'], exclude=['salt'])
+    user_ids = [f'user-{index}' for index in range(10)]
+    batch = recommender.get_recommendations_batch(user_ids, 10, filters)
+    ann = built(engine='ann')
+    assert ann.ann_index is not None
+    for user_id in user_ids:
+        exact = [item['id'] for item in recommender.get_recommendations(user_id, 10, filters)['recommendations']]
+        assert [item['id'] for item in batch[user_id]['recommendations']] == exact
+        # One probe seldom holds ten passing recipes; the exact fallback fills them in
+        assert len(ann.get_recommendations(user_id, 10, filters)['recommendations']) == len(exact)
+
+
+def test_hashing_features_filter_too(built):
+    hashed = built(feature_mode='hashing')
+    filters = RecipeFilters(include=['chicken'], exclude=['walnuts'])
+    items = hashed.get_recommendations('user-0', 10, filters)['recommendations']
+    assert items and all(passes(item, filters) for item in items)
+
+
+def test_popular_fallback_is_filtered(recommender):
+    filters = RecipeFilters(include=['rice'])
+    result = recommender.get_recommendations('nobody', 5, filters)
+    assert result['fallback'] == 'popular'
+    assert all(passes(item, filters) for item in result['recommendations'])
+
+
+def test_facets_survive_a_snapshot(recommender, tmp_path):
+    path = str(tmp_path / 'snapshot')
+    recommender.save_snapshot(path)
+    loaded = RecipeRecommender()
+    assert loaded.load_snapshot(path)
+    assert np.array_equal(loaded.facets.bitmap_terms, recommender.facets.bitmap_terms)
+    assert np.array_equal(loaded.facets.bitmaps, recommender.facets.bitmaps)
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from inverted_index import InvertedIndex
+from recommender import RecipeRecommender
+from scoring import score_recipes, top_n_indices
+
+USER_TEXTS = ['chicken breasts garlic rice', 'salt', 'walnuts maple syrup yogurt',
+              'olive oil onion tomatoes basil parmesan cheese salt butter sugar eggs']
+
+
+@pytest.fixture(scope='module')
+def fitted(make_recipes):
+    texts = [' '.join(doc['Cleaned_Ingredients']) for doc in make_recipes(600)]
+    vectorizer = RecipeRecommender().vectorizer
+    recipe_vectors = vectorizer.fit_transform(texts)
+    return vectorizer, recipe_vectors, InvertedIndex.build(recipe_vectors)
+
+
+def assert_matches_exhaustive(fitted, user_vector, n, excluded=None):
+    _, recipe_vectors, index = fitted
+    scores = score_recipes(recipe_vectors, user_vector)
+    expected = top_n_indices(scores, n, excluded)
+    rows, found, _ = index.top_n(user_vector, n, excluded)
+    assert list(rows) == list(expected)
+    np.testing.assert_allclose(found, scores[expected], atol=1e-12)
+    return rows, found
+
+
+@pytest.mark.parametrize('n', [1, 10, 50])
+@pytest.mark.parametrize('user_text', USER_TEXTS)
+def test_matches_exhaustive_scoring(fitted, user_text, n):
+    vectorizer = fitted[0]
+    assert_matches_exhaustive(fitted, vectorizer.transform([user_text]), n)
+
+
+@pytest.mark.parametrize('user_text', USER_TEXTS)
+def test_matches_exhaustive_scoring_with_excluded_rows(fitted, user_text):
+    vectorizer, recipe_vectors, _ = fitted
+    excluded = np.random.default_rng(0).random(recipe_vectors.shape[0]) < 0.3
+    rows, _ = assert_matches_exhaustive(fitted, vectorizer.transform([user_text]), 20, excluded)
+    assert not excluded[rows].any()
+
+
+def test_fills_up_with_zero_scores_in_catalog_order(fitted):
+    vectorizer, recipe_vectors, _ = fitted
+    # A term few recipes have, so most of the top n score zero
+    user_vector = vectorizer.transform(['walnuts'])
+    scores = score_recipes(recipe_vectors, user_vector)
+    n = int(np.count_nonzero(scores)) + 30
+    excluded = np.zeros(recipe_vectors.shape[0], dtype=bool)
+    excluded[:10] = True
+    for mask in (None, excluded):
+        matching = int(np.count_nonzero(scores if mask is None else scores[~mask]))
+        rows, found = assert_matches_exhaustive(fitted, user_vector, n, mask)
+        assert len(rows) == n
+        assert np.count_nonzero(found) == matching
+        filler = rows[matching:]
+        assert list(filler) == sorted(filler)
+
+
+def test_unknown_terms_get_the_first_recipes(fitted):
+    vectorizer = fitted[0]
+    rows, found = assert_matches_exhaustive(fitted, vectorizer.transform(['unobtainium']), 5)
+    assert list(rows) == [0, 1, 2, 3, 4]
+    assert not found.any()
@@ -0,0 +1,31 @@
+import pytest
+
+from metrics import PipelineMetrics
+
+
+def stage_count(metrics, pipeline, stage):
+    counts, _ = metrics.snapshot()
+    return int(counts[metrics.series.index((pipeline, stage))].sum())
+
+
+@pytest.fixture
+def recommender(make_recipes, build_recommender):
+    return build_recommender(make_recipes(20), cache_size=0, metrics=PipelineMetrics())
+
+
+def test_similar_records_hits_and_misses(recommender):
+    assert recommender.get_similar_recipes(f'{1:024x}', 3)
+    assert recommender.get_similar_recipes('missing', 3) is None
+    assert stage_count(recommender.metrics, 'similar', 'total') == 2
+    assert stage_count(recommender.metrics, 'similar', 'materialize') == 1
+
+
+def test_recommendations_record_unknown_users(recommender):
+    recommender.get_recommendations('nobody', 3)
+    assert stage_count(recommender.metrics, 'recommend', 'total') == 1
+
+
+def test_render_is_prometheus_text(recommender):
+    text = recommender.metrics.render({'cookmate_recipes': ('Recipes indexed', 20)})
+    assert 'cookmate_stage_seconds_count{pipeline="index",stage="fit"} 1' in text
+    assert text.endswith('cookmate_recipes 20.0\n')
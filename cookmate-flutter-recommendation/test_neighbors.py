@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from neighbors import compute_neighbors
+
+
+@pytest.fixture(scope='module')
+def documents(make_recipes):
+    return make_recipes(600)
+
+
+@pytest.fixture
+def precomputed(documents, build_recommender):
+    recommender = build_recommender(documents, cache_size=0, similar_k=5, similar_workers=0)
+    recommender.build_neighbors()
+    return recommender
+
+
+@pytest.fixture
+def scored(documents, build_recommender):
+    return build_recommender(documents, cache_size=0)
+
+
+def ids(similar):
+    return [item['id'] for item in similar]
+
+
+def test_matches_exhaustive_scoring(precomputed, scored):
+    neighbors = compute_neighbors(precomputed.recipe_vectors, 5, workers=0)
+    for row in range(0, 600, 7):
+        rows, scores = neighbors.of(row)
+        similar = scored.get_similar_recipes(f'{row:024x}', 5)
+        assert [f'{other:024x}' for other in rows] == ids(similar)
+        np.testing.assert_allclose(scores, [item['similarity'] for item in similar], rtol=1e-6)
+
+
+def test_more_than_k_are_scored(precomputed, scored):
+    for row in range(0, 600, 50):
+        recipe_id = f'{row:024x}'
+        assert ids(precomputed.get_similar_recipes(recipe_id, 3)) == ids(scored.get_similar_recipes(recipe_id, 3))
+        assert ids(precomputed.get_similar_recipes(recipe_id, 8)) == ids(scored.get_similar_recipes(recipe_id, 8))
+
+
+def test_deleted_neighbours_are_replaced(precomputed, scored):
+    recipe_id = f'{10:024x}'
+    deleted_ids = ids(precomputed.get_similar_recipes(recipe_id, 2))
+    for recommender in (precomputed, scored):
+        recommender.apply_catalog_changes([], deleted_ids)
+    found = ids(precomputed.get_similar_recipes(recipe_id, 5))
+    assert len(found) == 5 and not set(found) & set(deleted_ids)
+    assert found == ids(scored.get_similar_recipes(recipe_id, 5))
+
+
+def test_short_list_is_scored(precomputed, scored):
+    recipe_id = f'{20:024x}'
+    precomputed.neighbors.rows[20] = -1
+    assert ids(precomputed.get_similar_recipes(recipe_id, 5)) == ids(scored.get_similar_recipes(recipe_id, 5))
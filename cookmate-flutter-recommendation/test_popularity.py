@@ -0,0 +1,47 @@
+import time
+
+from popularity import PopularityRanking
+from user_store import create_user_store
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_ranks_before_the_first_refresh():
+    popularity = PopularityRanking(refresh_interval=3600)
+    for recipe_id in ['a', 'b', 'b', 'c', 'b', 'c']:
+        popularity.record(recipe_id)
+    assert [recipe_id for recipe_id, _ in popularity.top(3)] == ['b', 'c', 'a']
+
+
+def test_decay_favours_recent_events():
+    popularity = PopularityRanking(half_life=3600, refresh_interval=3600)
+    now = time.time()
+    for _ in range(3):
+        popularity.record('old', now - 5 * 3600)
+    popularity.record('new', now)
+    ranking = dict(popularity.refresh(now))
+    assert ranking['new'] > ranking['old']
+    assert abs(ranking['old'] - 3 / 32) < 1e-9
+
+
+def test_seeded_from_a_restarted_sqlite_store(tmp_path):
+    path = str(tmp_path / 'users.db')
+    store = create_user_store('sqlite', path)
+    for user in range(5):
+        store.add(f'user-{user}', {'rice'}, 'popular')
+    store.add('user-0', {'rice'}, 'rare')
+    store.close()
+
+    restarted = create_user_store('sqlite', path)
+    popularity = PopularityRanking(refresh_interval=3600, seed=restarted.tracked_recipes)
+    popularity.record('live')
+    assert wait_for(lambda: popularity.seeded == 6)
+    # The refresh thread may have ranked the seed before 'live' was counted
+    ranking = [recipe_id for recipe_id, _ in popularity.refresh()[:3]]
+    assert ranking[0] == 'popular' and set(ranking[1:]) == {'rare', 'live'}
+    restarted.close()
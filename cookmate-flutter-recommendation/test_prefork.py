@@ -0,0 +1,129 @@
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+import urllib.request
+
+import pytest
+
+from prefork import PreforkServer
+from recommender import RecipeRecommender
+from serving import serve
+
+WORKERS = 2
+
+
+@pytest.fixture(scope='module')
+def snapshot_path(tmp_path_factory, make_recipes, build_recommender):
+    path = str(tmp_path_factory.mktemp('prefork') / 'snapshot')
+    build_recommender(make_recipes(300)).save_snapshot(path)
+    return path
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def get(port, path='/'):
+    with urllib.request.urlopen(f'http://127.0.0.1:{port}{path}', timeout=10) as response:
+        return json.loads(response.read())
+
+
+def read_events(path):
+    with open(path) as events:
+        return [line.split() for line in events]
+
+
+@pytest.fixture(params=['development', 'production'])
+def pool(request, tmp_path, snapshot_path):
+    """A running PreforkServer whose workers map the snapshot and log when they are ready and exit"""
+    events = str(tmp_path / 'events')
+    port = free_port()
+    state = {}
+
+    def log(event):
+        with open(events, 'a') as handle:
+            handle.write(f'{event} {os.getpid()}\n')
+
+    def start():
+        time.sleep(0.3)  # A slow start, so replacing a worker before it is ready shows
+        state['recommender'] = RecipeRecommender(cache_size=0)
+        assert state['recommender'].load_snapshot(snapshot_path, shared=True)
+        log('ready')
+
+    def app(environ, start_response):
+        if environ['PATH_INFO'] == '/slow':
+            time.sleep(1.5)
+        recommender = state['recommender']
+        body = json.dumps({'pid': os.getpid(), 'recipes': recommender.get_recipe_count(),
+                           'read_only': recommender.read_only}).encode()
+        start_response('200 OK', [('Content-Type', 'application/json'), ('Content-Length', str(len(body)))])
+        return [body]
+
+    server = PreforkServer(
+        app, '127.0.0.1', port, WORKERS, on_worker_start=start, on_worker_exit=lambda: log('exit'),
+        serve=lambda sock, stop: serve(app, '127.0.0.1', port, request.param, threads=4, sock=sock, stop=stop),
+        stop_timeout=10
+    )
+    supervisor = multiprocessing.get_context('fork').Process(target=server.serve_forever)
+    supervisor.start()
+    deadline = time.time() + 10
+    while len(read_events(events) if os.path.exists(events) else []) < WORKERS and time.time() < deadline:
+        time.sleep(0.05)
+    yield port, events, supervisor
+    os.kill(supervisor.pid, signal.SIGTERM)
+    supervisor.join(20)
+
+
+def test_workers_serve_one_shared_snapshot(pool):
+    port, events, _ = pool
+    pids = {pid for _, pid in read_events(events)}
+    assert len(pids) == WORKERS
+
+    seen = set()
+    for _ in range(200):
+        answer = get(port)
+        assert answer['recipes'] == 300
+        assert answer['read_only']
+        seen.add(str(answer['pid']))
+        if seen == pids:
+            break
+    assert seen == pids
+
+
+def test_rolling_restart_waits_for_replacements_and_drains(pool):
+    port, events, supervisor = pool
+    old = {pid for _, pid in read_events(events)}
+    slow = []
+    in_flight = threading.Thread(target=lambda: slow.append(get(port, '/slow')))
+    in_flight.start()
+    time.sleep(0.1)
+    os.kill(supervisor.pid, signal.SIGHUP)
+
+    failures = []
+    deadline = time.time() + 15
+    while time.time() < deadline:
+        try:
+            get(port)
+        except OSError as e:
+            failures.append(e)
+        if sum(1 for event, pid in read_events(events) if event == 'exit' and pid in old) == WORKERS:
+            break
+    in_flight.join()
+
+    assert not failures
+    assert len(slow) == 1 and slow[0]['recipes'] == 300
+    ready = exited = 0
+    for event, pid in read_events(events):
+        if event == 'ready' and pid not in old:
+            ready += 1
+        elif event == 'exit' and pid in old:
+            exited += 1
+            # Each worker is only stopped once its replacement is ready
+            assert ready >= exited
+    assert exited == WORKERS
@@ -0,0 +1,33 @@
+import pytest
+
+
+@pytest.fixture(scope='module')
+def recommender(make_recipes, make_events, build_recommender):
+    documents = make_recipes(1000)
+    recommender = build_recommender(documents, cache_size=0)
+    for user_id, recipe_id, used in make_events(documents, 40):
+        recommender.track_user_behavior(user_id, recipe_id, used)
+    # A user whose only ingredient is in no recipe
+    recommender.track_user_behavior('unmatched', documents[0]['_id'], ['unobtainium'])
+    return recommender
+
+
+def assert_same_payload(found, expected):
+    assert found.keys() == expected.keys()
+    for key in expected.keys() - {'recommendations'}:
+        assert found[key] == expected[key]
+    assert [item['id'] for item in found['recommendations']] == [item['id'] for item in expected['recommendations']]
+    assert ([item['similarity'] for item in found['recommendations']]
+            == pytest.approx([item['similarity'] for item in expected['recommendations']]))
+
+
+@pytest.mark.parametrize('n', [1, 10])
+def test_batch_matches_one_request_per_user(recommender, monkeypatch, n):
+    # Three users per scoring chunk, so users spread over many chunks
+    monkeypatch.setattr(recommender, 'batch_score_budget', 3 * len(recommender.recipes))
+    user_ids = [f'user-{index}' for index in range(40)] + ['unmatched', 'nobody', 'user-0']
+    batch = recommender.get_recommendations_batch(user_ids, n)
+    assert list(batch) == list(dict.fromkeys(user_ids))
+    assert batch['nobody']['fallback'] == batch['unmatched']['fallback'] == 'popular'
+    for user_id in user_ids:
+        assert_same_payload(batch[user_id], recommender.get_recommendations(user_id, n))
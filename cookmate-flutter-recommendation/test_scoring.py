@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from sklearn.metrics.pairwise import cosine_similarity
+
+from recommender import RecipeRecommender
+from scoring import score_recipes, top_n_indices
+
+
+@pytest.fixture(scope='module')
+def fitted(make_recipes):
+    texts = [' '.join(doc['Cleaned_Ingredients']) for doc in make_recipes(600)]
+    vectorizer = RecipeRecommender().vectorizer
+    return vectorizer, vectorizer.fit_transform(texts)
+
+
+def per_row_ranking(vectorizer, recipe_vectors, user_text, n):
+    """What recommendations did before: one cosine per recipe, then a stable sort"""
+    user_vector = vectorizer.transform([user_text])
+    similarities = [(row, cosine_similarity(user_vector, recipe_vectors[row])[0][0])
+                    for row in range(recipe_vectors.shape[0])]
+    similarities.sort(key=lambda item: item[1], reverse=True)
+    return similarities[:n]
+
+
+@pytest.mark.parametrize('user_text', ['chicken breasts garlic rice', 'salt', 'walnuts maple syrup yogurt',
+                                       'olive oil onion tomatoes basil parmesan cheese'])
+def test_matches_per_row_cosine(fitted, user_text):
+    vectorizer, recipe_vectors = fitted
+    scores = score_recipes(recipe_vectors, vectorizer.transform([user_text]))
+    rows = top_n_indices(scores, 10)
+    expected = per_row_ranking(vectorizer, recipe_vectors, user_text, 10)
+    assert list(rows) == [row for row, _ in expected]
+    np.testing.assert_allclose(scores[rows], [similarity for _, similarity in expected], atol=1e-12)
+
+
+def test_top_n_keeps_catalog_order_on_ties():
+    scores = np.array([0.5, 0.9, 0.5, 0.1, 0.5, 0.9])
+    assert list(top_n_indices(scores, 4)) == [1, 5, 0, 2]
+    assert list(top_n_indices(scores, 10)) == list(np.argsort(-scores, kind='stable'))
+
+
+def test_top_n_skips_excluded_rows():
+    scores = np.array([0.5, 0.9, 0.7, 0.1])
+    excluded = np.array([False, True, False, False])
+    assert list(top_n_indices(scores, 2, excluded)) == [2, 0]
+    assert list(top_n_indices(scores, 10, excluded)) == [2, 0, 3]
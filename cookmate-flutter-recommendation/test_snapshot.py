@@ -0,0 +1,58 @@
+import os
+
+import pytest
+
+from recommender import RecipeRecommender
+from snapshot import catalog_fingerprint, read_manifest
+
+
+def track(recommender, events):
+    for user_id, recipe_id, used in events:
+        recommender.track_user_behavior(user_id, recipe_id, used)
+
+
+@pytest.fixture(scope='module')
+def saved(tmp_path_factory, make_recipes, make_events, build_recommender):
+    documents = make_recipes(800)
+    recommender = build_recommender(documents, similar_k=5, similar_workers=0)
+    recommender.build_neighbors()
+    events = make_events(documents, 20)
+    track(recommender, events)
+    path = str(tmp_path_factory.mktemp('snapshots') / 'snapshot')
+    recommender.save_snapshot(path)
+    return recommender, documents, events, path
+
+
+@pytest.mark.parametrize('shared', [False, True])
+def test_round_trip_serves_the_same_results(saved, shared):
+    original, documents, events, path = saved
+    loaded = RecipeRecommender(similar_k=5)
+    assert loaded.load_snapshot(path, shared=shared)
+    track(loaded, events)
+
+    assert (loaded.recipe_vectors != original.recipe_vectors).nnz == 0
+    for index in range(20):
+        expected = original.get_recommendations(f'user-{index}', 10)['recommendations']
+        found = loaded.get_recommendations(f'user-{index}', 10)['recommendations']
+        assert [item['id'] for item in found] == [item['id'] for item in expected]
+        assert [item['similarity'] for item in found] == pytest.approx([item['similarity'] for item in expected])
+    recipe_id = events[0][1]
+    assert loaded.get_similar_recipes(recipe_id, 5) == original.get_similar_recipes(recipe_id, 5)
+    assert loaded.catalog_fingerprint == catalog_fingerprint(doc['_id'] for doc in documents)
+
+
+def test_save_replaces_the_snapshot_whole(saved):
+    original, documents, _, path = saved
+    original.save_snapshot(path)
+    parent = os.path.dirname(path)
+    assert os.listdir(parent) == ['snapshot']
+    assert read_manifest(path)['recipe_count'] == len(documents)
+
+
+def test_other_feature_mode_is_not_loaded(saved):
+    path = saved[-1]
+    assert not RecipeRecommender(feature_mode='hashing').load_snapshot(path)
+
+
+def test_missing_snapshot_is_not_loaded(tmp_path):
+    assert not RecipeRecommender().load_snapshot(str(tmp_path / 'nothing'))
@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from features import create_index, create_vectorizer
+
+
+@pytest.fixture(scope='module')
+def texts(make_recipes):
+    return [' '.join(doc['Cleaned_Ingredients']) for doc in make_recipes(900, vocabulary_size=400)]
+
+
+def test_batches_match_fit_transform(texts):
+    expected_vectorizer = create_vectorizer()
+    expected = expected_vectorizer.fit_transform(texts)
+
+    vectorizer = create_vectorizer()
+    index = create_index(vectorizer)
+    for start in range(0, len(texts), 300):
+        index.add_documents(texts[start:start + 300])
+        # Weighting in between must not change the final result
+        index.finalize()
+    vectors = index.finalize()
+
+    assert list(index.feature_names) == list(expected_vectorizer.get_feature_names_out())
+    assert abs(vectors - expected).max() < 1e-12
+    np.testing.assert_allclose(vectorizer.idf_, expected_vectorizer.idf_)
+    # The wrapped vectorizer is fitted, so queries are weighted the same way
+    assert abs(vectorizer.transform(['rice garlic']) - expected_vectorizer.transform(['rice garlic'])).max() < 1e-12
+
+
+def test_hashing_index_matches_its_vectorizer(texts):
+    texts = texts[:300]
+    expected = create_vectorizer('hashing', hash_features=2 ** 12).fit_transform(texts)
+    index = create_index(create_vectorizer('hashing', hash_features=2 ** 12), 'hashing')
+    index.add_documents(texts[:100])
+    index.add_documents(texts[100:])
+    assert abs(index.finalize() - expected).max() < 1e-12
+
+
+def test_pruned_index_drops_rare_word_pairs_only():
+    texts = ['red onion', 'red onion', 'green onion']
+    index = create_index(create_vectorizer('pruned'), 'pruned', min_bigram_df=2)
+    index.add_documents(texts)
+    index.finalize()
+    assert list(index.feature_names) == ['green', 'onion', 'red', 'red onion']
@@ -0,0 +1,79 @@
+import multiprocessing
+import threading
+
+from user_profile import ProfileLimits
+from user_store import UserGenerations, create_user_store
+
+NO_DECAY = ProfileLimits(half_life=0)
+
+
+def test_tracking_survives_reopening(tmp_path):
+    path = str(tmp_path / 'users.db')
+    store = create_user_store('sqlite', path, limits=NO_DECAY)
+    for _ in range(3):
+        store.add('user', {'rice'}, 'recipe-1')
+    store.add('user', {'garlic'})
+    store.close()
+
+    reopened = create_user_store('sqlite', path, limits=NO_DECAY)
+    profile = reopened.get('user')
+    assert profile.weights == {'rice': 3.0, 'garlic': 1.0}
+    assert list(profile.seen) == ['recipe-1']
+    reopened.close()
+
+
+def test_reads_never_count_a_commit_twice(tmp_path):
+    # No cache, and a commit after every couple of users, so reads keep racing commits
+    store = create_user_store('sqlite', str(tmp_path / 'users.db'), limits=NO_DECAY,
+                              cache_users=0, batch_size=2, flush_interval=0.001)
+    tracked = 2000
+    done = threading.Event()
+    overcounts = []
+
+    def read():
+        while not done.is_set():
+            profile = store.get('user')
+            if profile is not None and profile.weights.get('rice', 0.0) > progress[0]:
+                overcounts.append(profile.weights['rice'])
+
+    progress = [0]
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    for index in range(tracked):
+        progress[0] = index + 1
+        store.add('user', {'rice'})
+        store.add(f'other-{index}', {'rice'})
+    done.set()
+    for reader in readers:
+        reader.join()
+    store.close()
+
+    assert not overcounts
+    assert store.get('user').weights['rice'] == tracked
+
+
+def test_tracking_in_one_worker_drops_what_another_cached(tmp_path, make_recipes, build_recommender):
+    # The parent and a forked child play two workers sharing the file and the change stamps
+    store = create_user_store('sqlite', str(tmp_path / 'users.db'), limits=NO_DECAY,
+                              generations=UserGenerations(slots=1024, shared=True))
+    documents = make_recipes(200)
+    recommender = build_recommender(documents, user_store=store)
+    store.add('user', {'rice'})
+    store.flush()
+    recommender.get_recommendations('user', 5)
+    assert recommender.get_recommendations('user', 5)['user_ingredients'] == ['rice']
+    assert recommender.recommendation_cache.hits == 1
+
+    def track():
+        recommender.track_user_behavior('user', documents[0]['_id'], ['walnuts'])
+        store.close()
+
+    worker = multiprocessing.get_context('fork').Process(target=track)
+    worker.start()
+    worker.join()
+    assert worker.exitcode == 0
+
+    assert 'walnuts' in recommender.get_recommendations('user', 5)['user_ingredients']
+    assert recommender.recommendation_cache.hits == 1
+    store.close()
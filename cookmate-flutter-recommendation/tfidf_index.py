@@ -0,0 +1,191 @@
+from collections import Counter
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.preprocessing import normalize
+
+
+def fit_idf(vectorizer, df, n_docs):
+    """IDF of each column from its document frequency, as TfidfVectorizer computes it"""
+    if vectorizer.smooth_idf:
+        return np.log((1 + n_docs) / (1 + df)) + 1
+    return np.log(n_docs / df) + 1
+
+
+def apply_tfidf(vectorizer, counts, idf):
+    """Weight a float CSR matrix of raw term counts like the vectorizer's transform; modifies it"""
+    if vectorizer.sublinear_tf:
+        np.log(counts.data, counts.data)
+        counts.data += 1.0
+    if vectorizer.use_idf:
+        counts.data *= idf[counts.indices]
+    if vectorizer.norm is not None:
+        counts = normalize(counts, norm=vectorizer.norm, copy=False)
+    return counts
+
+
+class IncrementalTfidfIndex:
+    """TF-IDF index that grows batch by batch without refitting the corpus.
+
+    Each batch is tokenized once with the vectorizer's own analyzer. Raw term
+    counts are appended as CSR rows and document frequencies are accumulated
+    as they arrive. IDF weighting happens in ``finalize``, which also fits the
+    wrapped vectorizer in place so it can keep vectorizing queries. The result
+    is the same matrix ``vectorizer.fit_transform`` would return for the whole
+    corpus.
+
+    With ``min_bigram_df`` above 1, ``finalize`` leaves out word pairs found
+    in fewer documents than that, from the matrix and from the fitted
+    vocabulary alike; single words are always kept. Counts of pruned pairs
+    are still kept, as later batches may bring them over the threshold.
+    """
+
+    def __init__(self, vectorizer, min_bigram_df=1):
+        self.vectorizer = vectorizer
+        self.min_bigram_df = min_bigram_df
+        self.analyzer = vectorizer.build_analyzer()
+        self.vocabulary = {}  # term -> id in order of first appearance
+        self.feature_names = None  # Alphabetical terms as of the last finalize
+        self.n_docs = 0
+        self._df = np.zeros(0, dtype=np.int64)
+        self._indices = []
+        self._counts = []
+        self._row_lengths = []
+        self._vectors = None
+        self._dirty = False
+
+    def add_documents(self, documents):
+        """Tokenize and append a batch of raw documents"""
+        return self.add_tokenized(self.analyzer(doc) for doc in documents)
+
+    def add_tokenized(self, token_lists):
+        """Append a batch of already tokenized documents"""
+        vocabulary = self.vocabulary
+        indices = []
+        counts = []
+        row_lengths = []
+        for tokens in token_lists:
+            term_counts = Counter(tokens)
+            for term, count in term_counts.items():
+                term_id = vocabulary.get(term)
+                if term_id is None:
+                    term_id = vocabulary[term] = len(vocabulary)
+                indices.append(term_id)
+                counts.append(count)
+            row_lengths.append(len(term_counts))
+
+        indices = np.asarray(indices, dtype=np.int32)
+        batch_df = np.bincount(indices, minlength=len(vocabulary))
+        batch_df[:len(self._df)] += self._df
+        self._df = batch_df
+
+        self._indices.append(indices)
+        self._counts.append(np.asarray(counts, dtype=np.int32))
+        self._row_lengths.append(np.asarray(row_lengths, dtype=np.int64))
+        self.n_docs += len(row_lengths)
+        self._dirty = True
+        return len(row_lengths)
+
+    @property
+    def dirty(self):
+        """True when documents were added since the last finalize"""
+        return self._dirty
+
+    def finalize(self):
+        """Weight the accumulated counts and return the TF-IDF matrix.
+
+        Terms are renumbered alphabetically, as ``TfidfVectorizer`` does,
+        and the wrapped vectorizer is fitted with the new vocabulary and IDF.
+        """
+        if not self._dirty:
+            return self._vectors
+
+        terms = sorted(self.vocabulary)
+        n_terms = len(terms)
+        order = np.fromiter((self.vocabulary[term] for term in terms), dtype=np.int64, count=n_terms)
+        remap = np.empty(n_terms, dtype=np.int32)
+        remap[order] = np.arange(n_terms, dtype=np.int32)
+
+        indptr = np.zeros(self.n_docs + 1, dtype=np.int64)
+        np.cumsum(np.concatenate(self._row_lengths), out=indptr[1:])
+        indices = np.concatenate(self._indices)
+        data = np.concatenate(self._counts).astype(np.float64)
+        # Like CountVectorizer: sort rows by first-seen term id, then renumber.
+        # Keeping that column order keeps the row norms bit-for-bit identical.
+        vectors = sp.csr_matrix((data, indices, indptr), shape=(self.n_docs, n_terms))
+        vectors.sort_indices()
+        vectors.indices = remap[vectors.indices]
+        vectors.has_sorted_indices = False
+
+        vectorizer = self.vectorizer
+        df = self._df[order]
+        if self.min_bigram_df > 1:
+            # Word n-grams are joined with spaces, single words never contain one
+            kept = (df >= self.min_bigram_df) | np.fromiter(
+                (' ' not in term for term in terms), dtype=bool, count=n_terms)
+            if not kept.all():
+                vectors = vectors[:, np.flatnonzero(kept)]
+                terms = [term for term, keep in zip(terms, kept) if keep]
+                n_terms = len(terms)
+                df = df[kept]
+        idf = fit_idf(vectorizer, df, self.n_docs)
+        vectors = apply_tfidf(vectorizer, vectors, idf)
+
+        vectorizer.vocabulary_ = dict(zip(terms, range(n_terms)))
+        if vectorizer.use_idf:
+            vectorizer.idf_ = idf
+
+        self.feature_names = np.asarray(terms, dtype=object)
+        self._vectors = vectors
+        self._dirty = False
+        return vectors
+
+
+class HashingTfidfIndex:
+    """TF-IDF index over a fixed number of hashed columns.
+
+    Terms are hashed straight into their final column, so batches need no
+    vocabulary and no renumbering: ``finalize`` only stacks the counts and
+    weights them with the IDF of each column. Same interface as
+    IncrementalTfidfIndex; ``feature_names`` stays None.
+    """
+
+    def __init__(self, vectorizer):
+        self.vectorizer = vectorizer
+        self.analyzer = vectorizer.build_analyzer()
+        self.feature_names = None
+        self.n_docs = 0
+        self._df = np.zeros(vectorizer.n_features, dtype=np.int64)
+        self._counts = []
+        self._vectors = None
+        self._dirty = False
+
+    def add_documents(self, documents):
+        """Tokenize and append a batch of raw documents"""
+        return self.add_tokenized(self.analyzer(doc) for doc in documents)
+
+    def add_tokenized(self, token_lists):
+        """Append a batch of already tokenized documents"""
+        counts = self.vectorizer.count_tokens(token_lists)
+        self._df += np.bincount(counts.indices, minlength=len(self._df))
+        self._counts.append(counts)
+        self.n_docs += counts.shape[0]
+        self._dirty = True
+        return counts.shape[0]
+
+    @property
+    def dirty(self):
+        """True when documents were added since the last finalize"""
+        return self._dirty
+
+    def finalize(self):
+        """Weight the accumulated counts, fit the vectorizer's IDF and return the TF-IDF matrix"""
+        if not self._dirty:
+            return self._vectors
+        if len(self._counts) > 1:
+            self._counts = [sp.vstack(self._counts, format='csr')]
+        idf = fit_idf(self.vectorizer, self._df, self.n_docs)
+        self._vectors = apply_tfidf(self.vectorizer, self._counts[0].copy(), idf)
+        self.vectorizer.idf_ = idf
+        self._dirty = False
+        return self._vectors
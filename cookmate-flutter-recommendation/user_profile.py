@@ -0,0 +1,108 @@
+import heapq
+import json
+
+DEFAULT_HALF_LIFE = 30 * 24 * 3600  # Seconds for a tracked ingredient's weight to halve
+DEFAULT_MAX_INGREDIENTS = 50
+DEFAULT_MAX_SEEN = 200
+MIN_WEIGHT = 0.01  # Ingredients decayed below this are forgotten
+
+
+class ProfileLimits:
+    """How fast profiles forget and how big they may get"""
+
+    __slots__ = ('half_life', 'max_ingredients', 'max_seen')
+
+    def __init__(self, half_life=DEFAULT_HALF_LIFE, max_ingredients=DEFAULT_MAX_INGREDIENTS,
+                 max_seen=DEFAULT_MAX_SEEN):
+        self.half_life = half_life  # 0 or None turns decay off
+        self.max_ingredients = max_ingredients
+        self.max_seen = max_seen
+
+    def decay(self, elapsed):
+        """Factor a weight shrinks by over ``elapsed`` seconds"""
+        if not self.half_life or elapsed <= 0:
+            return 1.0
+        return 0.5 ** (elapsed / self.half_life)
+
+
+class UserProfile:
+    """Decayed ingredient weights and recently seen recipes of one user.
+
+    ``weights`` are as of ``updated_at`` (epoch seconds); tracking an
+    ingredient adds 1 to its weight and every weight halves each
+    ``half_life`` seconds. At most ``max_ingredients`` ingredients (the
+    heaviest) and the ``max_seen`` most recent recipe ids are kept, so a
+    profile stays the same size however long the user's history gets.
+    ``seen`` maps recipe ids to when they were last tracked, oldest first.
+    """
+
+    __slots__ = ('weights', 'updated_at', 'seen')
+
+    def __init__(self, weights=None, updated_at=0.0, seen=None):
+        self.weights = weights if weights is not None else {}
+        self.updated_at = updated_at
+        self.seen = seen if seen is not None else {}
+
+    def track(self, ingredients, recipe_id, now, limits):
+        """Count one use of each ingredient, and of the recipe if given"""
+        self._decay_to(now, limits)
+        weights = self.weights
+        for ingredient in ingredients:
+            weights[ingredient] = weights.get(ingredient, 0.0) + 1.0
+        if recipe_id is not None:
+            self.seen.pop(recipe_id, None)
+            self.seen[recipe_id] = now
+        self._prune(limits)
+
+    def merge(self, other, limits):
+        """Add another profile's weights and seen recipes into this one"""
+        now = max(self.updated_at, other.updated_at)
+        self._decay_to(now, limits)
+        factor = limits.decay(now - other.updated_at)
+        weights = self.weights
+        for ingredient, weight in other.weights.items():
+            weights[ingredient] = weights.get(ingredient, 0.0) + weight * factor
+        if other.seen:
+            seen = dict(self.seen)
+            for recipe_id, seen_at in other.seen.items():
+                if seen.get(recipe_id, -1.0) < seen_at:
+                    seen[recipe_id] = seen_at
+            self.seen = dict(sorted(seen.items(), key=lambda item: item[1]))
+        self._prune(limits)
+
+    def weights_at(self, now, limits):
+        """Ingredient weights decayed to ``now``"""
+        factor = limits.decay(now - self.updated_at)
+        return {ingredient: weight * factor for ingredient, weight in self.weights.items()}
+
+    @property
+    def ingredients(self):
+        """Tracked ingredients, heaviest first"""
+        return sorted(self.weights, key=self.weights.get, reverse=True)
+
+    def copy(self):
+        return UserProfile(dict(self.weights), self.updated_at, dict(self.seen))
+
+    def _decay_to(self, now, limits):
+        factor = limits.decay(now - self.updated_at)
+        if factor != 1.0:
+            for ingredient in self.weights:
+                self.weights[ingredient] *= factor
+        self.updated_at = max(self.updated_at, now)
+
+    def _prune(self, limits):
+        weights = self.weights
+        if len(weights) > limits.max_ingredients:
+            weights = dict(heapq.nlargest(limits.max_ingredients, weights.items(), key=lambda item: item[1]))
+        self.weights = {ingredient: weight for ingredient, weight in weights.items() if weight >= MIN_WEIGHT}
+        while len(self.seen) > limits.max_seen:
+            del self.seen[next(iter(self.seen))]
+
+    def to_json(self):
+        return json.dumps({'t': self.updated_at, 'w': self.weights, 's': list(self.seen.items())},
+                          separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, text):
+        data = json.loads(text)
+        return cls(data['w'], data['t'], dict(data['s']))
@@ -0,0 +1,408 @@
+import itertools
+import logging
+import mmap
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+from user_profile import UserProfile, ProfileLimits
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_USERS = 100000
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_FLUSH_INTERVAL = 0.5
+DEFAULT_CACHE_TTL = 30
+MAX_PENDING_FACTOR = 10  # add() commits inline once this many batches are waiting
+SQLITE_MAX_PARAMS = 500  # Ids per IN (...) lookup
+DEFAULT_GENERATION_SLOTS = 2 ** 20  # 8 MB of stamps; users sharing a slot just invalidate each other
+
+
+class UserGenerations:
+    """A stamp per user that changes whenever the user's profile does.
+
+    Users are hashed into ``slots`` 64-bit stamps, so memory stays fixed
+    however many users there are; two users sharing a slot only make each
+    other's cached results look stale. With ``shared=True`` the stamps live
+    in anonymous shared memory created before the pre-fork workers are, so
+    a profile tracked by one worker invalidates what every worker cached
+    from it. A bump writes a value unique to the process and call rather
+    than adding one, so two workers bumping a slot at once still change it.
+    """
+
+    def __init__(self, slots=DEFAULT_GENERATION_SLOTS, shared=False):
+        self.slots = slots
+        if shared:
+            # MAP_SHARED anonymous memory: forked children write to the same pages
+            self._buffer = mmap.mmap(-1, slots * 8)
+            self._stamps = np.frombuffer(self._buffer, dtype=np.int64)
+        else:
+            self._stamps = np.zeros(slots, dtype=np.int64)
+        self._pid = None
+        self._counter = None
+
+    def _slot(self, user_id):
+        return zlib.crc32(str(user_id).encode('utf-8')) % self.slots
+
+    def get(self, user_id):
+        return int(self._stamps[self._slot(user_id)])
+
+    def bump(self, user_id):
+        """Give the user a new stamp and return it"""
+        if self._pid != os.getpid():
+            # Counting restarts in each process; the pid keeps the stamps apart
+            self._pid = os.getpid()
+            self._counter = itertools.count(1)
+        stamp = (self._pid << 32) | next(self._counter)
+        self._stamps[self._slot(user_id)] = stamp
+        return stamp
+
+
+class MemoryUserStore:
+    """Tracked profiles per user, held in this process only.
+
+    Every store maps a user id to a UserProfile. ``add`` tracks one use of
+    some ingredients and optionally a recipe and tells whether the profile
+    changed, ``get`` returns a user's profile (None for unknown users) and
+    ``get_many`` does the same for several users at once. Profiles handed
+    out are copies, so callers can read them while other threads track.
+    ``tracked_recipes`` lists the recipes profiles remember being tracked.
+    ``generation`` is a stamp that changes with the user's profile (see
+    UserGenerations), for caches of results computed from it.
+    """
+
+    def __init__(self, limits=None, generations=None):
+        self.limits = limits or ProfileLimits()
+        self.generations = generations if generations is not None else UserGenerations()
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def add(self, user_id, ingredients, recipe_id=None):
+        """Track ingredients (and a recipe) for a user; returns True if the profile changed"""
+        with self._lock:
+            profile = self._users.get(user_id)
+            if profile is None:
+                profile = self._users[user_id] = UserProfile()
+            elif not ingredients and recipe_id is None:
+                return False
+            profile.track(ingredients, recipe_id, time.time(), self.limits)
+            self.generations.bump(user_id)
+            return True
+
+    def get(self, user_id):
+        with self._lock:
+            profile = self._users.get(user_id)
+            return None if profile is None else profile.copy()
+
+    def generation(self, user_id):
+        return self.generations.get(user_id)
+
+    def get_many(self, user_ids):
+        return {user_id: self.get(user_id) for user_id in user_ids}
+
+    def tracked_recipes(self):
+        """(recipe_id, tracked_at) of every recipe each profile last tracked"""
+        with self._lock:
+            return [pair for profile in self._users.values() for pair in profile.seen.items()]
+
+    def __contains__(self, user_id):
+        with self._lock:
+            return user_id in self._users
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def stats(self):
+        with self._lock:
+            return {'backend': 'memory', 'users': len(self._users)}
+
+
+class SqliteUserStore:
+    """Tracked profiles per user in an SQLite file, shared by every process using it.
+
+    ``add`` only updates a hot-user LRU and a per-user delta profile; a
+    writer thread commits the deltas in one transaction every
+    ``flush_interval`` seconds or once ``batch_size`` users have changed,
+    merging each into the stored profile so that writes from other worker
+    processes add up instead of overwriting each other. If the writer falls
+    far behind, ``add`` commits inline instead of letting the queue grow.
+    Reads come from the LRU, falling back to the file plus the deltas not
+    yet committed. At most ``cache_users`` users are cached. Tracking bumps
+    the user's stamp in ``generations`` and so does committing it; a cached
+    profile is re-read once its stamp changed, which with shared stamps
+    makes writes from other workers show up as soon as they are committed,
+    and after ``cache_ttl`` seconds in any case, for writers that do not
+    share them. The connection and writer are opened lazily per process,
+    so a store created before forking works in every worker.
+    """
+
+    def __init__(self, path, limits=None, cache_users=DEFAULT_CACHE_USERS, batch_size=DEFAULT_BATCH_SIZE,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL, cache_ttl=DEFAULT_CACHE_TTL, generations=None):
+        self.path = path
+        self.limits = limits or ProfileLimits()
+        self.generations = generations if generations is not None else UserGenerations()
+        self.cache_users = cache_users
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.cache_ttl = cache_ttl
+        self._hot = OrderedDict()  # user_id -> (read_at, generation, UserProfile)
+        self._pending = {}  # user_id -> UserProfile of what was tracked since the last commit
+        self._committing = {}  # The deltas the writer is committing right now
+        self._commits = 0  # Bumped after every commit, so readers can detect one they raced
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()  # One commit at a time
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._local = threading.local()
+        self._pid = None
+        self.hits = 0
+        self.misses = 0
+        self.committed = 0
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # A forked child starts over: its parent's connections and thread are not its own
+            self._local = threading.local()
+            self._hot.clear()
+            self._pending.clear()
+            self._committing = {}
+            self._stop.clear()
+            self._create_table()
+            self._writer = threading.Thread(target=self._run, name='user-store-writer', daemon=True)
+            self._writer.start()
+            self._pid = os.getpid()
+
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')  # Readers never wait for the writer
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def _create_table(self):
+        connection = self._connection()
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS user_profiles ('
+            'user_id TEXT PRIMARY KEY, profile TEXT NOT NULL) WITHOUT ROWID'
+        )
+        self._migrate_ingredient_pairs(connection)
+
+    def _migrate_ingredient_pairs(self, connection):
+        """Turn a file of unweighted (user, ingredient) pairs into profiles"""
+        found = connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'user_ingredients'"
+        ).fetchone()
+        if found is None:
+            return
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            profiles = {}
+            now = time.time()
+            for user_id, ingredient in connection.execute('SELECT user_id, ingredient FROM user_ingredients'):
+                profile = profiles.setdefault(user_id, UserProfile(updated_at=now))
+                if ingredient:
+                    profile.weights[ingredient] = 1.0
+            for profile in profiles.values():
+                profile.track((), None, now, self.limits)  # Applies the size cap
+            connection.executemany(
+                'INSERT OR IGNORE INTO user_profiles VALUES (?, ?)',
+                [(user_id, profile.to_json()) for user_id, profile in profiles.items()]
+            )
+            connection.execute('DROP TABLE user_ingredients')
+            connection.execute('COMMIT')
+            logger.info(f"Converted the tracked ingredients of {len(profiles)} users into profiles")
+        except sqlite3.Error:
+            connection.execute('ROLLBACK')
+            raise
+
+    def add(self, user_id, ingredients, recipe_id=None):
+        """Track ingredients (and a recipe) for a user; returns True if the profile changed"""
+        self._ensure_started()
+        is_new_user = self.get(user_id) is None
+        if not ingredients and recipe_id is None and not is_new_user:
+            return False
+        now = time.time()
+        with self._lock:
+            self._pending.setdefault(user_id, UserProfile(updated_at=now)).track(
+                ingredients, recipe_id, now, self.limits)
+            generation = self.generations.bump(user_id)
+            entry = self._hot.get(user_id)
+            if entry is not None:
+                entry[2].track(ingredients, recipe_id, now, self.limits)
+                self._hot[user_id] = (entry[0], generation, entry[2])
+            backlog = len(self._pending)
+        if backlog >= self.batch_size * MAX_PENDING_FACTOR:
+            self.flush()
+        elif backlog >= self.batch_size:
+            self._wake.set()
+        return True
+
+    def get(self, user_id):
+        self._ensure_started()
+        with self._lock:
+            entry = self._hot.get(user_id)
+            if (entry is not None and time.monotonic() - entry[0] < self.cache_ttl
+                    and entry[1] == self.generations.get(user_id)):
+                self._hot.move_to_end(user_id)
+                self.hits += 1
+                return entry[2].copy()
+            self.misses += 1
+        while True:
+            # A commit swaps the file's rows and _committing under the lock in one
+            # step; one that lands between here and the lock below is retried.
+            # The stamp is read first, so a write landing after the read bumps it.
+            commits = self._commits
+            generation = self.generations.get(user_id)
+            row = self._connection().execute(
+                'SELECT profile FROM user_profiles WHERE user_id = ?', (user_id,)
+            ).fetchone()
+            with self._lock:
+                if commits != self._commits:
+                    continue  # A commit landed mid-read; its deltas may be in neither place
+                queued = self._pending.get(user_id)
+                in_flight = self._committing.get(user_id)
+                if row is None and queued is None and in_flight is None:
+                    return None
+                profile = UserProfile.from_json(row[0]) if row is not None else UserProfile()
+                for delta in (in_flight, queued):
+                    if delta is not None:
+                        profile.merge(delta, self.limits)
+                self._remember(user_id, generation, profile)
+                return profile.copy()
+
+    def get_many(self, user_ids):
+        return {user_id: self.get(user_id) for user_id in user_ids}
+
+    def tracked_recipes(self):
+        """(recipe_id, tracked_at) of every recipe each committed profile last tracked.
+
+        Reads the whole file, a profile at a time; meant for start-up.
+        """
+        self._ensure_started()
+        for (text,) in self._connection().execute('SELECT profile FROM user_profiles'):
+            yield from UserProfile.from_json(text).seen.items()
+
+    def generation(self, user_id):
+        return self.generations.get(user_id)
+
+    def __contains__(self, user_id):
+        return self.get(user_id) is not None
+
+    def _remember(self, user_id, generation, profile):
+        if self.cache_users <= 0:
+            return
+        self._hot[user_id] = (time.monotonic(), generation, profile)
+        self._hot.move_to_end(user_id)
+        while len(self._hot) > self.cache_users:
+            self._hot.popitem(last=False)
+
+    def flush(self):
+        """Commit every queued delta now"""
+        self._ensure_started()
+        with self._write_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                self._committing, self._pending = self._pending, {}
+            deltas = self._committing
+            user_ids = list(deltas)
+            connection = self._connection()
+            try:
+                # Read, merge and write in one write transaction so that other
+                # processes cannot commit between the read and the write
+                connection.execute('BEGIN IMMEDIATE')
+                stored = {}
+                for start in range(0, len(user_ids), SQLITE_MAX_PARAMS):
+                    chunk = user_ids[start:start + SQLITE_MAX_PARAMS]
+                    placeholders = ','.join('?' * len(chunk))
+                    stored.update(connection.execute(
+                        f'SELECT user_id, profile FROM user_profiles WHERE user_id IN ({placeholders})', chunk
+                    ))
+                rows = []
+                for user_id, delta in deltas.items():
+                    profile = UserProfile.from_json(stored[user_id]) if user_id in stored else UserProfile()
+                    profile.merge(delta, self.limits)
+                    rows.append((user_id, profile.to_json()))
+                connection.executemany('INSERT OR REPLACE INTO user_profiles VALUES (?, ?)', rows)
+                # Readers merge _committing over what they read from the file, so the
+                # rows must become visible and the deltas leave _committing together
+                with self._lock:
+                    connection.execute('COMMIT')
+                    self._committing = {}
+                    self._commits += 1
+                    self.committed += len(rows)
+                    # Other workers re-read these users; this one's cached profiles are current
+                    for user_id in user_ids:
+                        generation = self.generations.bump(user_id)
+                        entry = self._hot.get(user_id)
+                        if entry is not None:
+                            self._hot[user_id] = (entry[0], generation, entry[2])
+            except sqlite3.Error:
+                if connection.in_transaction:
+                    connection.execute('ROLLBACK')
+                with self._lock:
+                    # Keep the deltas for the next attempt
+                    for user_id, delta in deltas.items():
+                        queued = self._pending.get(user_id)
+                        if queued is not None:
+                            delta.merge(queued, self.limits)
+                        self._pending[user_id] = delta
+                    self._committing = {}
+                raise
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Error committing tracked profiles: {str(e)}")
+
+    def close(self):
+        """Commit what is queued and stop the writer"""
+        if self._pid != os.getpid():
+            return
+        self._stop.set()
+        self._wake.set()
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'backend': 'sqlite',
+                'cached_users': len(self._hot),
+                'max_cached_users': self.cache_users,
+                'pending_users': len(self._pending),
+                'committed': self.committed,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
+
+
+def create_user_store(backend='memory', path='user_preferences.db', limits=None, generations=None, **options):
+    """Build the store named by ``backend``: 'memory' or 'sqlite'.
+
+    ``limits`` bound every profile and ``generations`` holds the users'
+    change stamps (private to the store when not given); ``options`` tune
+    the SQLite store and are ignored by the in-memory one.
+    """
+    if backend == 'memory':
+        return MemoryUserStore(limits, generations)
+    if backend == 'sqlite':
+        return SqliteUserStore(path, limits, generations=generations, **options)
+    raise ValueError(f"Unknown user store backend: {backend}")
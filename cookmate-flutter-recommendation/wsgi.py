@@ -0,0 +1,5 @@
+# WSGI entry point for servers run from the outside, one process with threads:
+#   waitress-serve --port 5002 --threads 24 wsgi:application
+from app import create_app
+
+application = create_app()